@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+from pydantic import BaseModel, Field
+from typing import List, Optional
+
+# 批量导入用户
+class BulkImportError(BaseModel):
+    line: int = Field(description="NDJSON 行号 (从 1 开始)")
+    account: Optional[str] = None
+    error: str
+
+class BulkImportReport(BaseModel):
+    total: int = Field(description="非空行数")
+    imported: int
+    failed: int
+    errors: List[BulkImportError] = []
+    errors_truncated: bool = Field(False, description="错误过多时只返回前 N 条")
+    elapsed_seconds: float
+    rows_per_second: float
+    hash_seconds: float
+    write_seconds: float
@@ -11,6 +11,8 @@ class ChatContext(BaseModel):
 
 class ChatRequest(BaseModel):
     message: str
+    # 会话模式: 传 session_id 时上下文由服务端保存 (忽略 context)，否则沿用客户端回传 context 的旧模式
+    session_id: Optional[str] = None
     context: ChatContext = Field(default_factory=ChatContext)
 
 class CandidateDTO(BaseModel):
@@ -27,5 +29,9 @@ class ChatResponse(BaseModel):
     reply: str
     intent: str
     final_candidates: List[CandidateDTO] = []
-    new_context: ChatContext
+    session_id: Optional[str] = None
+    new_context: Optional[ChatContext] = None # 会话模式下为空 (上下文保存在服务端)
     debug_info: dict
+
+class SessionCreateResponse(BaseModel):
+    session_id: str
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+import hmac
+from typing import Optional
+from fastapi import APIRouter, HTTPException, Depends, Header, Request
+from app.api.schemas.admin_dto import BulkImportReport
+from app.core.container import container
+from app.core.utils.env_utils import ADMIN_API_KEY
+from app.services.bulk_import import aiter_lines
+
+# 依赖注入：校验管理密钥 (未配置 ADMIN_API_KEY 时管理接口整体关闭)
+async def require_admin(x_admin_key: Optional[str] = Header(None)):
+    if not ADMIN_API_KEY or not x_admin_key or not hmac.compare_digest(x_admin_key, ADMIN_API_KEY):
+        raise HTTPException(status_code=403, detail="无权访问管理接口")
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.post("/users/import", response_model=BulkImportReport)
+async def import_users(request: Request):
+    """
+    批量导入用户
+    请求体为 NDJSON (Content-Type: application/x-ndjson)，边接收边解析写入，逐行错误在报告中返回。
+    """
+    return await container.bulk_importer.run(aiter_lines(request.stream()))
+
+@router.get("/metrics")
+async def get_metrics():
+    """运行时指标 (准入控制 / 幂等缓存 / bcrypt 线程池 / 检索策略 / Onboarding 终止判断路径)"""
+    hasher = container.password_hasher
+    return {
+        "admission": container.admission.snapshot(),
+        "idempotency": container.idempotency.snapshot(),
+        "password_hasher": {**hasher.stats, "pending": hasher.pending, "max_pending": hasher.max_pending},
+        "retrieval_planner": container.retrieval_planner.snapshot(),
+        "termination": dict(container.termination_manager.stats),
+    }
@@ -3,22 +3,26 @@ from fastapi import APIRouter, HTTPException, Depends
 from fastapi.security import OAuth2PasswordBearer
 from app.api.schemas.auth_dto import LoginRequest, Token
 from app.core.container import container # 引入容器
-from app.core.security import verify_password, create_access_token, decode_access_token
+from app.core.security import create_access_token, decode_access_token, PasswordHasherBusy
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
 @router.post("/login", response_model=Token)
 async def login(request: LoginRequest):
-    db = container.db # 从容器获取
+    db = container.async_db # 从容器获取 (异步)
     
     # 1. 查用户
-    user = db.get_auth_user_by_account(request.username)
+    user = await db.get_auth_user_by_account(request.username)
     if not user:
         raise HTTPException(status_code=401, detail="账号或密码错误")
         
-    # 2. 验密码
-    if not verify_password(request.password, user["password_hash"]):
+    # 2. 验密码 (bcrypt 在线程池执行，不阻塞事件循环)
+    try:
+        ok = await container.password_hasher.verify(request.password, user["password_hash"])
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="登录请求过多，请稍后重试", headers={"Retry-After": "1"})
+    if not ok:
         raise HTTPException(status_code=401, detail="账号或密码错误")
         
     # 3. 发 Token (sub 存 user_id)
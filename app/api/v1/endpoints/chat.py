@@ -1,12 +1,17 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import json
-from fastapi import APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect, Query, status
+from collections import deque
+from typing import List, Optional
+from fastapi import APIRouter, HTTPException, Depends, WebSocket, WebSocketDisconnect, Query, Header, Request, Response, status
 from bson import ObjectId
 
-from app.api.schemas.chat_dto import ChatRequest, ChatResponse, CandidateDTO, ChatContext
+from app.api.schemas.chat_dto import ChatRequest, ChatResponse, CandidateDTO, ChatContext, SessionCreateResponse
 from app.api.v1.endpoints.auth import get_current_user_id
 from app.core.container import container # 引入容器
 from app.core.security import decode_access_token
+from app.services.admission import AdmissionRejected
+from app.services.idempotency import build_request_key
 
 router = APIRouter()
 
@@ -21,6 +26,169 @@ def serialize_mongo_obj(obj):
         return [serialize_mongo_obj(i) for i in obj]
     return obj
 
+def to_candidate_dto(c: dict) -> CandidateDTO:
+    """State 中的候选人 dict -> 前端卡片 DTO"""
+    return CandidateDTO(
+        id=c.get('id', ''),
+        nickname=c.get('nickname', '未知'),
+        gender=c.get('gender', 'unknown'),
+        age=c.get('age', 0),
+        city=c.get('city', ''),
+        summary=c.get('summary', ''),
+        evidence=c.get('evidence', '')
+    )
+
+# 会产出新一批候选人的意图 (其余意图沿用上一轮的候选人)
+SEARCH_INTENTS = ("search_candidate", "refresh_candidate")
+
+@router.post("/sessions", response_model=SessionCreateResponse)
+async def create_chat_session(user_id: str = Depends(get_current_user_id)):
+    """创建服务端会话，之后的 /message 只需携带 session_id"""
+    session_id = await container.session_service.acreate_session(user_id)
+    return SessionCreateResponse(session_id=session_id)
+
+@router.get("/sessions/{session_id}/candidates", response_model=List[CandidateDTO])
+async def get_session_candidates(session_id: str, user_id: str = Depends(get_current_user_id)):
+    """按需回查会话中最近一批候选人的卡片数据"""
+    ctx = await container.session_service.aget_context(session_id, user_id, history_limit=0)
+    if ctx is None:
+        raise HTTPException(status_code=404, detail="会话不存在")
+    cards = await container.session_service.arehydrate_candidates(ctx["final_candidates"])
+    return [CandidateDTO(**c) for c in cards]
+
+# --- WebSocket Streaming ---
+
+# 产出最终回复的节点：只转发这些节点里 LLM 的 Token (中间的分类/提取调用不下发)
+REPLY_NODES = {"onboarding", "chitchat", "response", "deep_dive"}
+WS_SEND_QUEUE_SIZE = 64   # 待发送帧的上限，队列满时暂停消费图的输出 (反压)
+WS_SEND_TIMEOUT = 30.0    # 单帧发送超时，客户端长期不读则断开
+_STREAM_END = object()
+
+async def _ws_sender(websocket: WebSocket, queue: asyncio.Queue):
+    """从队列取帧发送；客户端读得慢时，排队中的连续 Token 合并为一帧"""
+    pending = None
+    while True:
+        frame = pending if pending is not None else await queue.get()
+        pending = None
+        if frame is _STREAM_END:
+            return
+        if frame["type"] == "token":
+            parts = [frame["content"]]
+            while not queue.empty():
+                nxt = queue.get_nowait()
+                if nxt is _STREAM_END or nxt["type"] != "token":
+                    pending = nxt
+                    break
+                parts.append(nxt["content"])
+            frame = {"type": "token", "content": "".join(parts)}
+        await asyncio.wait_for(websocket.send_json(frame), timeout=WS_SEND_TIMEOUT)
+
+async def _produce_graph_stream(app, initial_state: dict, queue: asyncio.Queue) -> dict:
+    """
+    消费 `astream(stream_mode=["messages", "updates"])`：
+    - messages: 回复节点的 LLM Token -> token 帧；
+    - updates:  每个节点的增量合并为最终 State (确定性)，并下发一个轻量的 node 进度帧。
+    """
+    final_state = dict(initial_state)
+    async for mode, chunk in app.astream(initial_state, stream_mode=["messages", "updates"]):
+        if mode == "messages":
+            message, metadata = chunk
+            content = getattr(message, "content", "")
+            if content and isinstance(content, str) and metadata.get("langgraph_node") in REPLY_NODES:
+                await queue.put({"type": "token", "content": content})
+        elif mode == "updates":
+            for node, delta in chunk.items():
+                if isinstance(delta, dict):
+                    # messages 字段带 reducer 且不需要下发，跳过
+                    final_state.update({k: v for k, v in delta.items() if k != "messages"})
+                await queue.put({"type": "node", "node": node})
+    return final_state
+
+async def _cancel_and_wait(task: asyncio.Task):
+    """取消任务并等待其真正结束 (finally / 回滚逻辑执行完毕)"""
+    if task.done():
+        return
+    task.cancel()
+    try:
+        await task
+    except BaseException:
+        pass
+
+async def stream_graph_to_websocket(websocket: WebSocket, app, initial_state: dict) -> dict:
+    """运行图并通过有界队列把输出推给客户端，返回最终 State"""
+    queue: asyncio.Queue = asyncio.Queue(maxsize=WS_SEND_QUEUE_SIZE)
+    sender = asyncio.create_task(_ws_sender(websocket, queue))
+    producer = asyncio.create_task(_produce_graph_stream(app, initial_state, queue))
+    try:
+        done, _ = await asyncio.wait({sender, producer}, return_when=asyncio.FIRST_COMPLETED)
+        if sender in done:
+            # 发送端先结束只可能是出错 (断开 / 超时)：停止执行图
+            await _cancel_and_wait(producer)
+            sender.result() # 抛出发送端的异常
+        final_state = producer.result()
+        await queue.put(_STREAM_END)
+        await sender
+        return final_state
+    finally:
+        # 出错或自身被取消时，两个子任务都不能遗留
+        await _cancel_and_wait(producer)
+        await _cancel_and_wait(sender)
+
+async def _watch_ws_client(websocket: WebSocket, pending: deque) -> str:
+    """
+    图运行期间继续读取客户端: 断开返回 "disconnect"，收到 {"type": "cancel"} 返回 "cancel"，
+    其他消息缓存到 `pending`，本轮结束后按顺序处理。
+    """
+    while True:
+        message = await websocket.receive()
+        if message["type"] == "websocket.disconnect":
+            return "disconnect"
+        text = message.get("text")
+        if text is None:
+            continue
+        try:
+            frame = json.loads(text)
+        except json.JSONDecodeError:
+            frame = None
+        if isinstance(frame, dict) and frame.get("type") == "cancel":
+            return "cancel"
+        pending.append(text)
+
+async def run_ws_turn(websocket: WebSocket, turn, pending: deque):
+    """执行一轮对话 (协程 `turn`)，客户端断开或主动取消时中断图运行；被取消时返回 None"""
+    run = asyncio.ensure_future(turn)
+    watcher = asyncio.ensure_future(_watch_ws_client(websocket, pending))
+    try:
+        done, _ = await asyncio.wait({run, watcher}, return_when=asyncio.FIRST_COMPLETED)
+        if run in done:
+            return run.result()
+        await _cancel_and_wait(run)
+        if watcher.result() == "disconnect":
+            print(f"✂️ [WS] 客户端断开，已取消进行中的图运行")
+            raise WebSocketDisconnect(code=status.WS_1001_GOING_AWAY)
+        return None
+    finally:
+        await _cancel_and_wait(watcher)
+        await _cancel_and_wait(run)
+
+DISCONNECT_POLL_SECONDS = 0.5 # HTTP 请求的断开检测间隔
+
+async def run_until_http_disconnect(http_request: Request, coro):
+    """执行 `coro`，期间轮询客户端连接，断开时取消执行 (取消沿 Task 传播到图节点和异步 LLM 调用)"""
+    task = asyncio.ensure_future(coro)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=DISCONNECT_POLL_SECONDS)
+            if done:
+                return task.result()
+            if await http_request.is_disconnected():
+                await _cancel_and_wait(task)
+                print(f"✂️ [HTTP] 客户端断开，已取消进行中的请求")
+                # 499: Client Closed Request (响应已无人接收，仅用于日志)
+                raise HTTPException(status_code=499, detail="客户端已断开")
+    finally:
+        await _cancel_and_wait(task)
+
 @router.websocket("/ws")
 async def websocket_endpoint(
     websocket: WebSocket,
@@ -39,22 +207,28 @@ async def websocket_endpoint(
     user_id = payload.get("sub")
     await websocket.accept()
     
+    pending_frames: deque = deque() # 图运行期间收到的后续消息
     try:
         while True:
             # 2. 接收消息
-            data = await websocket.receive_text()
+            data = pending_frames.popleft() if pending_frames else await websocket.receive_text()
             try:
                 request_data = json.loads(data)
                 # 兼容直接发送字符串或完整 JSON 对象
                 if isinstance(request_data, str):
                     current_msg = request_data
                     ctx_dict = {} # 默认空上下文
+                    session_id = None
                 else:
+                    if request_data.get("type") == "cancel":
+                        continue # 没有进行中的运行，忽略迟到的取消
                     current_msg = request_data.get("message", "")
                     ctx_dict = request_data.get("context", {})
+                    session_id = request_data.get("session_id")
             except json.JSONDecodeError:
                 current_msg = data
                 ctx_dict = {}
+                session_id = None
 
             # 3. 构造 Context 对象 (简单处理，容错)
             # 注意: 这里尽量模拟 ChatRequest 的结构，但允许部分缺失
@@ -69,54 +243,49 @@ async def websocket_endpoint(
                 "last_target_person": ctx_dict.get("last_target_person"),
                 "last_search_criteria": ctx_dict.get("last_search_criteria")
             }
+            if session_id:
+                # 会话模式: 上下文从服务端读取
+                session_ctx = await container.session_service.aget_context(session_id, user_id)
+                if session_ctx is None:
+                    await websocket.send_json({"type": "error", "content": "会话不存在"})
+                    continue
+                initial_state.update(session_ctx)
             
-            # 4. 流式执行 LangGraph
+            # 4. 流式执行 LangGraph (只转发回复 Token 与节点进度，慢客户端时反压)
             app = container.recommendation_app
-            
-            final_output = None
-            
-            # 这里的 config 可以传 run_name 等
-            async for event in app.astream_events(initial_state, version="v1"):
-                kind = event["event"]
-                
-                # 捕获 LLM 的流式输出 (Token)
-                if kind == "on_chat_model_stream":
-                    chunk = event["data"]["chunk"]
-                    if chunk.content:
-                        await websocket.send_json({
-                            "type": "token",
-                            "content": chunk.content
-                        })
-                
-                # 捕获链结束，尝试提取最终状态
-                elif kind == "on_chain_end":
-                    output = event["data"].get("output")
-                    if isinstance(output, dict):
-                        # 简单的启发式判断：如果包含 reply 且包含 user_id，很可能是最终状态
-                        # 或者判断 key 是否覆盖了我们关心的字段
-                        if "reply" in output and "intent" in output:
-                            final_output = output
+            async def admitted_turn():
+                async with container.admission.admit(user_id):
+                    return await stream_graph_to_websocket(websocket, app, initial_state)
+
+            try:
+                # 客户端断开或发送 {"type": "cancel"} 时取消图运行 (断开时抛出 WebSocketDisconnect)
+                final_output = await run_ws_turn(websocket, admitted_turn(), pending_frames)
+            except AdmissionRejected as e:
+                await websocket.send_json({"type": "busy", "reason": e.reason, "retry_after": e.retry_after})
+                continue
+            if final_output is None:
+                await websocket.send_json({"type": "cancelled"})
+                continue
             
             # 发送最终结果 (Context 更新)
-            if final_output:
+            if final_output.get("reply") and session_id:
+                # 与 HTTP 路径一致: 保存本轮不受断开/取消影响 (shield)，保证会话不会只写入一半
+                await asyncio.shield(container.session_service.asave_turn(session_id, current_msg, final_output))
+                intent = final_output.get("intent", "unknown")
+                candidates_data = final_output.get("final_candidates", []) if intent in SEARCH_INTENTS else []
+                await websocket.send_json({"type": "result", "data": {
+                    "intent": intent,
+                    "session_id": session_id,
+                    "final_candidates": [to_candidate_dto(c).model_dump() for c in candidates_data]
+                }})
+            elif final_output.get("reply"):
                 # 构造类似 ChatResponse 的结构供前端更新 Context
                 # 需要序列化 ObjectId
                 
                 # 提取 CandidateDTO
                 candidates_data = final_output.get("final_candidates", [])
                 intent = final_output.get("intent", "unknown")
-                final_candidates_dtos = []
-                for c in candidates_data:
-                    dto = {
-                        "id": c.get('id', ''),
-                        "nickname": c.get('nickname', '未知'),
-                        "gender": c.get('gender', 'unknown'),
-                        "age": c.get('age', 0),
-                        "city": c.get('city', ''),
-                        "summary": c.get('summary', ''),
-                        "evidence": c.get('evidence', '')
-                    }
-                    final_candidates_dtos.append(dto)
+                final_candidates_dtos = [to_candidate_dto(c).model_dump() for c in candidates_data]
 
                 result_payload = {
                     "intent": intent,
@@ -139,6 +308,13 @@ async def websocket_endpoint(
 
     except WebSocketDisconnect:
         print(f"Client #{user_id} disconnected")
+    except asyncio.TimeoutError:
+        # 客户端长期不读，发送队列堆满：放弃该连接 (图已取消)
+        print(f"⚠️ Client #{user_id} too slow, closing")
+        try:
+            await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        except Exception:
+            pass
     except Exception as e:
         import traceback
         traceback.print_exc()
@@ -150,12 +326,46 @@ async def websocket_endpoint(
 @router.post("/message", response_model=ChatResponse)
 async def chat_with_matchmaker(
     request: ChatRequest,
-    user_id: str = Depends(get_current_user_id) 
+    http_request: Request,
+    response: Response,
+    user_id: str = Depends(get_current_user_id),
+    idempotency_key: Optional[str] = Header(None, alias="Idempotency-Key")
 ):
     """
     与 AI 红娘对话接口
+    客户端重试时建议携带相同的 `Idempotency-Key`：原请求仍在执行则等待同一结果，已完成则直接返回保存的响应。
     """
+    # 幂等键: 显式 Header 优先，否则按 用户 + 消息 (+ 会话/上下文) 哈希
+    key, explicit = build_request_key(user_id, idempotency_key, {
+        "message": request.message,
+        "session_id": request.session_id,
+        "context": None if request.session_id else request.context.model_dump()
+    })
+
+    async def admitted():
+        # 准入控制: 同一用户只允许一个在途请求，全局过载时快速返回 429
+        # (放在幂等层之内，重复请求挂到原请求上，不会因为 "用户已有在途请求" 被拒绝)
+        try:
+            async with container.admission.admit(user_id):
+                return await _handle_message(request, user_id)
+        except AdmissionRejected as e:
+            raise HTTPException(
+                status_code=429,
+                detail=f"服务繁忙 ({e.reason})，请稍后重试",
+                headers={"Retry-After": str(e.retry_after)}
+            )
+
+    # 客户端断开时取消等待；同一请求的所有等待方都断开后，共享的图运行随之取消
+    result, source = await run_until_http_disconnect(
+        http_request, container.idempotency.run(key, admitted, explicit)
+    )
+    if source != "executed":
+        response.headers["Idempotent-Replayed"] = source
+    return result
+
+async def _handle_message(request: ChatRequest, user_id: str) -> ChatResponse:
     ctx = request.context
+    session_mode = request.session_id is not None
     
     # 构造初始状态
     initial_state = {
@@ -163,12 +373,20 @@ async def chat_with_matchmaker(
         "current_input": request.message,
         "messages": [], 
         "search_count": 0,
-        
-        "seen_candidate_ids": ctx.seen_candidate_ids,
-        "final_candidates": ctx.last_candidates,
-        "last_target_person": ctx.last_target_person,
-        "last_search_criteria": ctx.last_search_criteria
     }
+    if session_mode:
+        # 会话模式: 上下文由服务端保存，候选人只以引用形式存在
+        session_ctx = await container.session_service.aget_context(request.session_id, user_id)
+        if session_ctx is None:
+            raise HTTPException(status_code=404, detail="会话不存在")
+        initial_state.update(session_ctx)
+    else:
+        initial_state.update({
+            "seen_candidate_ids": ctx.seen_candidate_ids,
+            "final_candidates": ctx.last_candidates,
+            "last_target_person": ctx.last_target_person,
+            "last_search_criteria": ctx.last_search_criteria
+        })
 
     try:
         # 从容器获取 app
@@ -177,34 +395,32 @@ async def chat_with_matchmaker(
         
         candidates_data = final_state.get("final_candidates", [])
         intent = final_state.get("intent", "unknown")
+
+        if session_mode:
+            # 图已跑完: 保存本轮不受取消影响 (shield)，保证会话不会只写入一半
+            await asyncio.shield(container.session_service.asave_turn(request.session_id, request.message, final_state))
+            # 非搜索意图下 state 里只有候选人引用，卡片数据由 /sessions/{id}/candidates 按需获取
+            if intent not in SEARCH_INTENTS:
+                candidates_data = []
         
-        final_candidates_dtos = []
-        for c in candidates_data:
-            dto = CandidateDTO(
-                id=c.get('id', ''),
-                nickname=c.get('nickname', '未知'),
-                gender=c.get('gender', 'unknown'),
-                age=c.get('age', 0),
-                city=c.get('city', ''),
-                summary=c.get('summary', ''),
-                evidence=c.get('evidence', '')
-            )
-            final_candidates_dtos.append(dto)
+        final_candidates_dtos = [to_candidate_dto(c) for c in candidates_data]
             
-        # 构造新的 Context
-        cleaned_last_criteria = serialize_mongo_obj(final_state.get("last_search_criteria", {}))
-        
-        new_ctx = ChatContext(
-            seen_candidate_ids=final_state.get("seen_candidate_ids", []),
-            last_candidates=serialize_mongo_obj(candidates_data if intent == 'search_candidate' else ctx.last_candidates),
-            last_target_person=final_state.get("last_target_person"),
-            last_search_criteria=cleaned_last_criteria
-        )
+        # 构造新的 Context (仅旧模式需要回传给客户端)
+        new_ctx = None
+        if not session_mode:
+            cleaned_last_criteria = serialize_mongo_obj(final_state.get("last_search_criteria", {}))
+            new_ctx = ChatContext(
+                seen_candidate_ids=final_state.get("seen_candidate_ids", []),
+                last_candidates=serialize_mongo_obj(candidates_data if intent == 'search_candidate' else ctx.last_candidates),
+                last_target_person=final_state.get("last_target_person"),
+                last_search_criteria=cleaned_last_criteria
+            )
         
         return ChatResponse(
             reply=final_state.get("reply", "系统暂时无法处理您的请求"),
             intent=intent,
             final_candidates=final_candidates_dtos,
+            session_id=request.session_id,
             new_context=new_ctx,
             debug_info={
                 "semantic_query": final_state.get("semantic_query"),
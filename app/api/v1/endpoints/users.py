@@ -4,7 +4,8 @@ from bson import ObjectId
 from fastapi import APIRouter, HTTPException, Depends
 from app.api.schemas.user_dto import UserRegisterRequest, UserRegisterResponse, UserProfileUpdate, UserProfileResponse
 from app.core.container import container
-from app.core.security import get_password_hash
+from app.core.security import PasswordHasherBusy
+from app.core.utils.cal_utils import derive_basic_fields
 from app.api.v1.endpoints.auth import get_current_user_id
 
 router = APIRouter()
@@ -14,11 +15,17 @@ async def register_account(request: UserRegisterRequest):
     """
     Step 1: 注册账号 (创建账号 + 关联空的用户档案)
     """
-    db = container.db
+    db = container.async_db
     
-    if db.get_auth_user_by_account(request.account):
+    if await db.get_auth_user_by_account(request.account):
         raise HTTPException(status_code=400, detail="该账号已被注册")
 
+    # 先计算密码哈希 (线程池)，排队已满时直接拒绝，避免留下没有账号的空档案
+    try:
+        pwd_hash = await container.password_hasher.hash(request.password)
+    except PasswordHasherBusy:
+        raise HTTPException(status_code=503, detail="注册请求过多，请稍后重试", headers={"Retry-After": "1"})
+
     try:
         # 1. 创建一个空的 user_basic 记录
         # 只初始化必要的空字段或默认值
@@ -32,19 +39,19 @@ async def register_account(request: UserRegisterRequest):
             "weight": 70,
             "self_intro_raw": "unknow",
         }
-        result = db.users_basic.insert_one(empty_basic)
+        empty_basic.update(derive_basic_fields(empty_basic)) # 物化 bmi / birth_year
+        result = await db.users_basic.insert_one(empty_basic)
         user_id = result.inserted_id
         
         # 1.5 初始化用户状态
-        db.users_states.insert_one({
+        await db.users_states.insert_one({
             "user_id": user_id,
             "is_onboarding_completed": False,
             "updated_at": datetime.now()
         })
         
         # 2. 创建 auth 记录
-        pwd_hash = get_password_hash(request.password)
-        db.create_auth_user(request.account, pwd_hash, user_id)
+        await db.create_auth_user(request.account, pwd_hash, user_id)
         
         return UserRegisterResponse(
             user_id=str(user_id),
@@ -61,7 +68,7 @@ async def update_profile(
     """
     Step 3: 完善/更新个人资料 (需要登录)
     """
-    db = container.db
+    db = container.async_db
     
     update_data = request.dict() # Pydantic 会自动把 date 类型传过来
     
@@ -72,22 +79,23 @@ async def update_profile(
     
     # is_completed 应该由 Onboarding 流程决定，此处仅更新基础信息
     # update_data["is_completed"] = True 
+    update_data.update(derive_basic_fields(update_data)) # 物化 bmi / birth_year，供硬过滤走索引
     update_data["updated_at"] = datetime.now()
     
     try:
-        db.users_basic.update_one(
+        await db.users_basic.update_one(
             {"_id": ObjectId(user_id)},
             {"$set": update_data}
         )
         
         # 顺便初始化 persona (如果不存在)
-        if not db.users_persona.find_one({"user_id": ObjectId(user_id)}):
+        if not await db.users_persona.find_one({"user_id": ObjectId(user_id)}):
              default_persona = {
                 "user_id": ObjectId(user_id),
                 "persona": {"occupation": "未知"},
                 "created_at": datetime.now()
             }
-             db.users_persona.insert_one(default_persona)
+             await db.users_persona.insert_one(default_persona)
 
         return UserProfileResponse(
             user_id=user_id,
@@ -102,14 +110,14 @@ async def get_my_profile(user_id: str = Depends(get_current_user_id)):
     """
     获取当前用户信息 (用于前端侧边栏展示)
     """
-    db = container.db
-    user = db.users_basic.find_one({"_id": ObjectId(user_id)})
+    db = container.async_db
+    user = await db.users_basic.find_one({"_id": ObjectId(user_id)})
     
     if not user:
         raise HTTPException(status_code=404, detail="用户不存在")
     
     # 获取状态
-    state_doc = db.users_states.find_one({"user_id": ObjectId(user_id)})
+    state_doc = await db.users_states.find_one({"user_id": ObjectId(user_id)})
     is_completed = state_doc.get("is_onboarding_completed", False) if state_doc else False
     
     # birthday 从 MongoDB 读出就是 datetime.datetime 类型，Pydantic 会自动处理
@@ -33,7 +33,8 @@ class MatchmakingState(TypedDict):
     last_target_person: Optional[str]  # 上一轮深度探索的目标名字 (用于指代消解)
     seen_candidate_ids: List[str]      # [NEW] 已经推荐过的候选人 ID 列表 (用于"换一批"排除)
     last_search_criteria: Optional[Dict] # [NEW] 上一轮的搜索条件 (用于"换一批"继承)
-    refined_criteria: Optional[Dict]   # [NEW] 自修正产生的结构化条件 (Refine -> Filter 传递用)
+    relaxation_note: Optional[str]     # 自修正时实际放宽了哪些条件 (由 ResponseNode 写进推荐语)
+    retrieval_plan: Optional[Dict]     # 检索策略规划结果 {strategy, estimate, reason, mongo_seconds}
     
     # 6. 用户画像上下文
     current_user_basic: Optional[Dict]
@@ -1,8 +1,9 @@
 # -*- coding: utf-8 -*-
 import os
 import yaml
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from pathlib import Path
+from typing import Dict, Optional
 
 class DatabaseConfig(BaseModel):
     mongo_uri: str
@@ -30,12 +31,151 @@ class RAGConfig(BaseModel):
     window_size: int
     overlap: int
 
+class OnboardingConfig(BaseModel):
+    """Onboarding 实时访谈相关参数 (YAML 中可缺省)"""
+    extract_every_n_user_msgs: int = 4 # 用户每发言 N 次触发一次后台增量提取
+    extract_context_overlap: int = 2   # 增量提取时向前多带的消息条数 (保证上下文连贯)
+
+class FinalizationConfig(BaseModel):
+    """Onboarding 结算 Outbox Worker 参数"""
+    poll_interval_seconds: float = 5.0  # 无通知时的轮询间隔
+    max_attempts: int = 5               # 单个任务最大重试次数，超过后标记为 dead
+    backoff_base_seconds: float = 10.0  # 指数退避基数: base * 2^(attempts-1)
+    lease_seconds: int = 600            # 任务租约，Worker 崩溃后超时可被重新领取
+
+class EmbeddingConfig(BaseModel):
+    """向量化服务参数 (模型名沿用 llm.chroma_embedding_model)"""
+    backend: str = "torch"               # torch / onnx / onnx_int8
+    onnx_cache_dir: str = "models/onnx"  # ONNX 导出/量化文件缓存目录
+    batch_size: int = 32
+    intra_op_threads: int = 0            # ONNX Runtime 线程数，0 表示默认
+    warmup_on_startup: bool = True
+    parity_check_on_startup: bool = False # 启动时只读取缓存的一致性结论 (不加载 torch)
+    parity_threshold: float = 0.99
+    microbatch_enabled: bool = True      # 跨请求合并单条 query 的向量化
+    microbatch_max_wait_ms: float = 5.0  # 攒批最长等待时间
+    microbatch_max_size: int = 32        # 单批最大条数
+
+class RetentionPolicy(BaseModel):
+    """单个 dialogue_type 的 Chroma 保留策略"""
+    mode: str = "permanent"                  # permanent: 永不清理 / persistent: 只压缩不淘汰 / sliding_window: 按时间和数量淘汰
+    max_age_days: Optional[int] = None       # sliding_window: 超过 N 天的块直接删除
+    max_chunks_per_user: Optional[int] = None # sliding_window: 每个用户只保留最近 N 块
+    compact_after_days: Optional[int] = None # 早于 N 天的块合并压缩 (None 表示不压缩)
+    compact_group_size: int = 4              # 压缩时每 N 个相邻块合并为 1 块
+
+def _default_retention_policies() -> Dict[str, RetentionPolicy]:
+    # 与设计文档中的分级生命周期一致
+    return {
+        "onboarding": RetentionPolicy(mode="permanent"),
+        "social": RetentionPolicy(mode="persistent", compact_after_days=90),
+        "user_chat": RetentionPolicy(mode="sliding_window", max_age_days=30, max_chunks_per_user=200),
+    }
+
+class ChromaRetentionConfig(BaseModel):
+    """Chroma 对话块保留/压缩任务参数"""
+    enabled: bool = False                  # 是否随应用启动定时任务
+    dry_run: bool = True                   # 只统计不删除 (确认策略后再关闭)
+    interval_seconds: float = 6 * 3600     # 定时任务间隔
+    scan_page_size: int = 1000             # 分页扫描集合的页大小
+    policies: Dict[str, RetentionPolicy] = Field(default_factory=_default_retention_policies)
+
+class DialogueArchiveConfig(BaseModel):
+    """已结算 Onboarding 对话的冷存储归档参数"""
+    enabled: bool = False               # 是否随应用启动定时归档
+    interval_seconds: float = 24 * 3600 # 定时任务间隔
+    min_age_days: int = 7               # 结算完成 N 天后才归档
+    batch_size: int = 200               # 单次最多归档的用户数
+    zstd_level: int = 10                # zstd 压缩级别
+
+class AuthConfig(BaseModel):
+    """认证相关配置"""
+    password_workers: int = 4          # bcrypt 线程池大小 (bcrypt 计算时释放 GIL，线程即可并行)
+    password_max_pending: int = 64     # 排队 + 执行中的 bcrypt 任务上限，超过直接返回 503
+    token_cache_size: int = 10000      # 已验证 JWT 的 LRU 缓存条数 (0 表示关闭)
+
+class BulkImportConfig(BaseModel):
+    """批量导入用户配置"""
+    batch_size: int = 1000             # 每批 insert_many 的行数
+    hash_workers: int = 0              # bcrypt 进程池大小，0 表示 CPU 核数
+    bcrypt_rounds: int = 12            # 与注册接口的 gensalt() 默认 cost 一致
+    max_reported_errors: int = 1000    # 报告中最多保留的逐行错误条数
+
+class AdmissionConfig(BaseModel):
+    """聊天接口准入控制 (/chat/message 与 /chat/ws)"""
+    enabled: bool = True
+    per_user_limit: int = 1                 # 每个用户同时在跑的图运行数
+    max_in_flight: int = 32                 # 全局同时在跑的图运行数
+    max_queue: int = 256                    # 等待队列上限
+    queue_deadline_seconds: float = 10.0    # 预计/实际排队超过该时间即拒绝
+    initial_service_seconds: float = 5.0    # 单次图运行耗时的初始估计 (之后按 EWMA 更新)
+    ewma_alpha: float = 0.2
+
+class IdempotencyConfig(BaseModel):
+    """/chat/message 的幂等与在途合并"""
+    enabled: bool = True
+    ttl_seconds: float = 300.0          # 显式 Idempotency-Key 的响应保存时间
+    fallback_ttl_seconds: float = 10.0  # 无 Header 时按消息哈希去重，只覆盖短时间内的自动重试
+    max_entries: int = 10000            # 保存的响应条数上限 (LRU)
+
+class RelaxationConfig(BaseModel):
+    """硬性条件无结果时的确定性放宽"""
+    min_hits: int = 5                  # 放宽后至少命中的人数 (取第一个达标的梯级)
+    age_step_years: int = 3            # 年龄范围两端各放宽的岁数
+    height_step_cm: int = 5            # 身高范围两端各放宽的厘米数
+    count_cap: int = 200               # 每级最多数到多少人 (与 hard_filter 的 limit 一致)
+
+class CriteriaParserConfig(BaseModel):
+    """规则版搜索条件解析 (置信度达标时跳过 filter_chain)"""
+    enabled: bool = True
+    min_confidence: float = 0.8        # 置信度阈值，低于该值仍走 LLM
+    log_path: Optional[str] = None     # 走 LLM 时把 LLM 与规则的解析结果追加到该 JSONL，供基准对比
+
+class RetrievalPlannerConfig(BaseModel):
+    """候选人检索策略规划 (mongo_only / es_native / id_hybrid)"""
+    enabled: bool = True
+    stats_refresh_seconds: float = 600.0  # users_basic 基数统计 (直方图) 的刷新间隔
+    mongo_only_max: int = 10              # 候选人不超过该数时不走 ES，直接交给精排
+    es_native_min: int = 2000             # 估算命中不少于该数且 ES 可表达时，跳过 Mongo 直接在 ES 中过滤检索
+
+class ESKnnConfig(BaseModel):
+    """ES 向量检索参数自适应 (按过滤后的文档数选择精确打分或近似 KNN)"""
+    exact_max_docs: int = 2000            # 过滤后文档数不超过该值时，用 script_score 精确计算余弦 (不走 HNSW)
+    num_candidates_factor: float = 1.5    # 近似 KNN: num_candidates ≈ k * factor / 过滤选择度
+    num_candidates_min: int = 100
+    num_candidates_max: int = 10000       # ES 的上限
+    doc_count_ttl_seconds: float = 300.0  # 索引总文档数 (计算选择度用) 的缓存时间
+
+class LocalSearchConfig(BaseModel):
+    """进程内混合检索引擎 (NumPy 向量 + jieba BM25)，用于无 ES 环境或 ES 故障兜底"""
+    mode: str = "off"                     # off / fallback (ES 失败时使用) / primary (完全替代 ES)
+    data_dir: str = "data/local_search"   # memmap 向量文件与文档元数据的目录
+    backfill_on_startup: bool = True      # 启动时在后台从 Mongo 回填尚未入库的用户
+    backfill_batch_size: int = 64         # 回填时每批向量化的人数
+    initial_capacity: int = 1024          # 向量矩阵初始行数 (不足时翻倍扩容)
+    bm25_k1: float = 1.2                  # 与 ES 默认 BM25 参数一致
+    bm25_b: float = 0.75
+
 class Settings(BaseModel):
     """系统配置 (YAML 驱动)"""
     database: DatabaseConfig
     llm: LLMConfig
     generation: GenerationConfig
     rag: RAGConfig
+    onboarding: OnboardingConfig = Field(default_factory=OnboardingConfig)
+    finalization: FinalizationConfig = Field(default_factory=FinalizationConfig)
+    embedding: EmbeddingConfig = Field(default_factory=EmbeddingConfig)
+    chroma_retention: ChromaRetentionConfig = Field(default_factory=ChromaRetentionConfig)
+    dialogue_archive: DialogueArchiveConfig = Field(default_factory=DialogueArchiveConfig)
+    auth: AuthConfig = Field(default_factory=AuthConfig)
+    bulk_import: BulkImportConfig = Field(default_factory=BulkImportConfig)
+    admission: AdmissionConfig = Field(default_factory=AdmissionConfig)
+    idempotency: IdempotencyConfig = Field(default_factory=IdempotencyConfig)
+    relaxation: RelaxationConfig = Field(default_factory=RelaxationConfig)
+    criteria_parser: CriteriaParserConfig = Field(default_factory=CriteriaParserConfig)
+    retrieval_planner: RetrievalPlannerConfig = Field(default_factory=RetrievalPlannerConfig)
+    es_knn: ESKnnConfig = Field(default_factory=ESKnnConfig)
+    local_search: LocalSearchConfig = Field(default_factory=LocalSearchConfig)
 
     @classmethod
     def load_from_yaml(cls, path: str = "config/config.yaml") -> "Settings":
@@ -71,8 +211,17 @@ class Settings(BaseModel):
              p = Path(config_data['database']['chroma_persist_dir'])
              if not p.is_absolute():
                  config_data['database']['chroma_persist_dir'] = str(project_root / p)
+        if 'embedding' in config_data and 'onnx_cache_dir' in config_data['embedding']:
+             p = Path(config_data['embedding']['onnx_cache_dir'])
+             if not p.is_absolute():
+                 config_data['embedding']['onnx_cache_dir'] = str(project_root / p)
 
-        return cls(**config_data)
+        loaded = cls(**config_data)
+        # 进程内检索引擎的数据目录: 默认值也是相对路径，构造后统一补全 (否则换个 CWD 启动会另建一份空索引)
+        p = Path(loaded.local_search.data_dir)
+        if not p.is_absolute():
+            loaded.local_search.data_dir = str(project_root / p)
+        return loaded
 
 # 单例加载
 try:
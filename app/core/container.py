@@ -1,4 +1,6 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import threading
 from typing import Optional
 
 from langchain_openai import ChatOpenAI
@@ -20,12 +22,30 @@ class AppContainer:
     def __init__(self):
         # 延迟初始化变量
         self._mongo_manager: Optional[MongoDBManager] = None
+        self._async_mongo_manager = None # AsyncMongoDBManager (Motor)，按事件循环绑定
+        self._async_mongo_loop = None
         self._chroma_manager: Optional[ChromaManager] = None
         self._es_manager: Optional[ESManager] = None
+        self._embedding_service = None # EmbeddingService 单例
         self._workflow = None # Workflow 单例
         self._profile_service = None # ProfileService 单例
         self._session_service = None # SessionService 单例
         self._termination_manager = None # TerminationManager 单例
+        self._extraction_service = None # IncrementalExtractionService 单例
+        self._finalization_worker = None # FinalizationWorker 单例
+        self._chroma_retention = None # ChromaRetentionService 单例
+        self._retention_scheduler = None # Chroma 保留任务 (PeriodicJob)
+        self._dialogue_archive = None # DialogueArchiveService 单例
+        self._archive_scheduler = None # 对话归档任务 (PeriodicJob)
+        self._password_hasher = None # PasswordHasher (bcrypt 线程池) 单例
+        self._bulk_importer = None # BulkUserImporter (bcrypt 进程池) 单例
+        self._admission = None # 聊天准入控制单例
+        self._idempotency = None # 聊天幂等/在途合并单例
+        self._cardinality_stats = None # users_basic 基数统计单例
+        self._stats_scheduler = None # 基数统计刷新任务 (PeriodicJob)
+        self._retrieval_planner = None # 候选人检索策略规划单例
+        self._local_search = None # 进程内混合检索引擎 (LocalSearchEngine) 单例
+        self._local_search_lock = threading.Lock()
         
         # LLM 缓存
         self._llms = {}
@@ -64,6 +84,118 @@ class AppContainer:
             self._termination_manager = DialogueTerminationManager(self.get_llm("intent"))
         return self._termination_manager
 
+    @property
+    def extraction_service(self):
+        """获取 Onboarding 后台增量提取服务单例"""
+        if not self._extraction_service:
+            from app.services.ai.workflows.onboarding_extraction import IncrementalExtractionService
+            self._extraction_service = IncrementalExtractionService()
+        return self._extraction_service
+
+    @property
+    def finalization_worker(self):
+        """获取 Onboarding 结算 Outbox Worker 单例"""
+        if not self._finalization_worker:
+            from app.services.ai.workflows.finalization_worker import FinalizationWorker
+            self._finalization_worker = FinalizationWorker()
+        return self._finalization_worker
+
+    @property
+    def chroma_retention(self):
+        """获取 Chroma 保留/压缩服务单例"""
+        if not self._chroma_retention:
+            from app.services.chroma_retention import ChromaRetentionService
+            self._chroma_retention = ChromaRetentionService(self.chroma, settings.chroma_retention)
+        return self._chroma_retention
+
+    @property
+    def retention_scheduler(self):
+        """获取 Chroma 保留任务定时器单例"""
+        if not self._retention_scheduler:
+            from app.services.periodic_job import PeriodicJob
+            self._retention_scheduler = PeriodicJob(
+                "chroma_retention", self.chroma_retention.run, settings.chroma_retention.interval_seconds
+            )
+        return self._retention_scheduler
+
+    @property
+    def dialogue_archive(self):
+        """获取 Onboarding 对话归档服务单例"""
+        if not self._dialogue_archive:
+            from app.services.dialogue_archive import DialogueArchiveService
+            self._dialogue_archive = DialogueArchiveService(self.db, settings.dialogue_archive)
+        return self._dialogue_archive
+
+    @property
+    def archive_scheduler(self):
+        """获取对话归档定时任务单例"""
+        if not self._archive_scheduler:
+            from app.services.periodic_job import PeriodicJob
+            self._archive_scheduler = PeriodicJob(
+                "dialogue_archive", self.dialogue_archive.run, settings.dialogue_archive.interval_seconds
+            )
+        return self._archive_scheduler
+
+    @property
+    def password_hasher(self):
+        """获取 bcrypt 线程池单例"""
+        if not self._password_hasher:
+            from app.core.security import PasswordHasher
+            self._password_hasher = PasswordHasher(
+                settings.auth.password_workers, settings.auth.password_max_pending
+            )
+        return self._password_hasher
+
+    @property
+    def bulk_importer(self):
+        """获取批量导入服务单例 (进程池首次导入时才启动，跨请求复用)"""
+        if not self._bulk_importer:
+            from app.services.bulk_import import BulkUserImporter
+            self._bulk_importer = BulkUserImporter(config=settings.bulk_import)
+        return self._bulk_importer
+
+    @property
+    def admission(self):
+        """获取聊天接口准入控制器单例"""
+        if not self._admission:
+            from app.services.admission import AdmissionController
+            self._admission = AdmissionController(settings.admission)
+        return self._admission
+
+    @property
+    def idempotency(self):
+        """获取聊天轮次幂等缓存单例"""
+        if not self._idempotency:
+            from app.services.idempotency import IdempotencyCache
+            self._idempotency = IdempotencyCache(settings.idempotency)
+        return self._idempotency
+
+    @property
+    def cardinality_stats(self):
+        """获取 users_basic 基数统计单例"""
+        if not self._cardinality_stats:
+            from app.services.retrieval_planner import CardinalityStats
+            self._cardinality_stats = CardinalityStats(self.db)
+        return self._cardinality_stats
+
+    @property
+    def stats_scheduler(self):
+        """获取基数统计刷新任务单例"""
+        if not self._stats_scheduler:
+            from app.services.periodic_job import PeriodicJob
+            self._stats_scheduler = PeriodicJob(
+                "cardinality_stats", self.cardinality_stats.refresh, settings.retrieval_planner.stats_refresh_seconds
+            )
+        return self._stats_scheduler
+
+    @property
+    def retrieval_planner(self):
+        """获取候选人检索策略规划单例"""
+        if not self._retrieval_planner:
+            from app.services.retrieval_planner import RetrievalPlanner
+            self._retrieval_planner = RetrievalPlanner(self.cardinality_stats, settings.retrieval_planner)
+        return self._retrieval_planner
+
     # --- Workflow (Singleton) ---
     @property
     def recommendation_app(self):
@@ -87,16 +219,50 @@ class AppContainer:
             )
         return self._mongo_manager
 
+    @property
+    def async_db(self):
+        """
+        获取 MongoDB 异步 Manager (Motor)。
+        Motor 客户端绑定事件循环：应用内始终是同一个循环；脚本里多次 asyncio.run 时按循环重建。
+        """
+        loop = asyncio.get_running_loop()
+        if not self._async_mongo_manager or self._async_mongo_loop is not loop:
+            from app.db.async_mongo_manager import AsyncMongoDBManager
+            self._async_mongo_manager = AsyncMongoDBManager(
+                settings.database.mongo_uri,
+                settings.database.db_name
+            )
+            self._async_mongo_loop = loop
+        return self._async_mongo_manager
+
     @property
     def chroma(self) -> ChromaManager:
         """获取 ChromaDB Manager 单例"""
         if not self._chroma_manager:
             self._chroma_manager = ChromaManager(
                 settings.database.chroma_persist_dir,
-                settings.database.chroma_collection_name
+                settings.database.chroma_collection_name,
+                embedding_function=self.embedding_service
             )
         return self._chroma_manager
 
+    @property
+    def embedding_service(self):
+        """获取向量化服务单例 (Chroma / ES 召回 / 结算共用)"""
+        if not self._embedding_service:
+            from app.services.embedding_service import EmbeddingService
+            self._embedding_service = EmbeddingService(
+                model_name=settings.llm.chroma_embedding_model,
+                backend=settings.embedding.backend,
+                cache_dir=settings.embedding.onnx_cache_dir,
+                batch_size=settings.embedding.batch_size,
+                intra_op_threads=settings.embedding.intra_op_threads,
+                microbatch_enabled=settings.embedding.microbatch_enabled,
+                microbatch_max_wait_ms=settings.embedding.microbatch_max_wait_ms,
+                microbatch_max_size=settings.embedding.microbatch_max_size
+            )
+        return self._embedding_service
+
     @property
     def es(self):
         """获取 Elasticsearch Manager 单例"""
@@ -105,6 +271,24 @@ class AppContainer:
             self._es_manager = ESManager()
         return self._es_manager
 
+    @property
+    def local_search(self):
+        """获取进程内混合检索引擎单例 (首次访问会加载 memmap 与 BM25 索引，较慢，启动时在线程中预热)"""
+        if not self._local_search:
+            # 启动预热线程与首个请求可能同时访问，加锁避免两个实例同时写同一份数据文件
+            with self._local_search_lock:
+                if not self._local_search:
+                    from app.db.local_search import LocalSearchEngine
+                    self._local_search = LocalSearchEngine(settings.local_search, settings.llm.vector_dims)
+        return self._local_search
+
+    @property
+    def search_engine(self):
+        """候选人混合检索的主后端: local_search.mode 为 primary 时是进程内引擎，否则是 ES"""
+        if settings.local_search.mode == "primary":
+            return self.local_search
+        return self.es
+
     # --- LLM Factory (Cached by Type) ---
 
     def get_llm(self, type: str = "chat") -> ChatOpenAI:
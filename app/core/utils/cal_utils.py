@@ -14,4 +14,29 @@ def calc_age(birthday_val):
         today = date.today()
         return today.year - b_date.year - ((today.month, today.day) < (b_date.month, b_date.day))
     except:
-        return 0
\ No newline at end of file
+        return 0
+
+def calc_bmi(height, weight):
+    """BMI = 体重(kg) / 身高(m)^2，保留两位小数；数据缺失或非法时返回 None"""
+    try:
+        h, w = float(height), float(weight)
+    except (TypeError, ValueError):
+        return None
+    if h <= 0 or w <= 0:
+        return None
+    return round(w / ((h / 100) ** 2), 2)
+
+def derive_basic_fields(basic: dict) -> dict:
+    """
+    根据 users_basic 中的原始字段计算物化字段 (bmi / birth_year)，供写入时一并 $set。
+    只返回能从 `basic` 中算出的字段，局部更新时不会误覆盖。
+    """
+    derived = {}
+    if "height" in basic or "weight" in basic:
+        bmi = calc_bmi(basic.get("height"), basic.get("weight"))
+        if bmi is not None:
+            derived["bmi"] = bmi
+    birthday = basic.get("birthday")
+    if isinstance(birthday, (datetime, date)):
+        derived["birth_year"] = birthday.year
+    return derived
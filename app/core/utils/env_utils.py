@@ -21,6 +21,9 @@ BASE_URL = os.environ.get("BAILIAN_BASE_URL")
 # JWT Security Settings
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY")
 ALGORITHM = os.environ.get("JWT_ALGORITHM", "HS256") # 默认 HS256
+
+# 管理接口密钥 (未配置时管理接口不可用)
+ADMIN_API_KEY = os.environ.get("ADMIN_API_KEY")
 # 检查关键环境变量
 if not API_KEY:
     raise ValueError(f"❌ 错误: 未找到 LLM API Key。请确保 {env_path} 文件或环境变量包含 BAILIAN_API_KEY 配置。")
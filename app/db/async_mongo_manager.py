@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+from typing import Dict, Any, List, Tuple, Optional
+from datetime import datetime
+from bson import ObjectId
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import ReturnDocument
+
+from app.core.utils.cal_utils import derive_basic_fields
+
+class AsyncMongoDBManager:
+    """
+    MongoDB 异步数据访问层 (Motor)
+    与 `MongoDBManager` 暴露相同的集合与方法，供 FastAPI Handler 和异步 Graph 节点 `await` 使用，
+    不再阻塞事件循环。同步版 `MongoDBManager` 保留给脚本和线程池内的同步节点。
+
+    注意：Motor 客户端绑定创建时的事件循环，由 `AppContainer.async_db` 负责按循环管理实例。
+    """
+
+    def __init__(self, uri: str, db_name: str):
+        self.client = AsyncIOMotorClient(uri)
+        self.db = self.client[db_name]
+
+        # Collections (与同步版保持一致)
+        self.users_basic = self.db["users_basic"]
+        self.users_persona = self.db["users_persona"]
+        self.onboarding_dialogues = self.db["users_onboarding_dialogues"]
+        self.onboarding_archive = self.db["users_onboarding_archive"] # 已结算对话的 zstd 压缩冷存储
+        self.chat_records = self.db["chat_records"]
+        self.profile = self.db["users_profile"]
+        self.users_auth = self.db["users_auth"]
+        self.chat_sessions = self.db["chat_sessions"]
+        self.chat_messages = self.db["chat_messages"] # 会话消息分桶存储
+        self.users_states = self.db["users_states"]
+
+    async def ensure_indexes(self):
+        """按 `mongo_indexes.INDEX_SPEC` 创建索引 (幂等，应用启动时调用)"""
+        from app.db.mongo_indexes import aapply_indexes
+        return await aapply_indexes(self)
+
+    def close(self):
+        self.client.close()
+
+    async def insert_user_with_persona(self, user_data: Dict[str, Any],
+                                       persona_data: Dict[str, Any]) -> ObjectId:
+        """插入用户基础信息和性格种子"""
+        user_basic = {k: v for k, v in user_data.items() if k != "persona_seed"}
+        user_basic.update(derive_basic_fields(user_basic)) # 物化 bmi / birth_year，供硬过滤走索引
+        user_basic["created_at"] = datetime.now()
+        result = await self.users_basic.insert_one(user_basic)
+        user_id = result.inserted_id
+
+        await self.users_persona.insert_one({
+            "user_id": user_id,
+            "persona": persona_data,
+            "created_at": datetime.now()
+        })
+        return user_id
+
+    async def create_auth_user(self, account: str, password_hash: str, user_id: ObjectId):
+        """创建认证用户"""
+        await self.users_auth.insert_one({
+            "account": account,
+            "password_hash": password_hash,
+            "user_id": user_id,
+            "created_at": datetime.now()
+        })
+
+    async def get_auth_user_by_account(self, account: str) -> Optional[Dict]:
+        """根据账号查找认证信息"""
+        return await self.users_auth.find_one({"account": account})
+
+    async def get_user_with_persona(self, user_id: ObjectId) -> Tuple[Dict, Dict]:
+        """获取用户信息和性格种子"""
+        user_basic = await self.users_basic.find_one({"_id": user_id})
+        persona_doc = await self.users_persona.find_one({"user_id": user_id})
+        persona = persona_doc["persona"] if persona_doc else {}
+        return user_basic, persona
+
+    async def insert_onboarding_dialogue(self, user_id: ObjectId, messages: List[Dict]):
+        """插入 onboarding 对话"""
+        await self.onboarding_dialogues.insert_one({
+            "user_id": user_id,
+            "messages": messages,
+            "updated_at": datetime.now()
+        })
+
+    async def push_onboarding_message(self, user_id: ObjectId, message: Dict, tail: int = 10) -> Dict:
+        """追加一条 onboarding 消息并返回最近 `tail` 条消息与计数器 (见同步版说明)"""
+        update = {
+            "$push": {"messages": message},
+            "$set": {"updated_at": datetime.now()}
+        }
+        if message.get("role") == "user":
+            update["$inc"] = {"user_msg_count": 1}
+
+        return await self.onboarding_dialogues.find_one_and_update(
+            {"user_id": user_id},
+            update,
+            projection={
+                "messages": {"$slice": -tail},
+                "user_msg_count": 1,
+                "completion_hint": 1,
+                "termination": 1
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        ) or {}
+
+    async def retract_onboarding_message(self, user_id: ObjectId, message: Dict):
+        """
+        撤回 `push_onboarding_message` 写入的消息 (本轮被取消、没有 AI 回复时调用)。
+        `extraction_cursor` 是消息数组下标：后台提取可能已经越过了被撤回的消息，
+        此时在同一次写操作里把游标减一，否则后面的消息整体左移，下一条用户消息会落在游标之前、永远不被提取。
+        """
+        is_target = {"$and": [
+            {"$eq": ["$$m.role", message.get("role")]},
+            {"$eq": ["$$m.timestamp", message.get("timestamp")]},
+        ]}
+        cursor = {"$ifNull": ["$extraction_cursor", 0]}
+        found = {"$gte": ["$_retract_idx", 0]}
+        set_fields = {
+            "messages": {"$filter": {"input": {"$ifNull": ["$messages", []]}, "as": "m", "cond": {"$not": [is_target]}}},
+            "extraction_cursor": {"$cond": [
+                {"$and": [found, {"$gt": [cursor, "$_retract_idx"]}]}, {"$subtract": [cursor, 1]}, cursor
+            ]},
+        }
+        if message.get("role") == "user":
+            set_fields["user_msg_count"] = {"$cond": [
+                found, {"$subtract": [{"$ifNull": ["$user_msg_count", 0]}, 1]}, {"$ifNull": ["$user_msg_count", 0]}
+            ]}
+        await self.onboarding_dialogues.update_one({"user_id": user_id}, [
+            {"$set": {"_retract_idx": {"$indexOfArray": [
+                {"$map": {"input": {"$ifNull": ["$messages", []]}, "as": "m", "in": is_target}}, True
+            ]}}},
+            {"$set": set_fields},
+            {"$unset": "_retract_idx"},
+        ])
+
+    async def append_onboarding_reply(self, user_id: ObjectId, message: Dict, state_updates: Optional[Dict] = None):
+        """在回合结束时写入 AI 回复，并与本轮的其他状态更新合并为一次写操作"""
+        set_fields = {"updated_at": datetime.now()}
+        if state_updates:
+            set_fields.update(state_updates)
+        await self.onboarding_dialogues.update_one(
+            {"user_id": user_id},
+            {"$push": {"messages": message}, "$set": set_fields}
+        )
+
+    async def insert_chat_record(self, user_id: ObjectId, partner_id: ObjectId,
+                                 messages: List[Dict]):
+        """插入聊天记录"""
+        await self.chat_records.insert_one({
+            "user_id": user_id,
+            "partner_id": partner_id,
+            "messages": messages,
+            "created_at": datetime.now()
+        })
@@ -1,20 +1,26 @@
 # -*- coding: utf-8 -*-
-from typing import List, Dict
-from langchain_huggingface import HuggingFaceEmbeddings
+import hashlib
+from datetime import datetime
+from typing import List, Dict, Optional
 from langchain_chroma import Chroma
+from langchain_core.embeddings import Embeddings
 from langchain_text_splitters import RecursiveCharacterTextSplitter # 更新后的导入路径
 from langchain_core.documents import Document
 
 class ChromaManager:
     """ChromaDB 管理器，支持对话分块和检索"""
 
-    def __init__(self, persist_directory: str = "./chroma_db", collection_name: str = "default_collection"):
+    def __init__(self, persist_directory: str = "./chroma_db", collection_name: str = "default_collection",
+                 embedding_function: Optional[Embeddings] = None):
         self.persist_directory = persist_directory
         self.collection_name = collection_name
         
-        # 从配置中加载嵌入模型名称
-        from app.core.config import settings # 在这里局部导入settings，避免循环引用
-        self.embeddings_model = HuggingFaceEmbeddings(model_name=settings.llm.chroma_embedding_model)
+        # 嵌入模型由外部注入 (AppContainer.embedding_service)；未注入时回退到按配置加载 HuggingFace 模型
+        if embedding_function is None:
+            from langchain_huggingface import HuggingFaceEmbeddings
+            from app.core.config import settings # 在这里局部导入settings，避免循环引用
+            embedding_function = HuggingFaceEmbeddings(model_name=settings.llm.chroma_embedding_model)
+        self.embeddings_model = embedding_function
         
         self.vector_db = Chroma(
             collection_name=self.collection_name,
@@ -28,20 +34,36 @@ class ChromaManager:
             add_start_index=True,
         )
 
+    @staticmethod
+    def build_chunk_id(user_id: str, dialogue_type: str, start_index: int, content: str) -> str:
+        """
+        确定性 Chunk ID: user + 对话类型 + 窗口起点 + 内容哈希。
+        同一窗口内容不变 -> ID 不变 (无需重新向量化)；内容变化 -> ID 变化 (旧块作为过期块清理)。
+        """
+        content_hash = hashlib.sha1(content.encode("utf-8")).hexdigest()[:12]
+        return f"{user_id}_{dialogue_type}_{start_index}_{content_hash}"
+
     def add_conversation_chunks(self,
                                 user_id: str,
                                 messages: List[Dict],
                                 dialogue_type: str, # "onboarding" or "social"
                                 window_size: int = 5,
-                                overlap: int = 2):
+                                overlap: int = 2,
+                                batch_size: int = 64):
         """
-        将对话消息切分为带有滑动窗口的块，并添加到向量数据库。
+        将对话消息切分为带有滑动窗口的块，并增量写入向量数据库。
         每个块包含 `window_size` 条消息，相邻块重叠 `overlap` 条消息。
+
+        幂等 & 增量：
+        - 只对库中不存在的 Chunk ID (新窗口或内容变化的窗口) 做向量化，按批 upsert；
+        - 同一 user + dialogue_type 下不再属于当前切分结果的旧块会被删除。
+        因此对长对话追加消息后重建索引，代价是 O(新窗口) 而不是 O(全部窗口)。
         """
         if not messages:
             return
 
         documents = []
+        ids = []
         # 构建滑动窗口
         for i in range(0, len(messages), window_size - overlap):
             window = messages[i : i + window_size]
@@ -67,15 +89,46 @@ class ChromaManager:
                 }
             )
             documents.append(doc)
-        
-        if documents:
-            # 清理旧的文档，避免重复
-            self.vector_db.delete(
-                ids=[d.metadata['user_id'] + "_" + d.metadata['dialogue_type'] + "_" + str(d.metadata['start_message_index']) for d in documents]
-            )
-            self.vector_db.add_documents(documents)
-            # self.vector_db.persist() # 新版本自动持久化，无需手动调用
-            print(f"✅ ChromaDB: 为用户 {user_id} 添加 {len(documents)} 条 {dialogue_type} 对话块。")
+            ids.append(self.build_chunk_id(user_id, dialogue_type, i, context_text))
+
+        if not documents:
+            return
+
+        # 对比库中已有的块
+        existing = self.vector_db.get(
+            where={"$and": [{"user_id": user_id}, {"dialogue_type": dialogue_type}]},
+            include=["metadatas"]
+        )
+        existing_ids = set()
+        compacted_ranges = [] # 保留任务合并过的块: 保留，且不再重建其覆盖范围内的窗口
+        for cid, meta in zip(existing.get("ids", []), existing.get("metadatas", [])):
+            if (meta or {}).get("compacted"):
+                compacted_ranges.append((meta.get("start_message_index", 0), meta.get("end_message_index", 0)))
+            else:
+                existing_ids.add(cid)
+        if compacted_ranges:
+            kept = [
+                (doc, cid) for doc, cid in zip(documents, ids)
+                if not any(lo <= doc.metadata["start_message_index"] <= hi for lo, hi in compacted_ranges)
+            ]
+            documents = [doc for doc, _ in kept]
+            ids = [cid for _, cid in kept]
+        wanted_ids = set(ids)
+
+        # 清理过期块 (内容已变化的窗口 / 已不存在的窗口)
+        stale_ids = list(existing_ids - wanted_ids)
+        if stale_ids:
+            self.vector_db.delete(ids=stale_ids)
+
+        # 只向量化新增/变化的窗口，分批 upsert
+        new_pairs = [(doc, cid) for doc, cid in zip(documents, ids) if cid not in existing_ids]
+        for b in range(0, len(new_pairs), batch_size):
+            batch = new_pairs[b : b + batch_size]
+            self.vector_db.add_documents([d for d, _ in batch], ids=[cid for _, cid in batch])
+        # self.vector_db.persist() # 新版本自动持久化，无需手动调用
+
+        print(f"✅ ChromaDB: 用户 {user_id} 的 {dialogue_type} 对话共 {len(documents)} 块，"
+              f"新增/更新 {len(new_pairs)} 块，清理过期 {len(stale_ids)} 块。")
 
     def retrieve_related_context(self, query: str, user_id: str = None, k: int = 5, filter: Dict = None) -> List[Document]:
         """
@@ -100,5 +153,3 @@ class ChromaManager:
         
         # results 是 (Document, score) 元组的列表
         return [doc for doc, score in results]
-
-from datetime import datetime # 导入 datetime 以避免 NameError 
@@ -1,11 +1,42 @@
 # -*- coding: utf-8 -*-
 import logging
-from typing import List, Dict, Any, Optional
+import math
+import time
+from typing import List, Dict, Any, Optional, Tuple
 from elasticsearch import Elasticsearch, helpers
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+
+def rrf_fuse(ranked_lists: List[List[Dict[str, Any]]], top_k: int, rrf_k: int = 60) -> List[Dict]:
+    """
+    RRF 融合 (Reciprocal Rank Fusion): score = Σ 1 / (k + rank)
+    ranked_lists: 每一路的有序文档 (含 user_id / tags / city)，ES 与进程内引擎共用
+    """
+    scores = {}
+    doc_map = {}
+    for docs in ranked_lists:
+        for rank, doc in enumerate(docs):
+            uid = doc["user_id"]
+            if uid not in doc_map:
+                doc_map[uid] = doc
+            scores[uid] = scores.get(uid, 0.0) + (1.0 / (rrf_k + rank + 1))
+
+    # 排序并返回
+    sorted_uids = sorted(scores.keys(), key=lambda u: scores[u], reverse=True)
+    final_results = []
+    
+    for uid in sorted_uids[:top_k]:
+        final_results.append({
+            "user_id": uid,
+            "score": scores[uid],
+            "tags": doc_map[uid].get("tags"),
+            "city": doc_map[uid].get("city")
+        })
+        
+    return final_results
+
 class ESManager:
     _instance = None
 
@@ -22,6 +53,8 @@ class ESManager:
         self.es_url = settings.database.es_url
         self.index_name = settings.database.es_index_name
         self.es_vector_dims = settings.llm.vector_dims
+        self.knn_config = settings.es_knn
+        self._doc_count = None # (总文档数, 获取时间)，计算过滤选择度用
         
         # 连接 ES (假设开发环境已关闭 Security，生产环境需配置 basic_auth)
         # 强制指定 scheme 为 http，且不传递任何 SSL 参数，防止客户端自动升级
@@ -45,6 +78,11 @@ class ESManager:
         """
         if self.client.indices.exists(index=self.index_name):
             logger.info(f"Index '{self.index_name}' already exists.")
+            # 已有索引补上后加的字段 (新增字段的 mapping 变更是兼容的；历史文档用迁移脚本回填)
+            try:
+                self.client.indices.put_mapping(index=self.index_name, properties={"birth_year": {"type": "integer"}})
+            except Exception as e:
+                logger.error(f"Failed to update mapping: {e}")
             return
 
         mapping = {
@@ -55,7 +93,8 @@ class ESManager:
                     # --- 硬指标 (Keyword) ---
                     "gender": { "type": "keyword" },
                     "city": { "type": "keyword" },
-                    "age": { "type": "integer" },
+                    "age": { "type": "integer" },        # 建索引时的年龄 (只用于展示，会过期)
+                    "birth_year": { "type": "integer" }, # 出生年份 (不随时间漂移，年龄过滤用这个)
                     
                     # --- 混合检索字段 ---
                     # 1. Tags: 半结构化标签 (如 "本科", "独生子") -> 关键词匹配
@@ -88,15 +127,17 @@ class ESManager:
         except Exception as e:
             logger.error(f"Failed to create index: {e}")
 
-    def index_user(self, user_id: str, profile_data: Dict[str, Any], vector: List[float]):
+    def index_user(self, user_id: str, profile_data: Dict[str, Any], vector: List[float], raise_on_error: bool = False):
         """
         索引单个用户
+        raise_on_error: 为 True 时向上抛出异常 (供需要重试的调用方使用)
         """
         doc = {
             "user_id": user_id,
             "gender": profile_data.get("gender"),
             "city": profile_data.get("city"),
             "age": profile_data.get("age"),
+            "birth_year": profile_data.get("birth_year"),
             "tags": profile_data.get("tags", ""), # 字符串，如 "本科 程序员 独生子"
             "profile_text": profile_data.get("profile_text", ""),
             "profile_vector": vector
@@ -106,6 +147,8 @@ class ESManager:
             # logger.debug(f"Indexed user {user_id}")
         except Exception as e:
             logger.error(f"Error indexing user {user_id}: {e}")
+            if raise_on_error:
+                raise
 
     def bulk_index_users(self, actions: List[Dict[str, Any]]):
         """
@@ -118,51 +161,124 @@ class ESManager:
         except Exception as e:
             logger.error(f"Bulk index failed: {e}")
 
-    def hybrid_search(self, 
-                      query_text: str, 
-                      query_vector: List[float], 
-                      top_k: int = 20, 
-                      filters: Optional[Dict] = None) -> List[Dict]:
-        """
-        核心方法：混合检索 (Manual RRF Implementation)
-        [Fix] 在应用层手动实现 RRF，以绕过 ES Basic License 不支持 rank 参数的限制。
-        """
-        # --- 构造过滤条件 (共享) ---
+    @staticmethod
+    def build_filter(filters: Optional[Dict] = None, exclude: Optional[Dict] = None):
+        """返回 (must 子句, must_not 子句, 组合后的 filter query 或 None)"""
         must_clauses = []
         if filters:
              for k, v in filters.items():
                  if isinstance(v, list):
                      must_clauses.append({"terms": {k: v}})
+                 elif isinstance(v, dict):
+                     must_clauses.append({"range": {k: v}})
                  else:
                      must_clauses.append({"term": {k: v}})
-        
-        filter_query = {"bool": {"must": must_clauses}} if must_clauses else None
+        must_not_clauses = [{"terms": {k: v}} for k, v in (exclude or {}).items() if v]
 
-        # --- 1. 执行 KNN 搜索 (Vector) ---
-        knn_hits = []
-        try:
-            knn_res = self.client.search(
+        filter_query = None
+        if must_clauses or must_not_clauses:
+            filter_query = {"bool": {"must": must_clauses, "must_not": must_not_clauses}}
+        return must_clauses, must_not_clauses, filter_query
+
+    def doc_count(self) -> int:
+        """索引总文档数 (带缓存)"""
+        now = time.monotonic()
+        if self._doc_count is None or now - self._doc_count[1] > self.knn_config.doc_count_ttl_seconds:
+            self._doc_count = (self.client.count(index=self.index_name)["count"], now)
+        return self._doc_count[0]
+
+    def _filtered_size(self, filters: Optional[Dict], exclude: Optional[Dict], filter_query: Optional[Dict]) -> int:
+        """过滤后的文档数: 只有 user_id 列表时直接取长度，否则发一次 count 请求"""
+        if not filter_query:
+            return self.doc_count()
+        if not exclude and filters and set(filters) == {"user_id"} and isinstance(filters["user_id"], list):
+            return len(filters["user_id"])
+        return self.client.count(index=self.index_name, query=filter_query)["count"]
+
+    def knn_plan(self, k: int, filtered_size: int) -> Dict:
+        """
+        按过滤后的文档数选择向量检索方式:
+        - 小集合: script_score 精确余弦，只对过滤后的文档打分，召回率 100%；
+        - 大集合: 近似 KNN，num_candidates 按 k / 选择度放大 (过滤越严，HNSW 需要探索越多节点才能凑够 k 个)。
+        """
+        config = self.knn_config
+        if filtered_size <= config.exact_max_docs:
+            return {"mode": "exact"}
+        selectivity = min(1.0, filtered_size / max(self.doc_count(), 1))
+        num_candidates = math.ceil(k * config.num_candidates_factor / max(selectivity, 1e-6))
+        num_candidates = max(k, config.num_candidates_min, min(num_candidates, config.num_candidates_max))
+        return {"mode": "approx", "num_candidates": num_candidates, "selectivity": round(selectivity, 4)}
+
+    def vector_search(self, query_vector: List[float], filter_query: Optional[Dict], k: int,
+                      filtered_size: int) -> Tuple[List[Dict], Dict]:
+        """向量检索，返回 (hits, plan)"""
+        plan = self.knn_plan(k, filtered_size)
+        source = ["user_id", "tags", "gender", "age", "city"]
+        if plan["mode"] == "exact":
+            res = self.client.search(
+                index=self.index_name,
+                query={
+                    "script_score": {
+                        # 没有向量的文档无法计算余弦，先排除
+                        "query": {"bool": {"filter": [filter_query or {"match_all": {}},
+                                                      {"exists": {"field": "profile_vector"}}]}},
+                        "script": {
+                            # 与 mapping 的 cosine similarity 一致；+1 保证分数非负
+                            "source": "cosineSimilarity(params.query_vector, 'profile_vector') + 1.0",
+                            "params": {"query_vector": query_vector}
+                        }
+                    }
+                },
+                size=k,
+                _source=source
+            )
+        else:
+            res = self.client.search(
                 index=self.index_name,
                 knn={
                     "field": "profile_vector",
                     "query_vector": query_vector,
-                    "k": top_k * 2, # 多取一些用于融合
-                    "num_candidates": 100,
+                    "k": k,
+                    "num_candidates": plan["num_candidates"],
                     "filter": filter_query # 向量搜索也能带 filter
                 },
-                size=top_k * 2,
-                _source=["user_id", "tags", "gender", "age", "city"]
+                size=k,
+                _source=source
             )
-            knn_hits = knn_res.get("hits", {}).get("hits", [])
+        return res.get("hits", {}).get("hits", []), plan
+
+    def hybrid_search(self, 
+                      query_text: str, 
+                      query_vector: List[float], 
+                      top_k: int = 20, 
+                      filters: Optional[Dict] = None,
+                      exclude: Optional[Dict] = None) -> List[Dict]:
+        """
+        核心方法：混合检索 (Manual RRF Implementation)
+        [Fix] 在应用层手动实现 RRF，以绕过 ES Basic License 不支持 rank 参数的限制。
+        filters: 字段 -> 值 (term) / 列表 (terms) / {"gte", "lte"} (range)
+        exclude: 字段 -> 列表，命中的文档被排除 (如已推荐过的 user_id)
+        """
+        # --- 构造过滤条件 (共享) ---
+        must_clauses, must_not_clauses, filter_query = self.build_filter(filters, exclude)
+
+        # --- 1. 执行向量搜索 (小集合精确打分 / 大集合近似 KNN) ---
+        knn_hits, knn_error = [], None
+        try:
+            filtered_size = self._filtered_size(filters, exclude, filter_query)
+            knn_hits, plan = self.vector_search(query_vector, filter_query, top_k * 2, filtered_size) # 多取一些用于融合
+            logger.debug(f"Vector search plan: {plan} (filtered={filtered_size})")
         except Exception as e:
             logger.error(f"KNN search failed: {e}")
+            knn_error = e
 
         # --- 2. 执行 Text 搜索 (BM25) ---
-        text_hits = []
+        text_hits, text_error = [], None
         try:
             keyword_query = {
                 "bool": {
                     "must": must_clauses,
+                    "must_not": must_not_clauses,
                     "should": [
                         {
                             "multi_match": {
@@ -183,36 +299,11 @@ class ESManager:
             text_hits = text_res.get("hits", {}).get("hits", [])
         except Exception as e:
             logger.error(f"Text search failed: {e}")
+            text_error = e
 
-        # --- 3. 应用 RRF 融合 (Reciprocal Rank Fusion) ---
-        # Formula: score = 1 / (k + rank)
-        rrf_k = 60
-        scores = {}
-        doc_map = {}
-
-        # 处理 KNN 结果
-        for rank, hit in enumerate(knn_hits):
-            uid = hit["_source"]["user_id"]
-            doc_map[uid] = hit["_source"]
-            scores[uid] = scores.get(uid, 0.0) + (1.0 / (rrf_k + rank + 1))
-
-        # 处理 Text 结果
-        for rank, hit in enumerate(text_hits):
-            uid = hit["_source"]["user_id"]
-            if uid not in doc_map:
-                doc_map[uid] = hit["_source"]
-            scores[uid] = scores.get(uid, 0.0) + (1.0 / (rrf_k + rank + 1))
+        if knn_error and text_error:
+            # 两路都失败 (ES 不可用)：抛给调用方降级，而不是返回看似"没有匹配"的空结果
+            raise RuntimeError(f"Hybrid search failed: knn={knn_error}; text={text_error}")
 
-        # --- 4. 排序并返回 ---
-        sorted_uids = sorted(scores.keys(), key=lambda u: scores[u], reverse=True)
-        final_results = []
-        
-        for uid in sorted_uids[:top_k]:
-            final_results.append({
-                "user_id": uid,
-                "score": scores[uid],
-                "tags": doc_map[uid].get("tags"),
-                "city": doc_map[uid].get("city")
-            })
-            
-        return final_results
+        # --- 3. 应用 RRF 融合 (Reciprocal Rank Fusion) ---
+        return rrf_fuse([[h["_source"] for h in knn_hits], [h["_source"] for h in text_hits]], top_k)
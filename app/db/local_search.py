@@ -0,0 +1,363 @@
+# -*- coding: utf-8 -*-
+"""
+进程内混合检索引擎 (无 ES 模式)
+
+本地开发 / CI 没有 ES；线上 ES 故障时，RecallNode 原来退回 Chroma 对话块的相似度检索，
+那是对话内容而不是画像，会返回重复 ID，聊天少的候选人基本搜不到。
+这里在进程内实现与 `ESManager.hybrid_search` 相同签名与语义的检索:
+- 画像向量: NumPy memmap 的 float32 矩阵 (行 = 用户，已归一化，余弦 = 点积)，精确暴力检索；
+- 关键词: jieba 分词的 BM25 倒排索引，`tags^3` 与 `profile_text` 取最大 (对应 ES best_fields)；
+- 融合: 与 ES 共用 `rrf_fuse`。
+数据落在 `settings.local_search.data_dir`: `vectors.f32` (memmap) + `docs.jsonl` (追加写的元数据)。
+由启动时的 Mongo 回填和结算流程 (local_index 步骤) 增量写入。
+
+命令行 (从 Mongo 回填尚未入库的用户):
+    python -m app.db.local_search --backfill
+"""
+import argparse
+import asyncio
+import json
+import logging
+import math
+import os
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Set
+
+import numpy as np
+
+from app.core.config import settings, LocalSearchConfig
+from app.db.es_manager import rrf_fuse
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_SKIP = re.compile(r"^[\s\W_]+$")
+KEYWORD_FIELDS = ("gender", "city")
+NUMERIC_FIELDS = ("age", "birth_year") # 支持 range 过滤的字段 (缺失值记为 -1)
+
+
+def tokenize(text: str) -> List[str]:
+    """jieba 精确模式分词 (对应 ES 的 ik_smart)，去掉空白与标点"""
+    import jieba
+    return [t.lower() for t in jieba.lcut(text or "") if not _TOKEN_SKIP.match(t)]
+
+
+class BM25Index:
+    """单字段 BM25 倒排索引 (Lucene 公式，参数与 ES 默认值一致)"""
+
+    def __init__(self, k1: float = 1.2, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.postings: Dict[str, Dict[int, int]] = defaultdict(dict) # term -> {row: tf}
+        self.doc_terms: Dict[int, List[str]] = {}
+        self.doc_len: Dict[int, int] = {}
+        self.total_len = 0
+
+    def set(self, row: int, tokens: List[str]):
+        self.remove(row)
+        tf = Counter(tokens)
+        for term, n in tf.items():
+            self.postings[term][row] = n
+        self.doc_terms[row] = list(tf)
+        self.doc_len[row] = len(tokens)
+        self.total_len += len(tokens)
+
+    def remove(self, row: int):
+        for term in self.doc_terms.pop(row, []):
+            self.postings[term].pop(row, None)
+            if not self.postings[term]:
+                del self.postings[term]
+        self.total_len -= self.doc_len.pop(row, 0)
+
+    def scores(self, tokens: List[str], mask: Optional[np.ndarray] = None) -> Dict[int, float]:
+        n_docs = len(self.doc_len)
+        if not n_docs:
+            return {}
+        avgdl = self.total_len / n_docs or 1.0
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(tokens):
+            posting = self.postings.get(term)
+            if not posting:
+                continue
+            idf = math.log(1 + (n_docs - len(posting) + 0.5) / (len(posting) + 0.5))
+            for row, tf in posting.items():
+                if mask is not None and not mask[row]:
+                    continue
+                norm = self.k1 * (1 - self.b + self.b * self.doc_len[row] / avgdl)
+                scores[row] += idf * tf * (self.k1 + 1) / (tf + norm)
+        return scores
+
+
+class LocalSearchEngine:
+    VECTOR_FILE = "vectors.f32"
+    DOCS_FILE = "docs.jsonl"
+    META_FILE = "meta.json"
+
+    def __init__(self, config: Optional[LocalSearchConfig] = None, dims: Optional[int] = None):
+        self.config = config or settings.local_search
+        self.dims = dims or settings.llm.vector_dims
+        self.data_dir = self.config.data_dir
+        self._lock = threading.RLock()
+
+        self._rows: Dict[str, int] = {}                 # user_id -> 行号
+        self._docs: List[Optional[Dict[str, Any]]] = []  # 行号 -> 元数据
+        self._keyword: Dict[str, Dict[Any, Set[int]]] = {f: defaultdict(set) for f in KEYWORD_FIELDS}
+        self._numeric: Dict[str, np.ndarray] = {f: np.zeros(0, dtype=np.int32) for f in NUMERIC_FIELDS}
+        self._tags_bm25 = BM25Index(self.config.bm25_k1, self.config.bm25_b)
+        self._text_bm25 = BM25Index(self.config.bm25_k1, self.config.bm25_b)
+        self._vectors: Optional[np.memmap] = None
+        self._capacity = 0
+        self._load()
+
+    # --- 持久化 ---
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.data_dir, name)
+
+    def _load(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        meta = {}
+        if os.path.exists(self._path(self.META_FILE)):
+            with open(self._path(self.META_FILE), encoding="utf-8") as f:
+                meta = json.load(f)
+        if meta and meta.get("dims") != self.dims:
+            logger.warning(f"Local search dims changed ({meta.get('dims')} -> {self.dims}), rebuilding from scratch.")
+            for name in (self.VECTOR_FILE, self.DOCS_FILE, self.META_FILE):
+                if os.path.exists(self._path(name)):
+                    os.remove(self._path(name))
+            meta = {}
+
+        latest: Dict[int, Dict] = {}
+        lines = 0
+        if os.path.exists(self._path(self.DOCS_FILE)):
+            with open(self._path(self.DOCS_FILE), encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        doc = json.loads(line)
+                        latest[doc.pop("row")] = doc
+                        lines += 1
+
+        self._open_vectors(max(meta.get("capacity", 0), self.config.initial_capacity, len(latest)))
+        for row in sorted(latest):
+            self._ensure_row(row)
+            self._set_doc(row, latest[row])
+        if lines > 2 * len(latest) + 100:
+            self._compact()
+        logger.info(f"Local search engine loaded {len(self._rows)} docs from {self.data_dir}")
+
+    def _open_vectors(self, capacity: int):
+        """打开 (必要时扩容) memmap 向量矩阵；r+ 模式下 shape 超过文件大小时 NumPy 会自动扩展文件"""
+        if self._vectors is not None:
+            self._vectors.flush()
+        path = self._path(self.VECTOR_FILE)
+        open(path, "ab").close()
+        self._vectors = np.memmap(path, dtype=np.float32, mode="r+", shape=(capacity, self.dims))
+        self._capacity = capacity
+        for field, old in self._numeric.items():
+            values = np.full(capacity, -1, dtype=np.int32)
+            values[:len(old)] = old[:capacity]
+            self._numeric[field] = values
+        with open(self._path(self.META_FILE), "w", encoding="utf-8") as f:
+            json.dump({"dims": self.dims, "capacity": capacity}, f)
+
+    def _ensure_row(self, row: int):
+        if row >= self._capacity:
+            self._open_vectors(max(row + 1, self._capacity * 2))
+        while len(self._docs) <= row:
+            self._docs.append(None)
+
+    def _compact(self):
+        """重写 docs.jsonl，只保留每行的最新版本"""
+        tmp = self._path(self.DOCS_FILE + ".tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for row, doc in enumerate(self._docs):
+                if doc is not None:
+                    f.write(json.dumps({"row": row, **doc}, ensure_ascii=False) + "\n")
+        os.replace(tmp, self._path(self.DOCS_FILE))
+
+    def flush(self):
+        with self._lock:
+            if self._vectors is not None:
+                self._vectors.flush()
+
+    # --- 写入 ---
+
+    def _set_doc(self, row: int, doc: Dict[str, Any]):
+        old = self._docs[row]
+        if old is not None:
+            for field in KEYWORD_FIELDS:
+                self._keyword[field][old.get(field)].discard(row)
+        self._docs[row] = doc
+        self._rows[doc["user_id"]] = row
+        for field in KEYWORD_FIELDS:
+            self._keyword[field][doc.get(field)].add(row)
+        for field in NUMERIC_FIELDS:
+            self._numeric[field][row] = doc.get(field) or -1
+        self._tags_bm25.set(row, tokenize(doc.get("tags", "")))
+        self._text_bm25.set(row, tokenize(doc.get("profile_text", "")))
+
+    def index_user(self, user_id: str, profile_data: Dict[str, Any], vector: List[float], raise_on_error: bool = False):
+        """与 ESManager.index_user 相同的签名: 按 user_id 覆盖写入 (幂等)"""
+        try:
+            self.index_users([(user_id, profile_data, vector)])
+        except Exception as e:
+            logger.error(f"Error indexing user {user_id} locally: {e}")
+            if raise_on_error:
+                raise
+
+    def index_users(self, items: Iterable):
+        """批量写入 [(user_id, profile_data, vector), ...]，最后统一 flush 一次"""
+        with self._lock:
+            lines = []
+            for user_id, profile_data, vector in items:
+                doc = {
+                    "user_id": user_id,
+                    "gender": profile_data.get("gender"),
+                    "city": profile_data.get("city"),
+                    "age": profile_data.get("age"),
+                    "birth_year": profile_data.get("birth_year"),
+                    "tags": profile_data.get("tags", ""),
+                    "profile_text": profile_data.get("profile_text", ""),
+                }
+                row = self._rows.get(user_id, len(self._docs))
+                self._ensure_row(row)
+                vec = np.asarray(vector, dtype=np.float32)
+                norm = float(np.linalg.norm(vec))
+                self._vectors[row] = vec / norm if norm else vec
+                self._set_doc(row, doc)
+                lines.append(json.dumps({"row": row, **doc}, ensure_ascii=False) + "\n")
+            self._vectors.flush()
+            with open(self._path(self.DOCS_FILE), "a", encoding="utf-8") as f:
+                f.writelines(lines)
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._rows
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    # --- 检索 ---
+
+    def _rows_for(self, field: str, values) -> List[int]:
+        values = values if isinstance(values, list) else [values]
+        if field == "user_id":
+            return [self._rows[v] for v in values if v in self._rows]
+        if field in self._keyword:
+            return [row for v in values for row in self._keyword[field].get(v, ())]
+        raise ValueError(f"Unsupported filter field: {field}")
+
+    def _mask(self, n: int, filters: Optional[Dict], exclude: Optional[Dict]) -> np.ndarray:
+        """与 ESManager.build_filter 相同的语义: 值 -> term，列表 -> terms，{gte, lte} -> range (NUMERIC_FIELDS)"""
+        mask = np.array([doc is not None for doc in self._docs[:n]], dtype=bool)
+        for field, cond in (filters or {}).items():
+            if isinstance(cond, dict):
+                if field not in self._numeric:
+                    raise ValueError(f"Unsupported range field: {field}")
+                values = self._numeric[field][:n]
+                if "gte" in cond: mask &= values >= cond["gte"]
+                if "gt" in cond: mask &= values > cond["gt"]
+                if "lte" in cond: mask &= (values <= cond["lte"]) & (values >= 0)
+                if "lt" in cond: mask &= (values < cond["lt"]) & (values >= 0)
+            else:
+                allowed = np.zeros(n, dtype=bool)
+                allowed[self._rows_for(field, cond)] = True
+                mask &= allowed
+        for field, values in (exclude or {}).items():
+            mask[self._rows_for(field, values)] = False
+        return mask
+
+    def hybrid_search(self,
+                      query_text: str,
+                      query_vector: List[float],
+                      top_k: int = 20,
+                      filters: Optional[Dict] = None,
+                      exclude: Optional[Dict] = None) -> List[Dict]:
+        """与 ESManager.hybrid_search 相同的签名与返回格式"""
+        k = top_k * 2 # 多取一些用于融合
+        with self._lock:
+            n = len(self._docs)
+            if not n:
+                return []
+            mask = self._mask(n, filters, exclude)
+            rows = np.flatnonzero(mask)
+            if not rows.size:
+                return []
+
+            # --- 1. 向量检索 (过滤后精确计算余弦) ---
+            knn_docs = []
+            if query_vector is not None:
+                q = np.asarray(query_vector, dtype=np.float32)
+                q_norm = float(np.linalg.norm(q))
+                if q_norm:
+                    # 整个矩阵做一次 GEMV 再按掩码取行，比先拷贝过滤后的行更快
+                    sims = (self._vectors[:n] @ (q / q_norm))[rows]
+                    top = np.argpartition(-sims, k - 1)[:k] if sims.size > k else np.arange(sims.size)
+                    top = top[np.argsort(-sims[top])]
+                    knn_docs = [self._docs[rows[i]] for i in top]
+
+            # --- 2. BM25 (tags^3 与 profile_text 取最大，对应 multi_match best_fields) ---
+            tokens = tokenize(query_text)
+            tag_scores = self._tags_bm25.scores(tokens, mask)
+            text_scores = self._text_bm25.scores(tokens, mask)
+            scores = {row: max(3 * tag_scores.get(row, 0.0), text_scores.get(row, 0.0))
+                      for row in set(tag_scores) | set(text_scores)}
+            text_docs = [self._docs[row] for row in sorted(scores, key=scores.get, reverse=True)[:k]]
+
+        # --- 3. RRF 融合 ---
+        return rrf_fuse([knn_docs, text_docs], top_k)
+
+
+async def abackfill_from_mongo(engine: LocalSearchEngine, async_db, embedding_service, batch_size: int = 64) -> int:
+    """把已生成画像摘要、但尚未进入本地引擎的用户补齐 (向量化 + 写入)，返回写入人数"""
+    from app.services.ai.workflows.user_init import UserInitializationService
+
+    added = 0
+    batch: List[Dict] = []
+
+    async def flush():
+        nonlocal added
+        uids = [p["user_id"] for p in batch]
+        basics = {b["_id"]: b async for b in async_db.users_basic.find({"_id": {"$in": uids}})}
+        summaries = [p.get("user_summary", "") for p in batch]
+        vectors = await embedding_service.aembed_documents(summaries)
+        items = [
+            (str(p["user_id"]),
+             UserInitializationService.build_es_profile(basics.get(p["user_id"], {}), p, summary),
+             vector)
+            for p, summary, vector in zip(batch, summaries, vectors)
+        ]
+        await asyncio.to_thread(engine.index_users, items)
+        added += len(items)
+        batch.clear()
+
+    cursor = async_db.profile.find({"user_summary": {"$nin": [None, ""]}})
+    async for profile in cursor:
+        if str(profile.get("user_id")) in engine:
+            continue
+        batch.append(profile)
+        if len(batch) >= batch_size:
+            await flush()
+    if batch:
+        await flush()
+    print(f"✅ [LocalSearch] 回填完成: 新增 {added} 人，共 {len(engine)} 人")
+    return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process hybrid search engine maintenance")
+    parser.add_argument("--backfill", action="store_true", help="从 Mongo 回填尚未入库的用户")
+    args = parser.parse_args()
+
+    from app.core.container import container
+    engine = container.local_search
+    if args.backfill:
+        asyncio.run(abackfill_from_mongo(
+            engine, container.async_db, container.embedding_service, settings.local_search.backfill_batch_size
+        ))
+    print(f"docs={len(engine)} capacity={engine._capacity} dims={engine.dims} dir={engine.data_dir}")
+    engine.flush()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""一次性数据迁移脚本 (python -m app.db.migrations.<name>)"""
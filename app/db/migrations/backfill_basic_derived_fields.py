@@ -0,0 +1,57 @@
+# -*- coding: utf-8 -*-
+"""
+回填 users_basic 的物化字段 `bmi` / `birth_year` (一次性迁移，可重复执行)
+
+用法:
+    python -m app.db.migrations.backfill_basic_derived_fields [--dry-run] [--batch-size 1000]
+
+新写入 (注册 / 更新资料 / 数据生成) 已在写入时维护这两个字段，这里只处理历史数据。
+"""
+import argparse
+
+from pymongo import UpdateOne
+
+from app.core.utils.cal_utils import derive_basic_fields
+
+
+def backfill(db_manager, batch_size: int = 1000, dry_run: bool = False) -> dict:
+    stats = {"scanned": 0, "updated": 0, "skipped": 0}
+    ops = []
+    cursor = db_manager.users_basic.find(
+        {}, {"height": 1, "weight": 1, "birthday": 1, "bmi": 1, "birth_year": 1}
+    ).batch_size(batch_size)
+
+    for doc in cursor:
+        stats["scanned"] += 1
+        derived = derive_basic_fields(doc)
+        changed = {k: v for k, v in derived.items() if doc.get(k) != v}
+        if not changed:
+            stats["skipped"] += 1
+            continue
+        ops.append(UpdateOne({"_id": doc["_id"]}, {"$set": changed}))
+        if len(ops) >= batch_size:
+            if not dry_run:
+                db_manager.users_basic.bulk_write(ops, ordered=False)
+            stats["updated"] += len(ops)
+            ops = []
+
+    if ops:
+        if not dry_run:
+            db_manager.users_basic.bulk_write(ops, ordered=False)
+        stats["updated"] += len(ops)
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill users_basic.bmi / birth_year")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true", help="只统计需要更新的文档数")
+    args = parser.parse_args()
+
+    from app.core.container import container
+    from app.db.mongo_indexes import apply_indexes
+
+    result = backfill(container.db, args.batch_size, args.dry_run)
+    print(f"{'🔍 [DRY-RUN]' if args.dry_run else '✅'} users_basic 回填完成: {result}")
+    if not args.dry_run:
+        apply_indexes(container.db) # 确保新的硬过滤复合索引存在
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+"""
+回填 ES 画像文档的 `birth_year` 字段 (一次性迁移，可重复执行)
+
+用法:
+    python -m app.db.migrations.backfill_es_birth_year [--dry-run] [--batch-size 1000]
+
+检索规划的 es_native 策略按 birth_year 过滤 (age 是结算时的快照，会随生日过期)。
+新结算的用户在建索引时已写入该字段，这里只对历史文档做局部更新 (ES 中不存在的用户跳过)。
+"""
+import argparse
+
+from elasticsearch import helpers
+
+
+def backfill(db_manager, es_manager, batch_size: int = 1000, dry_run: bool = False) -> dict:
+    stats = {"scanned": 0, "updated": 0, "missing": 0}
+    es_manager.create_index_if_not_exists() # 确保 mapping 中已有 birth_year
+    cursor = db_manager.users_basic.find(
+        {"is_completed": True, "birth_year": {"$ne": None}}, {"birth_year": 1}
+    ).batch_size(batch_size)
+
+    actions = []
+
+    def flush():
+        if not dry_run:
+            success, errors = helpers.bulk(es_manager.client, actions, raise_on_error=False, stats_only=False)
+            stats["updated"] += success
+            stats["missing"] += len(errors)
+        else:
+            stats["updated"] += len(actions)
+        actions.clear()
+
+    for doc in cursor:
+        stats["scanned"] += 1
+        actions.append({
+            "_op_type": "update",
+            "_index": es_manager.index_name,
+            "_id": str(doc["_id"]),
+            "doc": {"birth_year": doc["birth_year"]},
+        })
+        if len(actions) >= batch_size:
+            flush()
+    if actions:
+        flush()
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Backfill birth_year into ES profile documents")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--dry-run", action="store_true", help="只统计需要更新的文档数")
+    args = parser.parse_args()
+
+    from app.core.container import container
+
+    result = backfill(container.db, container.es, args.batch_size, args.dry_run)
+    print(f"{'🔍 [DRY-RUN]' if args.dry_run else '✅'} ES birth_year 回填完成: {result}")
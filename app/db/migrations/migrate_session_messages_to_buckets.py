@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+把 chat_sessions 中内嵌的 messages 数组迁移到分桶集合 chat_messages (一次性迁移，可重复执行)
+
+用法:
+    python -m app.db.migrations.migrate_session_messages_to_buckets [--dry-run]
+
+每个会话: 按序号切分为 MESSAGE_BUCKET_SIZE 条一桶，以 (session_id, bucket) 为键整桶 upsert，
+写完所有桶后再设置 message_count 并 $unset 原 messages 字段。中途失败重跑会得到相同结果。
+"""
+import argparse
+from datetime import datetime
+
+from pymongo import ReplaceOne
+
+from app.services.session_service import MESSAGE_BUCKET_SIZE
+
+
+def migrate(db_manager, bucket_size: int = MESSAGE_BUCKET_SIZE, dry_run: bool = False) -> dict:
+    stats = {"sessions": 0, "messages": 0, "buckets": 0}
+    cursor = db_manager.chat_sessions.find(
+        {"messages": {"$exists": True}}, {"messages": 1, "created_at": 1}
+    )
+    for session in cursor:
+        messages = session.get("messages") or []
+        sid = session["_id"]
+        now = datetime.now()
+
+        ops = []
+        for bucket_start in range(0, len(messages), bucket_size):
+            chunk = [
+                {**msg, "seq": bucket_start + offset}
+                for offset, msg in enumerate(messages[bucket_start: bucket_start + bucket_size])
+            ]
+            ops.append(ReplaceOne(
+                {"session_id": sid, "bucket": bucket_start // bucket_size},
+                {
+                    "session_id": sid,
+                    "bucket": bucket_start // bucket_size,
+                    "messages": chunk,
+                    "count": len(chunk),
+                    "created_at": chunk[0].get("timestamp") or session.get("created_at") or now,
+                    "updated_at": now
+                },
+                upsert=True
+            ))
+
+        stats["sessions"] += 1
+        stats["messages"] += len(messages)
+        stats["buckets"] += len(ops)
+        if dry_run:
+            continue
+
+        if ops:
+            db_manager.chat_messages.bulk_write(ops, ordered=True)
+        db_manager.chat_sessions.update_one(
+            {"_id": sid},
+            {"$set": {"message_count": len(messages)}, "$unset": {"messages": ""}}
+        )
+    return stats
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move embedded chat_sessions.messages into chat_messages buckets")
+    parser.add_argument("--dry-run", action="store_true", help="只统计，不写入")
+    args = parser.parse_args()
+
+    from app.core.container import container
+    from app.db.mongo_indexes import apply_indexes
+
+    if not args.dry_run:
+        apply_indexes(container.db) # 先建 (session_id, bucket) 唯一索引
+    result = migrate(container.db, dry_run=args.dry_run)
+    print(f"{'🔍 [DRY-RUN]' if args.dry_run else '✅'} 会话消息迁移完成: {result}")
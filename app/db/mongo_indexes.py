@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+MongoDB 索引声明 + 查询计划校验
+
+- `INDEX_SPEC`: 各集合的索引声明 (集合属性名 -> IndexModel 列表)，应用启动时由 lifespan 幂等创建；
+  索引名使用 Mongo 默认命名 (如 `user_id_1`)，与历史上手工创建的同键索引兼容；
+- `hot_queries()`: 在线链路上的热点查询形状，CLI 会逐个 `explain()`，出现 COLLSCAN 即失败。
+
+命令行:
+    python -m app.db.mongo_indexes --apply --check
+"""
+import argparse
+import sys
+from datetime import datetime
+from typing import Dict, List
+
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, IndexModel
+
+INDEX_SPEC: Dict[str, List[IndexModel]] = {
+    "users_auth": [
+        IndexModel([("account", ASCENDING)], unique=True),
+    ],
+    "users_basic": [
+        # 硬过滤: 性别等值 (总是存在) -> 城市 $in -> 物化的出生年份 / 身高 / BMI 范围
+        IndexModel([("gender", ASCENDING), ("city", ASCENDING), ("birth_year", ASCENDING),
+                    ("height", ASCENDING), ("bmi", ASCENDING)]),
+    ],
+    "users_persona": [
+        IndexModel([("user_id", ASCENDING)]),
+    ],
+    "profile": [
+        IndexModel([("user_id", ASCENDING)]),
+    ],
+    "users_states": [
+        IndexModel([("user_id", ASCENDING)]),
+        # 结算 Outbox Worker 领取任务
+        IndexModel([("finalize_outbox.status", ASCENDING), ("finalize_outbox.next_attempt_at", ASCENDING)], sparse=True),
+    ],
+    "onboarding_dialogues": [
+        IndexModel([("user_id", ASCENDING)]),
+    ],
+    "onboarding_archive": [
+        IndexModel([("user_id", ASCENDING)], unique=True),
+    ],
+    "chat_sessions": [
+        # 最近活跃会话: user_id + is_active 等值，按 updated_at 倒序
+        IndexModel([("user_id", ASCENDING), ("is_active", ASCENDING), ("updated_at", DESCENDING)]),
+    ],
+    "chat_messages": [
+        # 会话消息桶: 按 session 定位，按桶号取尾部
+        IndexModel([("session_id", ASCENDING), ("bucket", ASCENDING)], unique=True),
+    ],
+    "chat_records": [
+        IndexModel([("user_id", ASCENDING)]),
+    ],
+}
+
+
+def hot_queries() -> List[Dict]:
+    """热点查询形状 (参数取样例值，只用于 explain)"""
+    uid = ObjectId()
+    now = datetime.now()
+    return [
+        {"name": "auth.by_account", "collection": "users_auth", "filter": {"account": "13800000000"}},
+        {"name": "profile.by_user", "collection": "profile", "filter": {"user_id": uid}},
+        {"name": "states.by_user", "collection": "users_states", "filter": {"user_id": uid}},
+        {"name": "onboarding.by_user", "collection": "onboarding_dialogues", "filter": {"user_id": uid}},
+        {"name": "persona.by_user", "collection": "users_persona", "filter": {"user_id": uid}},
+        {"name": "sessions.last_active", "collection": "chat_sessions",
+         "filter": {"user_id": str(uid), "is_active": True}, "sort": [("updated_at", DESCENDING)]},
+        {"name": "messages.tail_buckets", "collection": "chat_messages",
+         "filter": {"session_id": uid}, "sort": [("bucket", DESCENDING)], "limit": 2},
+        {"name": "basic.hard_filter_full", "collection": "users_basic",
+         "filter": {"gender": "female", "city": {"$in": ["上海", "杭州"]},
+                    "height": {"$gte": 160, "$lte": 175}, "bmi": {"$gte": 18.5, "$lte": 24},
+                    "birth_year": {"$gte": now.year - 35, "$lte": now.year - 25},
+                    "_id": {"$nin": [uid]}}},
+        {"name": "basic.hard_filter_gender_only", "collection": "users_basic",
+         "filter": {"gender": "male", "_id": {"$nin": [uid]}}},
+        {"name": "basic.hard_filter_height", "collection": "users_basic",
+         "filter": {"gender": "male", "height": {"$gte": 175}, "_id": {"$nin": [uid]}}},
+        {"name": "basic.hard_filter_age_bmi", "collection": "users_basic",
+         "filter": {"gender": "female", "birth_year": {"$gte": now.year - 30}, "bmi": {"$lte": 22},
+                    "_id": {"$nin": [uid]}}},
+        {"name": "states.claim_outbox", "collection": "users_states",
+         "filter": {"$or": [
+             {"finalize_outbox.status": {"$in": ["pending", "failed"]}, "finalize_outbox.next_attempt_at": {"$lte": now}},
+             {"finalize_outbox.status": "processing", "finalize_outbox.locked_until": {"$lte": now}}
+         ]},
+         "sort": [("finalize_outbox.next_attempt_at", ASCENDING)]},
+    ]
+
+
+def apply_indexes(db_manager) -> Dict[str, List[str]]:
+    """[同步] 按声明创建索引 (已存在则跳过)，返回每个集合创建/确认的索引名"""
+    created = {}
+    for attr, models in INDEX_SPEC.items():
+        try:
+            created[attr] = getattr(db_manager, attr).create_indexes(models)
+        except Exception as e:
+            print(f"⚠️ [Index] {attr} 索引创建失败: {e}")
+    return created
+
+
+async def aapply_indexes(async_db_manager) -> Dict[str, List[str]]:
+    """[异步] 同上，供 lifespan 使用"""
+    created = {}
+    for attr, models in INDEX_SPEC.items():
+        try:
+            created[attr] = await getattr(async_db_manager, attr).create_indexes(models)
+        except Exception as e:
+            print(f"⚠️ [Index] {attr} 索引创建失败: {e}")
+    return created
+
+
+def _collect_stages(plan) -> List[str]:
+    """递归收集执行计划中的 stage 名称 (兼容经典引擎与 SBE 的 queryPlan 嵌套)"""
+    stages = []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        for key in ("queryPlan", "inputStage", "inputStages", "shards"):
+            if key in plan:
+                stages.extend(_collect_stages(plan[key]))
+    elif isinstance(plan, list):
+        for p in plan:
+            stages.extend(_collect_stages(p))
+    return stages
+
+
+def check_query_plans(db_manager) -> List[Dict]:
+    """对每个热点查询执行 explain()，返回 [{name, stages, collscan}]"""
+    results = []
+    for q in hot_queries():
+        cursor = getattr(db_manager, q["collection"]).find(q["filter"], q.get("projection"))
+        if q.get("sort"):
+            cursor = cursor.sort(q["sort"])
+        plan = cursor.limit(q.get("limit", 0)).explain()
+        stages = _collect_stages(plan.get("queryPlanner", {}).get("winningPlan", {}))
+        results.append({"name": q["name"], "stages": stages, "collscan": "COLLSCAN" in stages})
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="MongoDB index management / query plan check")
+    parser.add_argument("--apply", action="store_true", help="按声明创建索引")
+    parser.add_argument("--check", action="store_true", help="explain 热点查询，出现 COLLSCAN 时以非零状态退出")
+    args = parser.parse_args()
+
+    from app.core.container import container
+    db = container.db
+
+    if args.apply:
+        for coll, names in apply_indexes(db).items():
+            print(f"✅ {coll}: {names}")
+
+    if args.check or not args.apply:
+        failed = False
+        for r in check_query_plans(db):
+            mark = "❌" if r["collscan"] else "✅"
+            print(f"{mark} {r['name']:<32} {' -> '.join(r['stages'])}")
+            failed = failed or r["collscan"]
+        if failed:
+            print("❌ 存在 COLLSCAN 的热点查询，请检查 INDEX_SPEC")
+            sys.exit(1)
+        print("✅ 所有热点查询均命中索引")
@@ -2,7 +2,9 @@
 from typing import Dict, Any, List, Tuple, Optional
 from datetime import datetime
 from bson import ObjectId
-from pymongo import MongoClient
+from pymongo import MongoClient, ReturnDocument
+
+from app.core.utils.cal_utils import derive_basic_fields
 
 class MongoDBManager:
     """MongoDB 数据库管理器"""
@@ -15,10 +17,12 @@ class MongoDBManager:
         self.users_basic = self.db["users_basic"]
         self.users_persona = self.db["users_persona"]
         self.onboarding_dialogues = self.db["users_onboarding_dialogues"]
+        self.onboarding_archive = self.db["users_onboarding_archive"] # 已结算对话的 zstd 压缩冷存储
         self.chat_records = self.db["chat_records"]
         self.profile = self.db["users_profile"]
         self.users_auth = self.db["users_auth"]
         self.chat_sessions = self.db["chat_sessions"]
+        self.chat_messages = self.db["chat_messages"] # 会话消息分桶存储
         self.users_states = self.db["users_states"] # 状态表 (注意：迁移脚本里用的是 user_states，这里保持一致)
         
         # Indexes
@@ -30,6 +34,7 @@ class MongoDBManager:
         """插入用户基础信息和性格种子"""
         # 插入基础信息
         user_basic = {k: v for k, v in user_data.items() if k != "persona_seed"}
+        user_basic.update(derive_basic_fields(user_basic)) # 物化 bmi / birth_year，供硬过滤走索引
         user_basic["created_at"] = datetime.now()
         result = self.users_basic.insert_one(user_basic)
         user_id = result.inserted_id
@@ -74,6 +79,43 @@ class MongoDBManager:
         }
         self.onboarding_dialogues.insert_one(dialogue_data)
 
+    def push_onboarding_message(self, user_id: ObjectId, message: Dict, tail: int = 10) -> Dict:
+        """
+        追加一条 onboarding 消息，并在同一次 find_one_and_update 中返回:
+        - 最近 `tail` 条消息 ($slice)，不再读取整个 messages 数组
+        - 维护好的 `user_msg_count` 计数器 ($inc)，不再在 Python 里数数
+        - 后台提取写回的 `completion_hint` / `termination`
+        """
+        update = {
+            "$push": {"messages": message},
+            "$set": {"updated_at": datetime.now()}
+        }
+        if message.get("role") == "user":
+            update["$inc"] = {"user_msg_count": 1}
+
+        return self.onboarding_dialogues.find_one_and_update(
+            {"user_id": user_id},
+            update,
+            projection={
+                "messages": {"$slice": -tail},
+                "user_msg_count": 1,
+                "completion_hint": 1,
+                "termination": 1
+            },
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        ) or {}
+
+    def append_onboarding_reply(self, user_id: ObjectId, message: Dict, state_updates: Optional[Dict] = None):
+        """在回合结束时写入 AI 回复，并与本轮的其他状态更新合并为一次写操作"""
+        set_fields = {"updated_at": datetime.now()}
+        if state_updates:
+            set_fields.update(state_updates)
+        self.onboarding_dialogues.update_one(
+            {"user_id": user_id},
+            {"$push": {"messages": message}, "$set": set_fields}
+        )
+
     def insert_chat_record(self, user_id: ObjectId, partner_id: ObjectId,
                            messages: List[Dict]):
         """插入聊天记录"""
@@ -1,26 +1,98 @@
+import asyncio
 from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.v1.endpoints import chat, users, auth
+from app.api.v1.endpoints import chat, users, auth, admin
+from app.core.config import settings
 from app.core.container import container
 
+async def _warmup_local_search():
+    try:
+        engine = await asyncio.to_thread(lambda: container.local_search)
+        print(f"✅ Local search engine loaded ({len(engine)} docs, mode={settings.local_search.mode}).")
+        if settings.local_search.backfill_on_startup:
+            from app.db.local_search import abackfill_from_mongo
+            await abackfill_from_mongo(
+                engine, container.async_db, container.embedding_service, settings.local_search.backfill_batch_size
+            )
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"⚠️ Startup Warning: Local search warmup failed: {e}")
+
 # --- Lifespan (生命周期) 管理 ---
 # 替代旧版的 @app.on_event("startup")
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     # [Startup] 启动时执行
     print("🚀 Application starting up...")
+    local_mode = settings.local_search.mode
+    if local_mode != "primary":
+        try:
+            # 自动检查 ES 索引是否存在
+            container.es.create_index_if_not_exists()
+            print("✅ Elasticsearch index check passed.")
+        except Exception as e:
+            print(f"⚠️ Startup Warning: ES Index check failed: {e}")
+
     try:
-        # 自动检查 ES 索引是否存在
-        container.es.create_index_if_not_exists()
-        print("✅ Elasticsearch index check passed.")
+        await container.async_db.ensure_indexes()
+        print("✅ MongoDB index check passed.")
     except Exception as e:
-        print(f"⚠️ Startup Warning: ES Index check failed: {e}")
+        print(f"⚠️ Startup Warning: Mongo index check failed: {e}")
+
+    # 预热向量模型 (并对非 torch 后端做一致性校验)
+    try:
+        embedding = container.embedding_service
+        if settings.embedding.warmup_on_startup:
+            embedding.warmup()
+            print(f"✅ Embedding backend '{embedding.backend_name}' warmed up.")
+        if settings.embedding.parity_check_on_startup:
+            # 服务启动只读缓存的结论，不加载 torch (否则又回到 torch 的冷启动)
+            min_cos = embedding.parity_check(settings.embedding.parity_threshold, allow_torch=False)
+            if min_cos is None:
+                print("⚠️ Embedding parity not verified yet: run `python -m app.services.embedding_service`.")
+            else:
+                print(f"✅ Embedding parity check passed (min cosine {min_cos:.4f}).")
+    except RuntimeError:
+        raise
+    except Exception as e:
+        print(f"⚠️ Startup Warning: Embedding warmup failed: {e}")
+
+    # 启动 Onboarding 结算 Outbox Worker
+    container.finalization_worker.start()
+
+    # 启动 Chroma 对话块保留任务 (按配置开启)
+    if settings.chroma_retention.enabled:
+        container.retention_scheduler.start()
+    # 启动已结算对话的冷存储归档任务 (按配置开启)
+    if settings.dialogue_archive.enabled:
+        container.archive_scheduler.start()
+    # 启动基数统计刷新 (检索策略规划依赖)
+    if settings.retrieval_planner.enabled:
+        container.stats_scheduler.start()
+    # 进程内检索引擎: 线程中加载索引，并在后台从 Mongo 回填尚未入库的用户
+    backfill_task = None
+    if local_mode != "off":
+        backfill_task = asyncio.create_task(_warmup_local_search())
         
     yield # --- 应用运行中 ---
 
     # [Shutdown] 关闭时执行
     print("🛑 Application shutting down...")
+    await container.finalization_worker.stop()
+    if settings.chroma_retention.enabled:
+        await container.retention_scheduler.stop()
+    if settings.dialogue_archive.enabled:
+        await container.archive_scheduler.stop()
+    if settings.retrieval_planner.enabled:
+        await container.stats_scheduler.stop()
+    if backfill_task is not None:
+        backfill_task.cancel()
+        await asyncio.gather(backfill_task, return_exceptions=True)
+    container.async_db.close()
+    container.password_hasher.shutdown()
+    container.bulk_importer.close()
 
 # --- App 实例化 ---
 app = FastAPI(
@@ -44,6 +116,7 @@ app.add_middleware(
 app.include_router(auth.router, prefix="/api/v1/auth", tags=["auth"])
 app.include_router(chat.router, prefix="/api/v1/chat", tags=["chat"])
 app.include_router(users.router, prefix="/api/v1/users", tags=["users"])
+app.include_router(admin.router, prefix="/api/v1/admin", tags=["admin"])
 
 @app.get("/")
 def root():
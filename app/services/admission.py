@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+聊天接口的准入控制 (Admission Control / Load Shedding)
+
+LLM 供应商变慢时，如果不加限制，每个请求都会占着一次图运行、内存和数据库连接无限堆积，最终所有人的延迟一起崩溃。
+这里在进入图之前做三层控制：
+1. 每用户并发上限 (默认 1): 同一用户已有图在跑时直接返回 busy；
+2. 全局在途上限: 超出的请求进入 FIFO 等待队列；
+3. 队列截止时间: 按近期单次耗时 (EWMA) 估算排队时间，预计等不到就立刻拒绝 (429)，
+   已入队但超过截止时间仍未轮到的请求同样拒绝，而不是无限等待。
+"""
+import asyncio
+import math
+import time
+from collections import defaultdict, deque
+from contextlib import asynccontextmanager
+from typing import Deque, Dict, Optional
+
+from app.core.config import settings, AdmissionConfig
+
+
+class AdmissionRejected(Exception):
+    """请求未获准入。`reason`: user_busy / queue_full / overloaded / queue_timeout"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class AdmissionController:
+    def __init__(self, config: Optional[AdmissionConfig] = None):
+        self.config = config or settings.admission
+        self._in_flight = 0
+        self._waiters: Deque[asyncio.Future] = deque()
+        self._per_user: Dict[str, int] = defaultdict(int)
+        self._service_ewma = self.config.initial_service_seconds
+        self._queue_waits: Deque[float] = deque(maxlen=1000) # 最近的排队耗时 (秒)，用于分位数
+        self.stats = {"admitted": 0, "completed": 0, "failed": 0, "cancelled": 0, "cancelled_queued": 0,
+                      "rejected_user_busy": 0, "rejected_queue_full": 0, "rejected_overloaded": 0,
+                      "rejected_queue_timeout": 0}
+
+    # --- 估算 ---
+
+    def estimated_wait(self, position: Optional[int] = None) -> float:
+        """排在第 `position` 位 (默认队尾) 的请求预计等待秒数: 前面的请求数 / 并发数 * 单次耗时"""
+        position = len(self._waiters) if position is None else position
+        if self._in_flight < self.config.max_in_flight and position == 0:
+            return 0.0
+        return (position + 1) / self.config.max_in_flight * self._service_ewma
+
+    # --- 准入 ---
+
+    @asynccontextmanager
+    async def admit(self, user_id: str):
+        """
+        用法:
+            async with container.admission.admit(user_id):
+                await app.ainvoke(...)
+        未获准入时抛出 AdmissionRejected。
+        """
+        if not self.config.enabled:
+            yield
+            return
+
+        self._reserve_user(user_id)
+        try:
+            await self._acquire_slot()
+        except BaseException:
+            self._release_user(user_id)
+            raise
+
+        start = time.perf_counter()
+        outcome = "failed"
+        try:
+            yield
+            outcome = "completed"
+        except asyncio.CancelledError:
+            # 客户端断开导致的取消 (图运行被中断)
+            outcome = "cancelled"
+            raise
+        finally:
+            if outcome != "cancelled": # 被取消的运行耗时不具代表性，不计入 EWMA
+                self._record_service_time(time.perf_counter() - start)
+            self.stats[outcome] += 1
+            self._release_slot()
+            self._release_user(user_id)
+
+    def _reserve_user(self, user_id: str):
+        if self._per_user[user_id] >= self.config.per_user_limit:
+            self.stats["rejected_user_busy"] += 1
+            raise AdmissionRejected("user_busy", self._service_ewma)
+        self._per_user[user_id] += 1
+
+    def _release_user(self, user_id: str):
+        self._per_user[user_id] -= 1
+        if self._per_user[user_id] <= 0:
+            del self._per_user[user_id]
+
+    async def _acquire_slot(self):
+        if self._in_flight < self.config.max_in_flight and not self._waiters:
+            self._in_flight += 1
+            self._admitted(0.0)
+            return
+
+        if len(self._waiters) >= self.config.max_queue:
+            self.stats["rejected_queue_full"] += 1
+            raise AdmissionRejected("queue_full", self.estimated_wait())
+        estimate = self.estimated_wait()
+        if estimate > self.config.queue_deadline_seconds:
+            # 预计等不到: 立即拒绝，让客户端尽快退避，而不是占着连接排队
+            self.stats["rejected_overloaded"] += 1
+            raise AdmissionRejected("overloaded", estimate)
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        enqueued = time.perf_counter()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.config.queue_deadline_seconds)
+        except asyncio.TimeoutError:
+            if not waiter.done():
+                self._waiters.remove(waiter)
+                waiter.cancel()
+                self.stats["rejected_queue_timeout"] += 1
+                raise AdmissionRejected("queue_timeout", self.estimated_wait())
+            # 超时与被唤醒同时发生：名额已经转交给我们，照常执行
+        except BaseException as e:
+            # 调用方取消 (如客户端断开)：如果名额已转交则归还
+            if isinstance(e, asyncio.CancelledError):
+                self.stats["cancelled_queued"] += 1
+            if waiter.done() and not waiter.cancelled():
+                self._release_slot()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+                waiter.cancel()
+            raise
+        self._admitted(time.perf_counter() - enqueued)
+
+    def _admitted(self, waited: float):
+        self.stats["admitted"] += 1
+        self._queue_waits.append(waited)
+
+    def _release_slot(self):
+        # 名额直接转交给队首等待者 (in_flight 不变)，保证 FIFO 且不会被新请求插队
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self._in_flight -= 1
+
+    def _record_service_time(self, seconds: float):
+        alpha = self.config.ewma_alpha
+        self._service_ewma = (1 - alpha) * self._service_ewma + alpha * seconds
+
+    # --- 指标 ---
+
+    def snapshot(self) -> Dict:
+        waits = sorted(self._queue_waits)
+
+        def pct(q: float) -> float:
+            return round(waits[int(q * (len(waits) - 1))], 3) if waits else 0.0
+
+        return {
+            **self.stats,
+            "in_flight": self._in_flight,
+            "queued": len(self._waiters),
+            "active_users": len(self._per_user),
+            "max_in_flight": self.config.max_in_flight,
+            "service_seconds_ewma": round(self._service_ewma, 3),
+            "estimated_wait_seconds": round(self.estimated_wait(), 3),
+            "queue_wait_p50": pct(0.5),
+            "queue_wait_p99": pct(0.99),
+        }
@@ -23,8 +23,7 @@ class BaseProfileExtractor:
         """子类必须实现此方法，提供具体的 System Prompt"""
         raise NotImplementedError
 
-    def extract(self, conversation_text: str) -> Optional[BaseModel]:
-        """执行提取逻辑"""
+    def _build_chain(self):
         prompt = ChatPromptTemplate.from_template(
             """{system_prompt}
 
@@ -47,25 +46,39 @@ class BaseProfileExtractor:
 {format_instructions}
 """
         )
+        return prompt | self.llm
+
+    def _build_input(self, conversation_text: str) -> dict:
+        return {
+            "system_prompt": self._get_system_prompt(),
+            "conversation": conversation_text,
+            "format_instructions": self.parser.get_format_instructions()
+        }
+
+    def _parse_response(self, response) -> BaseModel:
+        # 简单的清洗逻辑
+        content = response.content.strip()
+        if content.startswith("```json"):
+            content = content.split("```json")[1].split("```")[0].strip()
+        elif content.startswith("```"):
+            content = content.split("```")[1].split("```")[0].strip()
+            
+        return self.parser.parse(content)
 
-        chain = prompt | self.llm
-        
+    def extract(self, conversation_text: str) -> Optional[BaseModel]:
+        """执行提取逻辑"""
         try:
-            response = chain.invoke({
-                "system_prompt": self._get_system_prompt(),
-                "conversation": conversation_text,
-                "format_instructions": self.parser.get_format_instructions()
-            })
-            
-            # 简单的清洗逻辑
-            content = response.content.strip()
-            if content.startswith("```json"):
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif content.startswith("```"):
-                content = content.split("```")[1].split("```")[0].strip()
-                
-            return self.parser.parse(content)
-            
+            response = self._build_chain().invoke(self._build_input(conversation_text))
+            return self._parse_response(response)
+        except Exception as e:
+            print(f"❌ Extractor [{self.__class__.__name__}] failed: {e}")
+            return None
+
+    async def aextract(self, conversation_text: str) -> Optional[BaseModel]:
+        """[异步] 执行提取逻辑 (取消时直接中断 LLM 请求)"""
+        try:
+            response = await self._build_chain().ainvoke(self._build_input(conversation_text))
+            return self._parse_response(response)
         except Exception as e:
             print(f"❌ Extractor [{self.__class__.__name__}] failed: {e}")
             return None
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 from typing import Dict, Any
 from datetime import datetime, date # 导入 date
 from langchain_openai import ChatOpenAI
@@ -63,6 +64,19 @@ class ProfileService:
         
         return full_profile_data
 
+    async def aextract_from_dialogue(self, dialogue_text: str) -> Dict[str, Any]:
+        """[异步版本] 并发运行所有 Agent，返回结构与 extract_from_dialogue 相同的画像字典"""
+        async def _run_agent(name, agent_instance):
+            try:
+                result = await agent_instance.aextract(dialogue_text)
+                return name, result.model_dump(exclude_none=True) if result else None
+            except Exception as e:
+                print(f"⚠️ [ProfileService] {name} 提取失败: {e}")
+                return name, None
+
+        results = await asyncio.gather(*(_run_agent(name, agent) for name, agent in self.agents.items()))
+        return dict(results)
+
     @staticmethod
     def format_dialogue_for_llm(messages: list) -> str:
         """辅助函数：将数据库的消息列表格式化为文本"""
@@ -198,10 +212,8 @@ class ProfileService:
             
         return clean_data
 
-    def generate_profile_completion_hint(self, profile: Dict) -> str:
-        """
-        使用 LLM 生成当前画像的完整度提示。
-        """
+    def _build_completion_hint_call(self, profile: Dict):
+        """构造完整度提示的 (chain, 输入)，同步/异步版本共用"""
         import json
         from langchain_core.prompts import ChatPromptTemplate
         from app.common.models.profile import REQUIRED_PROFILE_DIMENSIONS # 导入规则
@@ -232,15 +244,29 @@ class ProfileService:
         )
         
         chain = prompt | self.completion_llm
+        # 将 profile 转为格式化的 JSON 字符串
+        profile_str = json.dumps(profile, ensure_ascii=False, indent=2, default=str)
+        return chain, {
+            "profile_json": profile_str,
+            "required_dimensions": "\n".join(REQUIRED_PROFILE_DIMENSIONS)
+        }
+
+    def generate_profile_completion_hint(self, profile: Dict) -> str:
+        """
+        使用 LLM 生成当前画像的完整度提示。
+        """
         try:
-            # 将 profile 转为格式化的 JSON 字符串
-            profile_str = json.dumps(profile, ensure_ascii=False, indent=2, default=str)
-            
-            res = chain.invoke({
-                "profile_json": profile_str,
-                "required_dimensions": "\n".join(REQUIRED_PROFILE_DIMENSIONS)
-            })
-            return res.content
+            chain, inputs = self._build_completion_hint_call(profile)
+            return chain.invoke(inputs).content
+        except Exception as e:
+            print(f"⚠️ [Hint Gen] 生成提示失败: {e}")
+            return "当前画像信息分析服务暂时不可用，请根据对话历史判断缺失信息。"
+
+    async def agenerate_profile_completion_hint(self, profile: Dict) -> str:
+        """[异步版本] 生成当前画像的完整度提示"""
+        try:
+            chain, inputs = self._build_completion_hint_call(profile)
+            return (await chain.ainvoke(inputs)).content
         except Exception as e:
             print(f"⚠️ [Hint Gen] 生成提示失败: {e}")
             return "当前画像信息分析服务暂时不可用，请根据对话历史判断缺失信息。"
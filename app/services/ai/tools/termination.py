@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
-import json
-from typing import Dict, List, Tuple
+import asyncio
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
 from langchain_openai import ChatOpenAI
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
@@ -8,9 +9,29 @@ from langchain_core.output_parsers import PydanticOutputParser
 from app.common.models.termination import TerminationReason, TerminationSignal
 from app.common.models.profile import REQUIRED_PROFILE_DIMENSIONS # 导入公共常量
 
+# --- 本地预筛规则 (命中即可跳过 LLM) ---
+# 明确表示要结束对话的说法 (只在短回复中匹配；"有点累了"、"再见" 这类容易出现在正常回答里的说法交给 LLM)
+END_REQUEST_PHRASES = [
+    "下次再聊", "下次聊", "改天聊", "改天再聊", "回头再聊", "不想聊了", "不聊了",
+    "先这样吧", "就这样吧", "先到这", "拜拜", "我要睡了"
+]
+END_REPLY_MAX_LEN = 10         # 超过该长度的回复即使包含结束说法，也交给 LLM 结合上下文判断
+# 敷衍/不愿投入的回复 (整句精确匹配；"硕士"、"杭州" 这类短而有信息量的回答不算敷衍)
+DISENGAGED_REPLIES = {
+    "嗯", "嗯嗯", "哦", "噢", "好", "好的", "行", "还好", "随便", "都行", "都可以",
+    "不知道", "没有", "没", "算了", "呵呵", "ok", "OK"
+}
+DISENGAGED_STREAK = 3          # 连续 N 次敷衍回复视为犹豫
+ENGAGED_REPLY_MIN_LEN = 15     # 超过该长度且无结束信号，视为仍在积极投入
+
+
+def _fallback_signal(explanation: str) -> TerminationSignal:
+    return TerminationSignal(should_terminate=False, reason=None, confidence=0.0, explanation=explanation)
+
+
 class HesitancyDetector:
     """检测用户是否不想继续对话"""
-    
+
     def __init__(self, llm: ChatOpenAI):
         self.llm = llm
         self.parser = PydanticOutputParser(pydantic_object=TerminationSignal)
@@ -34,52 +55,81 @@ class HesitancyDetector:
 请输出 JSON 格式,不要任何解释或 Markdown 标记。
 
 {format_instructions}"""
-        )
-    
-    def detect(self, user_message: str, conversation_history: List[Dict]) -> TerminationSignal:
-        chain = self.prompt | self.llm
-        response = chain.invoke({
+        ).partial(format_instructions=self.parser.get_format_instructions())
+        # Chain 只构建一次，解析交给 PydanticOutputParser
+        self.chain = self.prompt | self.llm | self.parser
+
+    def prescreen(self, user_message: str, conversation_history: List[Dict]) -> Optional[TerminationSignal]:
+        """
+        本地规则预筛。返回 None 表示无法判断，需要交给 LLM。
+        """
+        msg = (user_message or "").strip()
+
+        # 1. 明确要求结束 (仅限短回复，如 "好的，下次再聊"；长回复里的同样说法可能只是在聊天)
+        phrase = next((p for p in END_REQUEST_PHRASES if p in msg), None)
+        if phrase:
+            if len(msg.strip("。.!！~～ ")) > END_REPLY_MAX_LEN:
+                return None
+            return TerminationSignal(should_terminate=True, reason=TerminationReason.USER_REQUEST_END,
+                                     confidence=0.95, explanation=f"[预筛] 用户明确表示结束: '{phrase}'")
+
+        # 2. 连续敷衍回复
+        user_replies = [m.get("content", "").strip() for m in conversation_history if m.get("role") == "user"]
+        recent = user_replies[-DISENGAGED_STREAK:]
+        if len(recent) == DISENGAGED_STREAK and all(self._is_disengaged(r) for r in recent):
+            return TerminationSignal(should_terminate=True, reason=TerminationReason.USER_HESITANT,
+                                     confidence=0.85, explanation=f"[预筛] 连续 {DISENGAGED_STREAK} 次敷衍回复")
+
+        # 3. 明显仍在积极投入
+        if len(msg) >= ENGAGED_REPLY_MIN_LEN:
+            return _fallback_signal("[预筛] 用户回复充实，无犹豫信号")
+
+        return None
+
+    @staticmethod
+    def _is_disengaged(reply: str) -> bool:
+        reply = reply.strip("。.!！~～ ")
+        return reply in DISENGAGED_REPLIES or reply.lower() in DISENGAGED_REPLIES
+
+    def _build_input(self, user_message: str, conversation_history: List[Dict]) -> Dict:
+        return {
             "user_message": user_message,
-            "conversation_history": self._format_history(conversation_history),
-            "format_instructions": self.parser.get_format_instructions()
-        })
-        return self._parse_response(response.content)
-    
+            "conversation_history": self._format_history(conversation_history)
+        }
+
+    def detect(self, user_message: str, conversation_history: List[Dict]) -> TerminationSignal:
+        try:
+            return self.chain.invoke(self._build_input(user_message, conversation_history))
+        except Exception as e:
+            print(f"❌ HesitancyDetector parsing failed: {e}")
+            return _fallback_signal(f"解析失败: {e}")
+
+    async def adetect(self, user_message: str, conversation_history: List[Dict]) -> TerminationSignal:
+        try:
+            return await self.chain.ainvoke(self._build_input(user_message, conversation_history))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ HesitancyDetector parsing failed: {e}")
+            return _fallback_signal(f"解析失败: {e}")
+
     def _format_history(self, history: List[Dict]) -> str:
         lines = []
         for msg in history[-5:]:
             role = "AI" if msg.get("role") == "ai" else "用户"
             lines.append(f"{role}: {msg.get('content', '')}")
         return "\n".join(lines)
-    
-    def _parse_response(self, content: str) -> TerminationSignal:
-        try:
-            content = content.strip()
-            if content.startswith("```json"):
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif content.startswith("```"):
-                content = content.split("```")[1].split("```")[0].strip()
-            data = json.loads(content)
-            return TerminationSignal(**data)
-        except json.JSONDecodeError as e:
-            print(f"❌ HesitancyDetector JSON parsing failed: {e}")
-            print(f"   Original content: {content}")
-            return TerminationSignal(should_terminate=False, reason=None, confidence=0.0, explanation=f"JSON解析失败: {e}")
-        except Exception as e:
-            print(f"❌ HesitancyDetector general parsing failed: {e}")
-            print(f"   Original content: {content}")
-            return TerminationSignal(should_terminate=False, reason=None, confidence=0.0, explanation=f"解析失败: {e}")
 
 
 class InfoCompletenessDetector:
     """检测 Onboarding 信息是否收集完成"""
-    
+
     def __init__(self, llm: ChatOpenAI):
         self.llm = llm
         self.parser = PydanticOutputParser(pydantic_object=TerminationSignal)
         # 精细化需要收集的维度 (仅供 LLM 参考，实际判断基于 profile_summary)
         self.required_dimensions_for_prompt = REQUIRED_PROFILE_DIMENSIONS
-        
+
         self.prompt = ChatPromptTemplate.from_template(
             """你是 AI 红娘的数据质量官，正在评估用户画像数据是否已充分收集。
 
@@ -106,81 +156,200 @@ class InfoCompletenessDetector:
 请输出 JSON 格式,不要任何解释或 Markdown 标记。
 
 {format_instructions}"""
+        ).partial(
+            required_dimensions="\n".join(self.required_dimensions_for_prompt),
+            format_instructions=self.parser.get_format_instructions()
         )
-    
+        self.chain = self.prompt | self.llm | self.parser
+
+    def prescreen(self, profile_completion_hint_text: str, profile: Optional[Dict] = None) -> Optional[TerminationSignal]:
+        """
+        本地规则预筛。返回 None 表示无法判断，需要交给 LLM。
+        """
+        # 1. Hint 已明确标注完善 (LLM 规则里的"最重要原则")
+        if profile_completion_hint_text and "核心画像已完善" in profile_completion_hint_text:
+            return TerminationSignal(should_terminate=True, reason=TerminationReason.INFO_COLLECTED,
+                                     confidence=0.95, explanation="[预筛] 画像概要已标注【核心画像已完善】")
+
+        # 2. 结构化画像的强制维度已齐全
+        if profile is not None:
+            missing = self.missing_required_fields(profile)
+            if not missing:
+                return TerminationSignal(should_terminate=True, reason=TerminationReason.INFO_COLLECTED,
+                                         confidence=0.9, explanation="[预筛] 教育/职业/家庭强制维度均已收集")
+        return None
+
+    @staticmethod
+    def missing_required_fields(profile: Dict) -> List[str]:
+        """基于结构化画像的规则版完整度检查 (与 Prompt 中的 Hard Constraints 对齐)"""
+        def _get(category, field):
+            return (profile.get(category) or {}).get(field)
+
+        missing = []
+        if not _get("education_profile", "highest_degree"): missing.append("学历")
+        if not _get("education_profile", "school_type"): missing.append("学校类型")
+
+        job = " ".join(str(_get("occupation_profile", f) or "") for f in ("job_title", "industry", "work_style"))
+        if not job.strip(): missing.append("职位/行业")
+        is_student = any(k in job for k in ("学生", "在读", "研究生", "博士生"))
+        if not is_student:
+            if not _get("occupation_profile", "work_style"): missing.append("工作风格")
+            if not _get("occupation_profile", "income_level"): missing.append("收入水平")
+
+        if not (_get("family_profile", "family_structure") or _get("family_profile", "siblings")):
+            missing.append("兄弟姐妹")
+        if not (_get("family_profile", "parents_health") or _get("family_profile", "parents_occupation")
+                or _get("family_profile", "family_atmosphere")):
+            missing.append("父母情况")
+        return missing
+
     def detect(self, profile_completion_hint_text: str) -> TerminationSignal:
         """
         根据结构化画像摘要来判断是否结束 Onboarding。
         直接接收外部生成好的 hint text，避免重复调用 LLM。
         """
-        chain = self.prompt | self.llm
-        response = chain.invoke({
-            "profile_completion_hint": profile_completion_hint_text,
-            "required_dimensions": "\n".join(self.required_dimensions_for_prompt),
-            "format_instructions": self.parser.get_format_instructions()
-        })
-        return self._parse_response(response.content)
-    
-    def _format_conversation(self, conversation: List[Dict]) -> str:
-        lines = []
-        for msg in conversation:
-            role = "AI" if msg.get("role") == "ai" else "用户"
-            lines.append(f"{role}: {msg.get('content', '')}")
-        return "\n".join(lines)
-    
-    def _parse_response(self, content: str) -> TerminationSignal:
         try:
-            content = content.strip()
-            if content.startswith("```json"):
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif content.startswith("```"):
-                content = content.split("```")[1].split("```")[0].strip()
-            data = json.loads(content)
-            return TerminationSignal(should_terminate=data["should_terminate"], reason=data.get("reason"), confidence=data["confidence"], explanation=data.get("explanation", ""))
-        except json.JSONDecodeError as e:
-            print(f"❌ InfoCompletenessDetector JSON parsing failed: {e}")
-            print(f"   Original content: {content}")
-            return TerminationSignal(should_terminate=False, reason=None, confidence=0.0, explanation=f"JSON解析失败: {e}")
+            return self.chain.invoke({"profile_completion_hint": profile_completion_hint_text})
         except Exception as e:
-            print(f"❌ InfoCompletenessDetector general parsing failed: {e}")
-            print(f"   Original content: {content}")
-            return TerminationSignal(should_terminate=False, reason=None, confidence=0.0, explanation=f"解析失败: {e}")
+            print(f"❌ InfoCompletenessDetector parsing failed: {e}")
+            return _fallback_signal(f"解析失败: {e}")
+
+    async def adetect(self, profile_completion_hint_text: str) -> TerminationSignal:
+        try:
+            return await self.chain.ainvoke({"profile_completion_hint": profile_completion_hint_text})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"❌ InfoCompletenessDetector parsing failed: {e}")
+            return _fallback_signal(f"解析失败: {e}")
 
 
 class DialogueTerminationManager:
-    """综合管理对话终止逻辑"""
-    
+    """
+    综合管理对话终止逻辑
+    决策顺序: 轮数检查 -> 本地预筛 (跳过 LLM) -> 两个 LLM 检测器并发执行，取第一个高置信度的终止信号。
+    """
+
+    HESITANCY_THRESHOLD = 0.7
+    INFO_THRESHOLD = 0.8
+
     def __init__(self, llm: ChatOpenAI):
         self.llm = llm
         self.hesitancy_detector = HesitancyDetector(llm)
         self.info_detector = InfoCompletenessDetector(llm)
-    
-    def should_terminate_onboarding(self, profile_completion_hint_text: str, full_conversation: List[Dict], min_conversational_turns: int = 8, max_turns: int = 30) -> Tuple[bool, TerminationSignal]:
+        # 决策路径统计 (用于观察预筛省下了多少次 LLM 调用)
+        self.stats = Counter()
+
+    def _record(self, path: str, llm_calls: int, signal: TerminationSignal, skipped: Optional[int] = None):
+        # skipped: 相比 "两个检测器都调用 LLM" 省下的调用次数 (轮数检查本来就不调用 LLM，不计入)
+        skipped = 2 - llm_calls if skipped is None else skipped
+        self.stats[path] += 1
+        self.stats["llm_calls"] += llm_calls
+        self.stats["llm_calls_skipped"] += skipped
+        print(
+            f"🛑 [Termination] path={path} terminate={signal.should_terminate} "
+            f"llm_calls={llm_calls} skipped={skipped} | totals={dict(self.stats)}"
+        )
+
+    @staticmethod
+    def _last_user_message(full_conversation: List[Dict]) -> Optional[str]:
+        for msg in reversed(full_conversation):
+            if msg.get("role") == "user":
+                return msg.get("content", "")
+        return None
+
+    def _precheck(self, profile_completion_hint_text: str, full_conversation: List[Dict],
+                  min_conversational_turns: int, max_turns: int, profile: Optional[Dict]):
+        """
+        不依赖 LLM 的检查。
+        返回 (已决策的结果或 None, 是否需要 LLM 检测犹豫, 是否需要 LLM 检测完整度, 最后一条用户消息)
+        """
         # min_conversational_turns 用来确保至少聊了几句才结束，避免开场白就说全了
-        
-        # 对话轮数检查 (确保聊了一段时间)
         num_turns = len(full_conversation) // 2
         if num_turns >= max_turns:
-            return True, TerminationSignal(should_terminate=True, reason=TerminationReason.MAX_TURNS, confidence=1.0, explanation=f"达到最大轮数 {max_turns}")
+            signal = TerminationSignal(should_terminate=True, reason=TerminationReason.MAX_TURNS, confidence=1.0, explanation=f"达到最大轮数 {max_turns}")
+            self._record("max_turns", 0, signal, skipped=0)
+            return (True, signal), False, False, None
         if num_turns < min_conversational_turns:
-            return False, TerminationSignal(should_terminate=False, reason=None, confidence=1.0, explanation=f"对话不足 {min_conversational_turns} 轮")
-            
+            signal = TerminationSignal(should_terminate=False, reason=None, confidence=1.0, explanation=f"对话不足 {min_conversational_turns} 轮")
+            self._record("min_turns", 0, signal, skipped=0)
+            return (False, signal), False, False, None
+
         # 优先判断用户是否不想聊了
-        if len(full_conversation) >= 2:
-            last_user_msg = None
-            for msg in reversed(full_conversation):
-                if msg.get("role") == "user":
-                    last_user_msg = msg.get("content", "")
-                    break
-            if last_user_msg:
-                hesitancy_signal = self.hesitancy_detector.detect(last_user_msg, full_conversation)
-                if hesitancy_signal.should_terminate and hesitancy_signal.confidence > 0.7:
-                    return True, hesitancy_signal
-        
+        last_user_msg = self._last_user_message(full_conversation) if len(full_conversation) >= 2 else None
+        need_hesitancy_llm = False
+        if last_user_msg:
+            pre = self.hesitancy_detector.prescreen(last_user_msg, full_conversation)
+            if pre is not None and pre.should_terminate:
+                self._record("prescreen_hesitancy", 0, pre)
+                return (True, pre), False, False, last_user_msg
+            need_hesitancy_llm = pre is None
+
         # 检查信息完整度 (主要逻辑)
-        # 直接使用传入的 hint text 进行判断
+        pre = self.info_detector.prescreen(profile_completion_hint_text, profile)
+        if pre is not None and pre.should_terminate:
+            self._record("prescreen_info", 0, pre)
+            return (True, pre), False, False, last_user_msg
+
+        return None, need_hesitancy_llm, True, last_user_msg
+
+    def should_terminate_onboarding(self, profile_completion_hint_text: str, full_conversation: List[Dict], min_conversational_turns: int = 8, max_turns: int = 30, profile: Optional[Dict] = None) -> Tuple[bool, TerminationSignal]:
+        """同步版本 (供脚本使用)，LLM 检测器顺序执行"""
+        decided, need_hesitancy, need_info, last_user_msg = self._precheck(
+            profile_completion_hint_text, full_conversation, min_conversational_turns, max_turns, profile
+        )
+        if decided:
+            return decided
+
+        llm_calls = 0
+        if need_hesitancy:
+            llm_calls += 1
+            hesitancy_signal = self.hesitancy_detector.detect(last_user_msg, full_conversation)
+            if hesitancy_signal.should_terminate and hesitancy_signal.confidence > self.HESITANCY_THRESHOLD:
+                self._record("llm_hesitancy", llm_calls, hesitancy_signal)
+                return True, hesitancy_signal
+
+        llm_calls += 1
         info_signal = self.info_detector.detect(profile_completion_hint_text)
-        if info_signal.should_terminate and info_signal.confidence > 0.8:
+        if info_signal.should_terminate and info_signal.confidence > self.INFO_THRESHOLD:
+            self._record("llm_info", llm_calls, info_signal)
             return True, info_signal
-            
-        return False, TerminationSignal(should_terminate=False, reason=None, confidence=0.0, explanation="继续收集信息")
\ No newline at end of file
+
+        signal = _fallback_signal("继续收集信息")
+        self._record("llm_continue", llm_calls, signal)
+        return False, signal
+
+    async def ashould_terminate_onboarding(self, profile_completion_hint_text: str, full_conversation: List[Dict], min_conversational_turns: int = 8, max_turns: int = 30, profile: Optional[Dict] = None) -> Tuple[bool, TerminationSignal]:
+        """异步版本：两个 LLM 检测器并发执行，任一给出高置信度终止信号即返回并取消另一个"""
+        decided, need_hesitancy, need_info, last_user_msg = self._precheck(
+            profile_completion_hint_text, full_conversation, min_conversational_turns, max_turns, profile
+        )
+        if decided:
+            return decided
+
+        tasks = {}
+        if need_hesitancy:
+            task = asyncio.create_task(self.hesitancy_detector.adetect(last_user_msg, full_conversation))
+            tasks[task] = ("llm_hesitancy", self.HESITANCY_THRESHOLD)
+        if need_info:
+            task = asyncio.create_task(self.info_detector.adetect(profile_completion_hint_text))
+            tasks[task] = ("llm_info", self.INFO_THRESHOLD)
+
+        llm_calls = len(tasks)
+        pending = set(tasks)
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    path, threshold = tasks[task]
+                    signal = task.result()
+                    if signal.should_terminate and signal.confidence > threshold:
+                        self._record(path, llm_calls, signal)
+                        return True, signal
+        finally:
+            for task in pending:
+                task.cancel()
+
+        signal = _fallback_signal("继续收集信息")
+        self._record("llm_continue", llm_calls, signal)
+        return False, signal
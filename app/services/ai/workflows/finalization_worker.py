@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from typing import Optional
+
+from app.core.config import settings
+
+
+class FinalizationWorker:
+    """
+    Onboarding 结算 Outbox Worker
+    随应用启动 (lifespan)，在事件循环中常驻：
+    - 有新任务入队时通过 `notify()` 立即唤醒；
+    - 否则按 `poll_interval_seconds` 轮询到期的重试任务和租约过期的任务。
+    """
+
+    def __init__(self):
+        self.poll_interval = settings.finalization.poll_interval_seconds
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._service = None
+
+    @property
+    def service(self):
+        if not self._service:
+            from app.services.ai.workflows.user_init import UserInitializationService
+            self._service = UserInitializationService()
+        return self._service
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            print("✅ Finalization worker started.")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def notify(self):
+        """新任务入队后调用，唤醒 Worker"""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            # 先清除信号再领取任务，处理期间到达的通知不会丢失
+            self._wakeup.clear()
+            try:
+                # 把当前所有到期任务处理完
+                while True:
+                    job = await self.service.claim_next_job()
+                    if not job:
+                        break
+                    await self.service.process_finalization(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ [FinalizationWorker] 轮询出错: {e}")
+
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import contextvars
+from datetime import datetime
+from typing import Dict, Set
+
+from bson import ObjectId
+
+from app.core.config import settings
+from app.core.container import container
+from app.core.utils.dict_utils import smart_merge
+
+
+class IncrementalExtractionService:
+    """
+    Onboarding 后台增量画像提取服务
+    职责：把 [提取 -> 合并写库 -> 刷新 Hint -> 终止检测] 从用户请求链路中剥离，放到后台按用户串行执行。
+
+    - **增量游标**：`users_onboarding_dialogues.extraction_cursor` 记录上一次成功提取到的消息下标，
+      每次只处理游标之后的新消息 (外加少量重叠上下文)，避免重复提取已见过的事实。
+    - **按用户串行**：同一用户同一时刻只有一个提取任务在跑，运行期间的新请求只打标记，结束后补跑一次。
+    - **结果回写**：最新 Hint 与终止判定写回 `users_onboarding_dialogues`
+      (`completion_hint` / `termination`)，由下一轮 `OnboardingNode` 随对话记录一并读取。
+    """
+
+    def __init__(self):
+        self.profile_service = container.profile_service
+        self.termination_manager = container.termination_manager
+
+        self.context_overlap = settings.onboarding.extract_context_overlap
+
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._lock_refs: Dict[str, int] = {}  # 持有/等待该用户锁的调用数，归零时回收锁 (防止 _locks 随用户数无限增长)
+        self._running: Set[str] = set()   # 正在执行提取的用户
+        self._dirty: Set[str] = set()     # 执行期间又有新请求的用户 (结束后补跑)
+        self._tasks: Set[asyncio.Task] = set() # 持有引用，防止 Task 被 GC
+
+    @property
+    def adb(self):
+        """异步 Mongo 访问层 (Motor)"""
+        return container.async_db
+
+    def schedule(self, user_id: str):
+        """
+        投递一次后台提取 (非阻塞)。
+        如果该用户已有任务在跑，只打标记，由当前任务结束后补跑，保证同一用户的合并串行进行。
+        """
+        if user_id in self._running:
+            self._dirty.add(user_id)
+            return
+
+        self._running.add(user_id)
+        # 使用空 Context 启动：后台提取的 LLM 调用不继承当前请求的回调，不会混入 WebSocket 流
+        task = asyncio.create_task(self._drain(user_id), context=contextvars.Context())
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _drain(self, user_id: str):
+        try:
+            while True:
+                self._dirty.discard(user_id)
+                await self.run_once(user_id)
+                if user_id not in self._dirty:
+                    break
+        finally:
+            self._running.discard(user_id)
+
+    def _acquire_ref(self, user_id: str) -> asyncio.Lock:
+        if user_id not in self._locks:
+            self._locks[user_id] = asyncio.Lock()
+        self._lock_refs[user_id] = self._lock_refs.get(user_id, 0) + 1
+        return self._locks[user_id]
+
+    def _release_ref(self, user_id: str):
+        self._lock_refs[user_id] -= 1
+        if self._lock_refs[user_id] == 0:
+            del self._lock_refs[user_id]
+            del self._locks[user_id]
+
+    async def run_once(self, user_id: str, check_termination: bool = True, raise_on_error: bool = False) -> bool:
+        """
+        执行一次增量提取 (持有用户锁)。返回是否有新消息被处理。
+        check_termination=False: 结算阶段补提取时使用，此时是否结束对话已成定局，跳过终止检测的 LLM 调用。
+        raise_on_error=True: 异常向上抛出 (结算步骤需要据此失败重试，不能基于旧画像继续)。
+        """
+        lock = self._acquire_ref(user_id)
+        try:
+            async with lock:
+                try:
+                    return await self._extract_delta(user_id, check_termination)
+                except Exception as e:
+                    if raise_on_error:
+                        raise
+                    print(f"   ❌ [Extraction] 用户 {user_id} 后台提取失败: {e}")
+                    import traceback
+                    traceback.print_exc()
+                    return False
+        finally:
+            self._release_ref(user_id)
+
+    async def _extract_delta(self, user_id: str, check_termination: bool = True) -> bool:
+        uid = ObjectId(user_id)
+
+        # 1. 读取游标，只拉取游标之后 (含重叠上下文) 的消息
+        meta = await self.adb.onboarding_dialogues.find_one(
+            {"user_id": uid},
+            {"extraction_cursor": 1, "completion_hint": 1}
+        )
+        if not meta:
+            return False
+        cursor = meta.get("extraction_cursor", 0)
+        start = max(0, cursor - self.context_overlap)
+
+        record = await self.adb.onboarding_dialogues.find_one(
+            {"user_id": uid},
+            {"messages": {"$slice": [start, 100000]}}
+        )
+        window = (record or {}).get("messages", [])
+        new_msgs = window[cursor - start:]
+        if not any(m.get("role") == "user" for m in new_msgs):
+            return False
+
+        new_cursor = start + len(window)
+        print(f"   🔄 [Extraction] 用户 {user_id} 增量提取: 消息 [{cursor}, {new_cursor}) (+{cursor - start} 条上下文)")
+
+        # 2. 并行提取 (各维度 Agent 以协程并发，取消时 LLM 请求随之中断)
+        dialogue_text = self.profile_service.format_dialogue_for_llm(window)
+        extracted_data = await self.profile_service.aextract_from_dialogue(dialogue_text)
+        update_payload = {k: v for k, v in (extracted_data or {}).items() if v}
+
+        # 3. 基于库中最新画像合并 (锁内读-改-写，避免并发覆盖)
+        profile_doc = await self.adb.profile.find_one({"user_id": uid}) or {}
+        full_profile = self.profile_service.clean_profile_data(profile_doc)
+
+        final_update_set = {}
+        if update_payload:
+            print(f"   -> 提取到新信息: {list(update_payload.keys())}")
+            smart_merge(full_profile, update_payload)
+            for top_key in update_payload.keys():
+                final_update_set[top_key] = full_profile[top_key]
+            final_update_set["updated_at"] = datetime.now()
+
+        if final_update_set:
+            await self.adb.profile.update_one(
+                {"user_id": uid},
+                {"$set": final_update_set},
+                upsert=True
+            )
+
+        # 4. 刷新 Hint (画像有变化或尚无缓存时)
+        profile_completion_hint = meta.get("completion_hint")
+        if final_update_set or not profile_completion_hint:
+            profile_completion_hint = await self.profile_service.agenerate_profile_completion_hint(full_profile)
+
+        # 5. 终止检测 (需要完整对话轮数，只投影计数所需字段)
+        termination = None
+        history_list = []
+        if check_termination:
+            full_record = await self.adb.onboarding_dialogues.find_one(
+                {"user_id": uid},
+                {"messages.role": 1, "messages.content": 1}
+            )
+            history_list = (full_record or {}).get("messages", [])
+        min_conversational_turns_for_check = 3
+        if len(history_list) >= min_conversational_turns_for_check * 2:
+            should_terminate, signal = await self.termination_manager.ashould_terminate_onboarding(
+                profile_completion_hint,
+                history_list, min_conversational_turns=30, max_turns=50,
+                profile=full_profile
+            )
+            termination = {
+                "should_terminate": should_terminate,
+                "reason": signal.reason.value if signal and signal.reason else None,
+                "explanation": signal.explanation if signal else "",
+                "checked_at": datetime.now()
+            }
+
+        # 6. 推进游标 (只有成功走完才推进)
+        cursor_update = {
+            "extraction_cursor": new_cursor,
+            "completion_hint": profile_completion_hint,
+            "extracted_at": datetime.now()
+        }
+        if termination:
+            cursor_update["termination"] = termination
+        await self.adb.onboarding_dialogues.update_one(
+            {"user_id": uid},
+            {"$set": cursor_update}
+        )
+        print(f"   ✅ [Extraction] 用户 {user_id} 增量提取完成，游标 -> {new_cursor}")
+        return True
@@ -0,0 +1,312 @@
+# -*- coding: utf-8 -*-
+"""
+规则版的搜索条件解析 (Rule-based Criteria Parser)
+
+大部分搜索都是套路化的 ("杭州的，1米75以上，25到30岁"、"同城985程序员")，
+却每次都要走一次 `FilterNode.filter_chain` 的 LLM 调用。这里用确定性规则覆盖常见写法：
+- 城市词典 + "同城/老乡/附近" (参考当前用户城市)
+- 身高 (1米75 / 一米八 / 1.8米 / 175cm，以上/以下/到/左右)
+- 年龄 (25到30岁 / 30岁以下 / 90后 / 比我大 / 和我差不多)
+- BMI 词表 (与 filter_chain 提示词中的映射一致)
+- 其余片段作为语义关键词
+并给出置信度: 有无法解释的数字、排除/否定 ("不要上海的"、"别太瘦"、"不要90后")、地域泛称、未支持的相对比较等情况时降低置信度，
+低于阈值 (settings.criteria_parser.min_confidence) 的解析结果交回 LLM 处理。
+"""
+import re
+import unicodedata
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from app.services.ai.workflows.recommendation.state import FilterOutput
+from app.core.utils.cal_utils import calc_age
+
+CITIES = [
+    "北京", "上海", "天津", "重庆", "广州", "深圳", "杭州", "南京", "苏州", "无锡", "常州", "南通", "宁波", "温州",
+    "绍兴", "嘉兴", "金华", "台州", "湖州", "合肥", "芜湖", "福州", "厦门", "泉州", "南昌", "济南", "青岛", "烟台",
+    "潍坊", "郑州", "洛阳", "武汉", "宜昌", "长沙", "株洲", "东莞", "佛山", "珠海", "中山", "惠州", "汕头", "南宁",
+    "桂林", "海口", "三亚", "成都", "绵阳", "贵阳", "昆明", "大理", "拉萨", "西安", "兰州", "西宁", "银川", "乌鲁木齐",
+    "石家庄", "唐山", "保定", "太原", "呼和浩特", "包头", "沈阳", "大连", "长春", "哈尔滨", "徐州", "扬州", "镇江",
+    "香港", "澳门", "台北",
+]
+# 泛地域 (省份/城市群): 对应哪些城市需要理解语境，交给 LLM
+REGIONS = [
+    "江浙沪", "江浙", "珠三角", "长三角", "京津冀", "北上广深", "北上广", "一线城市", "二线城市", "省会",
+    "浙江", "江苏", "广东", "福建", "山东", "河南", "河北", "湖南", "湖北", "四川", "安徽", "江西", "广西", "云南",
+    "贵州", "陕西", "山西", "甘肃", "辽宁", "吉林", "黑龙江", "东北", "西北", "南方", "北方", "海外", "国外",
+]
+SAME_CITY = r"同城|本地|老乡|附近|同一个城市|一个城市"
+
+# 与 filter_chain 提示词一致的 BMI 映射 (长词优先匹配，避免 "很瘦" 被当成 "瘦")
+BMI_WORDS = {
+    "很瘦": (None, 18.5), "骨感": (None, 18.5), "特别瘦": (None, 18.5), "非常瘦": (None, 18.5),
+    "不胖": (18.5, 24), "匀称": (18.5, 24), "身材标准": (18.5, 24), "标准身材": (18.5, 24),
+    "微胖": (24, 28), "丰满": (24, 28), "有肉": (24, 28), "壮实": (24, 28),
+    "瘦": (None, 20), "苗条": (None, 20), "纤细": (None, 20),
+    "胖": (28, None), "大码": (28, None),
+}
+
+GENDER_WORDS = (r"男朋友|女朋友|男孩子|女孩子|男孩|女孩|男生|女生|男士|女士|男性|女性|男的|女的|"
+                r"小哥哥|小姐姐|对象|另一半|伴侣")
+
+_CN_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5,
+              "六": 6, "七": 7, "八": 8, "九": 9}
+_CN = "零〇一二两三四五六七八九"
+_TO = r"\s*(?:到|至|-|~|—|－)\s*"
+
+# 身高值: 1米75 / 一米八 / 1.75米 / 175cm / 175
+_HV = (rf"(?:[1一][米mM](?:\d{{1,2}}|[{_CN}]{{1,2}})|1\.\d{{1,2}}\s*(?:米|m|M)|"
+       r"(?<!\d)(?:1[4-9]\d|2[01]\d)(?!\d)\s*(?:cm|CM|公分|厘米)?)")
+# 年龄值: 25 / 二十五 / 十八
+_AV = r"(?:(?<!\d)\d{2}(?!\d)|[二三四五六]十[一二三四五六七八九]?|十[八九])"
+
+_MIN_PRE = r"至少|最少|不低于|不矮于|不小于|高于|超过|大于"
+_MAX_PRE = r"不超过|不高于|不大于|低于|小于|最多|不到"
+_MIN_POST = r"以上|往上|及以上|或以上|起|\+|多|出头"
+_MAX_POST = r"以下|以内|之内|往下|及以下"
+_AROUND = r"左右|上下"
+
+_SPLIT = r"[\s,，。.!！?？;；、|/]+|的|和|并且|而且|还要|还有|同时|或者|或|且|也|又"
+_PREFIXES = ["我想找", "我想要", "我要找", "帮我找", "给我找", "我想", "我要", "想找", "想要", "帮我", "给我",
+             "找一个", "找一位", "找个", "找", "推荐", "介绍", "一个", "一位", "有没有", "要求", "希望", "最好是", "最好",
+             "要", "是", "在", "住在", "来自", "身高", "年龄", "年纪", "个子", "身材", "请", "麻烦", "能不能", "可以",
+             "那种", "比较", "从事", "做", "个"]
+_SUFFIXES = ["的人", "一下", "就行", "就好", "即可", "优先", "最好", "可以", "吗", "呢", "吧", "啊", "呀", "哦", "嘛", "人"]
+_FILLERS = {"随便", "都可以", "都行", "看看", "谢谢", "你好", "没有要求", "无所谓", "不限", "好", "有"}
+
+
+_CITY_RE = re.compile("|".join(sorted(CITIES, key=len, reverse=True)) + "(?:市)?")
+_REGION_RE = re.compile("|".join(sorted(REGIONS, key=len, reverse=True)))
+_BMI_RE = re.compile("|".join(sorted(BMI_WORDS, key=len, reverse=True)))
+_NEGATED_GEO_RE = re.compile(rf"(?:不要|不找|别|不是|除了|排除|非)\s*(?:{'|'.join(CITIES + REGIONS)})")
+
+# 否定词 ("别" 排除 "特别/性别/区别/分别/差别"，以及 "别墅")
+_NEGATOR = r"千万别|千万不要|不喜欢|不想要|不要|不能|不找|不是|(?<![特性区分差告])别(?!墅)"
+_DEGREE = r"(?:太|很|特别|过于|那么|这么)?"
+# 可被否定的硬性条件: 否定词 + 条件整体移除 (不会把条件反向写进过滤，也不会把否定词留在关键词里)
+_NEGATED_CONSTRAINT_RE = re.compile(
+    rf"(?:{_NEGATOR})\s*{_DEGREE}\s*(?:"
+    rf"比我(?:高|矮|大|小|年轻)|[和跟与]我(?:差不多大|差不多|年龄相仿|同龄)|同龄|年龄相仿|"
+    rf"(?:{_MIN_PRE}|{_MAX_PRE})?\s*{_HV}(?:{_TO}{_HV})?\s*(?:{_MIN_POST}|{_MAX_POST}|{_AROUND})?|"
+    rf"(?:{_MIN_PRE}|{_MAX_PRE})?\s*{_AV}\s*岁?(?:{_TO}{_AV})?\s*岁\s*(?:{_MIN_POST}|{_MAX_POST}|{_AROUND}|之间)?|"
+    rf"(?<!\d)\d[05]后|"
+    rf"{_BMI_RE.pattern})"
+)
+_NEGATOR_RE = re.compile(_NEGATOR)
+
+
+def _cn_to_int(s: str) -> int:
+    if s.isdigit():
+        return int(s)
+    if "十" in s:
+        tens, _, ones = s.partition("十")
+        return (_CN_DIGITS[tens] if tens else 1) * 10 + (_CN_DIGITS[ones] if ones else 0)
+    n = 0
+    for ch in s:
+        n = n * 10 + _CN_DIGITS[ch]
+    return n
+
+
+def _height_cm(text: str) -> int:
+    t = text.replace(" ", "")
+    m = re.fullmatch(r"[1一][米mM](.+)", t)
+    if m:
+        rest = m.group(1)
+        return 100 + _cn_to_int(rest) * (10 if len(rest) == 1 else 1)
+    m = re.fullmatch(r"(1\.\d{1,2})(?:米|m|M)", t)
+    if m:
+        return round(float(m.group(1)) * 100)
+    return int(re.match(r"\d+", t).group())
+
+
+class _Text:
+    """待解析文本: 匹配到的片段被替换为分隔符，剩下的就是关键词候选"""
+
+    def __init__(self, text: str):
+        self.text = text
+
+    def take(self, pattern):
+        """找出所有匹配并从文本中移除，返回 match 列表"""
+        matches = list(re.finditer(pattern, self.text))
+        for m in reversed(matches):
+            self.text = self.text[:m.start()] + "|" + self.text[m.end():]
+        return matches
+
+
+def _set_range(fields: Dict, lo_key: str, hi_key: str, lo=None, hi=None):
+    if lo is not None: fields[lo_key] = lo
+    if hi is not None: fields[hi_key] = hi
+
+
+def parse_criteria(text: str, user_basic: Optional[Dict] = None) -> Tuple[FilterOutput, float]:
+    """
+    解析用户搜索需求，返回 (FilterOutput, 置信度 0~1)。
+    置信度达到阈值时可以直接使用，跳过 filter_chain。
+    """
+    user_basic = user_basic or {}
+    t = _Text(unicodedata.normalize("NFKC", text))
+    fields: Dict = {}
+    notes: List[str] = []
+    confidence = 1.0
+    this_year = datetime.now().year
+    user_age = calc_age(user_basic.get("birthday")) or None
+    user_height = user_basic.get("height")
+
+    def penalize(amount: float, why: str):
+        nonlocal confidence
+        confidence -= amount
+        notes.append(why)
+
+    # --- 否定/排除 (如 "不要上海的"): 规则无法表达 "不要 X"，交给 LLM ---
+    if _NEGATED_GEO_RE.search(t.text) or re.search(r"除了|排除|以外|之外|不考虑", t.text):
+        penalize(0.5, "含排除条件")
+
+    # --- 否定的硬性条件 (如 "不要太胖"、"不要90后"、"别比我小"): 范围取反规则表达不了，整体移除并交给 LLM ---
+    if t.take(_NEGATED_CONSTRAINT_RE):
+        penalize(0.5, "含否定的硬性条件")
+
+    # --- 相对比较 (参考当前用户信息) ---
+    for m in t.take(r"比我(高|矮)"):
+        if not user_height:
+            penalize(0.5, "缺少用户身高")
+        elif m.group(1) == "高":
+            fields["height_min"] = user_height
+        else:
+            fields["height_max"] = user_height
+    for m in t.take(r"比我(大|小|年轻)|[和跟与]我(?:差不多大|差不多|年龄相仿|同龄)|同龄|年龄相仿"):
+        if not user_age:
+            penalize(0.5, "缺少用户年龄")
+        elif m.group(1) == "大":
+            fields["age_min"] = user_age
+        elif m.group(1):
+            fields["age_max"] = user_age
+        else:
+            _set_range(fields, "age_min", "age_max", user_age - 3, user_age + 3)
+
+    # --- 身高 ---
+    for m in t.take(rf"({_HV}){_TO}({_HV})(?:之间)?"):
+        lo, hi = sorted((_height_cm(m.group(1)), _height_cm(m.group(2))))
+        _set_range(fields, "height_min", "height_max", lo, hi)
+    for m in t.take(rf"(?:{_MIN_PRE})\s*({_HV})"):
+        fields["height_min"] = _height_cm(m.group(1))
+    for m in t.take(rf"(?:{_MAX_PRE})\s*({_HV})"):
+        fields["height_max"] = _height_cm(m.group(1))
+    for m in t.take(rf"({_HV})\s*({_MIN_POST}|{_MAX_POST}|{_AROUND})?"):
+        value, qualifier = _height_cm(m.group(1)), m.group(2)
+        if not qualifier:
+            penalize(0.3, "身高未说明以上/以下")
+            fields["height_min"] = value
+        elif re.fullmatch(_MAX_POST, qualifier):
+            fields["height_max"] = value
+        elif re.fullmatch(_AROUND, qualifier):
+            _set_range(fields, "height_min", "height_max", value - 3, value + 3)
+        else:
+            fields["height_min"] = value
+
+    # --- 年龄 ---
+    for m in t.take(rf"({_AV})\s*岁?{_TO}({_AV})\s*岁(?:之间)?"):
+        lo, hi = sorted((_cn_to_int(m.group(1)), _cn_to_int(m.group(2))))
+        _set_range(fields, "age_min", "age_max", lo, hi)
+    for m in t.take(rf"(?:{_MIN_PRE})\s*({_AV})\s*岁"):
+        fields["age_min"] = _cn_to_int(m.group(1))
+    for m in t.take(rf"(?:{_MAX_PRE})\s*({_AV})\s*岁"):
+        fields["age_max"] = _cn_to_int(m.group(1))
+    for m in t.take(rf"({_AV})\s*岁\s*({_MIN_POST}|{_MAX_POST}|{_AROUND})?"):
+        value, qualifier = _cn_to_int(m.group(1)), m.group(2)
+        if not qualifier:
+            penalize(0.3, "年龄未说明以上/以下")
+            _set_range(fields, "age_min", "age_max", value, value)
+        elif re.fullmatch(_MAX_POST, qualifier):
+            fields["age_max"] = value
+        elif re.fullmatch(_AROUND, qualifier):
+            _set_range(fields, "age_min", "age_max", value - 2, value + 2)
+        else:
+            fields["age_min"] = value
+    generations = t.take(r"(?<!\d)(\d)([05])后")
+    if generations:
+        # 90后 = 1990-1999 年出生，95后 = 1995-1999 年出生；多个世代取并集
+        spans = []
+        for m in generations:
+            n = int(m.group(1) + m.group(2))
+            start = 1900 + n if n >= 30 else 2000 + n
+            spans.append((start, start + (9 if m.group(2) == "0" else 4)))
+        _set_range(fields, "age_min", "age_max",
+                   this_year - max(e for _, e in spans), this_year - min(s for s, _ in spans))
+
+    # --- BMI ---
+    bmi_hits = t.take(_BMI_RE)
+    if bmi_hits:
+        if len({m.group() for m in bmi_hits}) > 1:
+            penalize(0.3, "体型描述不唯一")
+        lo, hi = BMI_WORDS[bmi_hits[0].group()]
+        _set_range(fields, "bmi_min", "bmi_max", lo, hi)
+
+    # --- 城市 ---
+    cities: List[str] = []
+    if t.take(SAME_CITY):
+        if user_basic.get("city"):
+            cities.append(user_basic["city"])
+        else:
+            penalize(0.5, "缺少用户城市")
+    for m in t.take(_CITY_RE):
+        city = m.group().rstrip("市")
+        if city not in cities:
+            cities.append(city)
+    if t.take(_REGION_RE):
+        penalize(0.6, "含泛地域")
+    fields["city"] = cities
+
+    # --- 性别词 (性别由系统强制为异性) ---
+    t.take(GENDER_WORDS)
+
+    # --- 剩余片段 -> 关键词 ---
+    if re.search(r"[比跟和与离]我", t.text):
+        penalize(0.4, "含未支持的相对比较")
+    keywords = []
+    for frag in re.split(_SPLIT, t.text):
+        frag = _strip_fillers(frag)
+        if not frag:
+            continue
+        if _NEGATOR_RE.search(frag):
+            # 剩下的否定 (如 "不要程序员"、"不要离异的") 是排除条件，不能当作正向关键词
+            if "含排除条件" not in notes:
+                penalize(0.5, "含排除条件")
+            continue
+        if re.search(r"\d", re.sub(r"985|211", "", frag)) or re.search(rf"[{_CN}十]+\s*(?:岁|米|后|公分|cm|CM)", frag):
+            penalize(0.6, f"无法解析的数字: {frag}")
+            continue
+        if re.fullmatch(r"[一-鿿]", frag):
+            # 残留单字 (如 "要个子高的" -> "高") 通常是没解析出的条件，不能当作关键词
+            penalize(0.5, f"残留单字: {frag}")
+            continue
+        frag = re.sub(r"(?<=[A-Za-z0-9])(?=[一-鿿])|(?<=[一-鿿])(?=[A-Za-z0-9])", " ", frag)
+        keywords.append(frag)
+    keyword_len = sum(len(k) for k in keywords)
+    if keyword_len > 30:
+        penalize(0.4, "描述较长")
+    elif keyword_len > 15:
+        penalize(0.2, "描述较长")
+
+    criteria = FilterOutput(
+        **fields,
+        keywords=" ".join(keywords),
+        explanation="规则解析" + (f" ({'; '.join(notes)})" if notes else ""),
+    )
+    return criteria, round(max(0.0, confidence), 2)
+
+
+def _strip_fillers(frag: str) -> str:
+    frag = frag.strip()
+    changed = True
+    while frag and changed:
+        changed = False
+        for p in _PREFIXES:
+            if frag.startswith(p) and frag != p:
+                frag, changed = frag[len(p):].strip(), True
+                break
+        for s in _SUFFIXES:
+            if frag.endswith(s) and frag != s:
+                frag, changed = frag[:-len(s)].strip(), True
+                break
+    if frag in _FILLERS or frag in _PREFIXES or frag in _SUFFIXES:
+        return ""
+    return frag
@@ -23,18 +23,17 @@ class RecommendationGraphBuilder:
         self.response_node = ResponseNode()
         self.deep_dive_node = DeepDiveNode()
         self.onboarding_node = OnboardingNode()
-        
-        # 自身偶尔也需要查库 (check_profile_status)
-        self.db = container.db
 
     def check_search_results(self, state: MatchmakingState) -> str:
         count = len(state.get('hard_candidate_ids', []))
         search_attempts = state.get('search_count', 0)
         
-        if count > 0:
+        plan = state.get('retrieval_plan') or {}
+        if count > 0 or plan.get('strategy') == "es_native":
             return "semantic"
-        elif search_attempts < 2:
-            return "refine" 
+        elif search_attempts < 1:
+            # 放宽是确定性的一次性计算 (一次聚合评估全部梯级)，不需要多轮重试
+            return "refine"
         else:
             return "response"
     
@@ -48,12 +47,14 @@ class RecommendationGraphBuilder:
         else:
             return "chitchat"
 
-    def check_profile_status(self, state: MatchmakingState) -> str:
+    async def check_profile_status(self, state: MatchmakingState) -> str:
         """检查用户画像是否完善"""
         user_id = state['user_id']
         try:
             uid = ObjectId(user_id)
-            state_doc = self.db.users_states.find_one({"user_id": uid})
+            state_doc = await container.async_db.users_states.find_one(
+                {"user_id": uid}, {"is_onboarding_completed": 1}
+            )
             
             if state_doc and state_doc.get("is_onboarding_completed"):
                 return "intent"
@@ -103,7 +104,11 @@ class RecommendationGraphBuilder:
             {"semantic": "semantic_recall", "refine": "refine_query", "response": "response"}
         )
         
-        workflow.add_edge("refine_query", "hard_filter")
+        workflow.add_conditional_edges(
+            "refine_query",
+            self.check_search_results,
+            {"semantic": "semantic_recall", "refine": "refine_query", "response": "response"}
+        )
         workflow.add_edge("semantic_recall", "ranking")
         workflow.add_edge("ranking", "evidence_hunting") 
         workflow.add_edge("evidence_hunting", "response") 
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 from bson import ObjectId
@@ -38,7 +39,7 @@ class DeepDiveNode:
                 
                 输出JSON: {format_instructions}"""
             ) | self.llm_intent | self.target_parser
-        )
+        ).with_config(tags=["nostream"]) # 中间的结构化输出，不进入 WebSocket 的 Token 流
         
         # 2. 深度分析回答 Chain
         self.deep_answer_chain = (
@@ -62,7 +63,7 @@ class DeepDiveNode:
             ) | self.llm_chat
         )
 
-    def deep_dive(self, state: MatchmakingState):
+    async def deep_dive(self, state: MatchmakingState):
         """处理深度询问意图"""
         # --- 第一阶段: 指代消解 (谁是目标?) ---
         candidates = state.get('final_candidates', [])
@@ -80,7 +81,7 @@ class DeepDiveNode:
 
         target_name = None
         try:
-            res = self.target_extractor_chain.invoke({
+            res = await self.target_extractor_chain.ainvoke({
                 "user_input": state['current_input'],
                 "chat_history": history_str,
                 "candidate_names": cand_names_str,
@@ -115,11 +116,12 @@ class DeepDiveNode:
         
         # --- 第三阶段: 获取深度信息并回复 ---
         uid = ObjectId(target_candidate['id'])
-        profile_doc = self.db.db["users_profile"].find_one({"user_id": uid}) or {}
-        basic_doc = self.db.users_basic.find_one({'_id':uid}) or {}
+        profile_doc = await container.async_db.profile.find_one({"user_id": uid}) or {}
+        basic_doc = await container.async_db.users_basic.find_one({'_id':uid}) or {}
         
-        # 生成画像摘要 (使用带缓存的新方法)
-        candidate_profile_summary = self.profile_service.get_profile_summary_with_cache(
+        # 生成画像摘要 (使用带缓存的新方法；未命中时同步调用 LLM，放到线程池)
+        candidate_profile_summary = await asyncio.to_thread(
+            self.profile_service.get_profile_summary_with_cache,
             basic_doc, 
             profile_doc, 
             self.db.profile
@@ -127,7 +129,8 @@ class DeepDiveNode:
 
         # 检索聊天记录 (Evidence)
         query = state['current_input']
-        docs = self.chroma.retrieve_related_context(
+        docs = await asyncio.to_thread(
+            self.chroma.retrieve_related_context,
             query, 
             user_id=target_candidate['id'], 
             k=3, 
@@ -137,7 +140,7 @@ class DeepDiveNode:
         
         # 生成回复
         try:
-            res = self.deep_answer_chain.invoke({
+            res = await self.deep_answer_chain.ainvoke({
                 "name": target_candidate['nickname'],
                 "user_input": state['current_input'],
                 "candidate_profile_summary": candidate_profile_summary,
@@ -1,12 +1,18 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import json
+import time
 from bson import ObjectId
 from datetime import datetime
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 
+from app.core.config import settings
 from app.core.container import container
 from app.common.models.state import MatchmakingState
-from app.services.ai.workflows.recommendation.state import FilterOutput, RefineOutput
+from app.services.ai.workflows.recommendation.state import FilterOutput
+from app.services.ai.workflows.recommendation import relaxation
+from app.services.ai.workflows.recommendation.criteria_parser import parse_criteria
 from app.core.utils.cal_utils import calc_age
 
 class FilterNode:
@@ -69,36 +75,13 @@ class FilterNode:
             ) | self.llm | self.filter_parser
         )
 
-        self.refine_parser = PydanticOutputParser(pydantic_object=RefineOutput)
-        self.refine_chain = (
-            ChatPromptTemplate.from_template(
-                """你是一个聪明的红娘。用户之前的要求太高了，导致数据库里找不到人。
-                请你根据之前的失败查询，生成一个新的、稍微**放宽**一点的结构化筛选条件。
-                
-                【失败的查询描述】: {current_input}
-                【失败的 Mongo 条件】: {hard_filters}
-                【当前的语义关键词】: {current_keywords}
-                【放宽策略】:
-                1. **只放宽硬性指标**：扩大年龄范围、放宽身高/BMI、移除地理位置限制。
-                2.**严格保留关键词**：请**原封不动**地保留【当前的语义关键词】到输出中，除非它本身包含明显的冲突（如既要胖又要瘦），否则不要修改或删除关键词。
-                
-                请输出：
-                1. `criteria`: 放宽后的完整结构化条件 (FilterOutput)。注意 `keywords` 字段要填入保留的关键词。
-                2. `relaxed_query_str`: 放宽后的自然语言描述。
-                3. `reason`: 解释理由。
-                
-                输出JSON: {format_instructions}"""
-            ) | self.llm | self.refine_parser
-        )
-
-    def hard_filter(self, state: MatchmakingState):
+    async def hard_filter(self, state: MatchmakingState):
         """Step 2: 统一提取 (Hard Filters + Semantic Keywords)"""
         print(f"🔍 [Filter] 提取条件 (Intent: {state.get('intent')})...")
         
         # --- 判断意图类型 & 检查是否有预设条件 ---
         is_refresh = (state.get('intent') == 'refresh_candidate')
         last_criteria = state.get('last_search_criteria')
-        refined_criteria = state.get('refined_criteria') # [NEW] 来自 RefineNode 的结构化修正
         # 初始化变量 (防止 UnboundLocalError)
         res = None
         query = {}
@@ -111,43 +94,47 @@ class FilterNode:
             semantic_query = last_criteria.get('semantic_query', "")
             # 保持 seen_ids 不变
             
-        # --- 场景 B: 结构化修正 (Refine Loop) ---
-        elif refined_criteria:
-            print("   🔧 触发[自修正]: 使用 RefineNode 提供的结构化条件 (跳过提取)")
-            # 直接使用 Pydantic 模型还原对象
-            try:
-                res = FilterOutput(**refined_criteria)
-                state['refined_criteria'] = None # 消费完即毁
-                state['seen_candidate_ids'] = [] # 修正条件后视为新搜索
-            except Exception as e:
-                print(f"   ❌ 还原修正条件失败: {e}")
-                # 降级处理：视为新搜索
-                pass
-            
-        # --- 场景 C: 新搜索 (Search Candidate) ---
+        # --- 场景 B: 新搜索 (Search Candidate) ---
         else:
-            if is_refresh: print("   ⚠️ 用户请求换一批但无历史/修正条件，视为新搜索")
+            if is_refresh: print("   ⚠️ 用户请求换一批但无历史条件，视为新搜索")
             
             state['seen_candidate_ids'] = []
             
-            # LLM 提取
+            # 当前用户信息 (规则解析与 LLM 提取都会参考)
             user_basic = state.get('current_user_basic', {})
             user_age = calc_age(user_basic.get('birthday')) if user_basic.get('birthday') else "未知"
             user_info_str = (f"性别: {user_basic.get('gender', '未知')}, 年龄: {user_age}, "
                              f"身高: {user_basic.get('height', '未知')}cm, 体重: {user_basic.get('weight', '未知')}kg, "
                              f"城市: {user_basic.get('city', '未知')}")
-            try:
-                res = self.filter_chain.invoke({
-                    "user_input": state['current_input'],
-                    "user_info": user_info_str,
-                    "format_instructions": self.filter_parser.get_format_instructions()
-                })
-            except Exception as e:
-                print(f"   ❌ 筛选解析失败: {e}")
-                state['hard_candidate_ids'] = []
-                return state
-
-        # --- 如果 res 存在 (场景 B 或 C)，则构建 Mongo Query ---
+            # 规则解析优先: 套路化的需求 (城市/身高/年龄/体型 + 关键词) 置信度达标时不调用 LLM
+            parser_cfg = settings.criteria_parser
+            rule_res, confidence = (None, 0.0)
+            if parser_cfg.enabled or parser_cfg.log_path:
+                try:
+                    rule_res, confidence = parse_criteria(state['current_input'], user_basic)
+                except Exception as e:
+                    print(f"   ⚠️ 规则解析异常: {e}")
+
+            if parser_cfg.enabled and rule_res and confidence >= parser_cfg.min_confidence:
+                print(f"   ⚡ 规则解析命中 (置信度 {confidence})，跳过 LLM")
+                res = rule_res
+            else:
+                llm_start = time.perf_counter()
+                try:
+                    res = await self.filter_chain.ainvoke({
+                        "user_input": state['current_input'],
+                        "user_info": user_info_str,
+                        "format_instructions": self.filter_parser.get_format_instructions()
+                    })
+                except Exception as e:
+                    print(f"   ❌ 筛选解析失败: {e}")
+                    state['hard_candidate_ids'] = []
+                    return state
+                if parser_cfg.log_path:
+                    await asyncio.to_thread(self._log_parse, state['current_input'], user_basic, res, rule_res, confidence,
+                                            time.perf_counter() - llm_start)
+
+        # --- 如果 res 存在 (场景 B)，则构建 Mongo Query ---
         if res:
             query = {}
             # City
@@ -160,26 +147,22 @@ class FilterNode:
                 if res.height_min: h_query["$gte"] = res.height_min
                 if res.height_max: h_query["$lte"] = res.height_max
                 query["height"] = h_query
-            # BMI
+            # BMI (物化字段 bmi，普通范围谓词可走索引)
             if res.bmi_min or res.bmi_max:
-                bmi_calc = {"$divide": ["$weight", {"$pow": [{"$divide": ["$height", 100]}, 2]}]}
-                expr = []
-                if res.bmi_min: expr.append({"$gte": [bmi_calc, res.bmi_min]})
-                if res.bmi_max: expr.append({"$lte": [bmi_calc, res.bmi_max]})
-                if expr:
-                    if "$expr" not in query: query["$expr"] = {"$and": expr}
-                    else: query["$expr"]["$and"].extend(expr)
-            # Age
+                bmi_query = {}
+                if res.bmi_min: bmi_query["$gte"] = res.bmi_min
+                if res.bmi_max: bmi_query["$lte"] = res.bmi_max
+                query["bmi"] = bmi_query
+            # Age (物化字段 birth_year: 今年 N 岁的人出生于 今年-N 或 今年-N-1 (还没过生日))
+            # 取两端都包含的出生年份，结果是按生日精确计算年龄的超集，不会漏掉 age_max 岁的人
             age_min = res.age_min
             age_max = res.age_max
             if age_min or age_max:
-                now = datetime.now().year
-                if age_max: query["birthday"] = {"$gte": datetime(now - age_max, 1, 1)}
-                # 注意处理 min/max 的覆盖问题，这里简化处理
-                if age_min: 
-                    target = datetime(now - age_min, 12, 31)
-                    if "birthday" in query: query["birthday"]["$lte"] = target
-                    else: query["birthday"] = {"$lte": target}
+                this_year = datetime.now().year
+                year_query = {}
+                if age_max: year_query["$gte"] = this_year - age_max - 1
+                if age_min: year_query["$lte"] = this_year - age_min
+                query["birth_year"] = year_query
             
             # Gender (强制)
             cg = state.get('current_user_basic', {}).get('gender', '').lower()
@@ -206,43 +189,95 @@ class FilterNode:
         # --- 执行查询 ---
         print(f"   -> Hard Filter: {query}")
         print(f"   -> Semantic Keywords: '{semantic_query}'")
-        
+
+        # --- 检索策略: 按估算的命中人数选择 mongo_only / es_native / id_hybrid ---
+        # 规划失败 (如基数统计异常) 不影响检索: 空 plan 走 Mongo，由 RecallNode.resolve 按实际人数定策略
+        try:
+            plan = container.retrieval_planner.plan(query, semantic_query)
+            print(f"   🧭 [Planner] {plan['strategy']} (估算 {plan['estimate']} 人, {plan['reason']})")
+        except Exception as e:
+            print(f"   ⚠️ [Planner] 规划失败，回退到 Mongo 预筛: {e}")
+            plan = {}
+        state['retrieval_plan'] = plan
+        state['hard_filters'] = query
+        state['semantic_query'] = semantic_query
+        if plan.get('strategy') == "es_native":
+            # 条件宽泛: 跳过 Mongo，由 RecallNode 直接在 ES 中带过滤条件检索
+            state['hard_candidate_ids'] = []
+            return state
+
+        start = time.perf_counter()
         try:
-            cursor = self.db.users_basic.find(query, {"_id": 1}).limit(200)
-            candidate_ids = [str(doc['_id']) for doc in cursor]
+            cursor = container.async_db.users_basic.find(query, {"_id": 1}).limit(200)
+            candidate_ids = [str(doc['_id']) async for doc in cursor]
             
-            state['hard_filters'] = query
-            state['semantic_query'] = semantic_query
             state['hard_candidate_ids'] = candidate_ids
             print(f"   -> 命中(Mongo): {len(candidate_ids)} 人")
             
         except Exception as e:
             print(f"   ❌ Mongo 查询失败: {e}")
             state['hard_candidate_ids'] = []
+        plan['mongo_seconds'] = time.perf_counter() - start
 
         return state
 
-    def refine_query(self, state: MatchmakingState):
-        """Step 2.5: 自修正节点"""
+    def _log_parse(self, user_input, user_basic, llm_res, rule_res, confidence, llm_seconds):
+        """记录 LLM 解析结果 (附带规则解析结果)，供 benchmarks/bench_criteria_parser.py 离线评估"""
+        record = {
+            "ts": datetime.now().isoformat(),
+            "user_input": user_input,
+            "user_basic": {k: user_basic.get(k) for k in ("gender", "birthday", "height", "weight", "city")},
+            "llm": llm_res.model_dump(),
+            "rule": rule_res.model_dump() if rule_res else None,
+            "confidence": confidence,
+            "llm_seconds": round(llm_seconds, 3),
+        }
+        try:
+            with open(settings.criteria_parser.log_path, "a", encoding="utf-8") as f:
+                f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        except Exception as e:
+            print(f"   ⚠️ 写入解析日志失败: {e}")
+
+    async def refine_query(self, state: MatchmakingState):
+        """Step 2.5: 自修正节点 (确定性放宽，不调用 LLM)"""
         print("🔄 [Refine] 结果为空，尝试放宽条件...")
+        state['search_count'] = state.get('search_count', 0) + 1
+        config = settings.relaxation
+        ladder = relaxation.build_ladder(state.get('hard_filters') or {}, config)
+        if not ladder:
+            print("   -> 没有可放宽的硬性条件")
+            return state
+
         try:
-            res = self.refine_chain.invoke({
-                "current_input": state['current_input'],
-                "hard_filters": state.get('hard_filters', {}),
-                "current_keywords": state.get('semantic_query', ""),  # [NEW] 传入当前关键词
-                "format_instructions": self.refine_parser.get_format_instructions()
-            })
-            
-            print(f"   -> 修正策略: {res.reason}")
-            print(f"   -> 新查询(展示): {res.relaxed_query_str}")
-            
-            # [关键] 将结构化条件直接存入 state，供 hard_filter 消费
-            state['refined_criteria'] = res.criteria.model_dump()
-            state['current_input'] = res.relaxed_query_str # 更新展示文本
-            state['search_count'] = state.get('search_count', 0) + 1
-            
+            counts = await relaxation.count_ladder(container.async_db.users_basic, ladder, config.count_cap)
         except Exception as e:
-            print(f"   ❌ 修正失败: {e}")
-            state['search_count'] = 99
-            
+            print(f"   ❌ 放宽计数失败: {e}")
+            return state
+        print(f"   -> 各级命中: {[(desc, n) for (desc, _), n in zip(ladder, counts)]}")
+
+        chosen = relaxation.choose_rung(ladder, counts, config.min_hits)
+        if chosen is None:
+            print("   -> 全部放宽后仍无结果")
+            return state
+        index, (_, query) = chosen
+        note = relaxation.describe(ladder, index)
+        print(f"   -> 采用第 {index + 1} 级: {note}")
+
+        try:
+            cursor = container.async_db.users_basic.find(query, {"_id": 1}).limit(200)
+            candidate_ids = [str(doc['_id']) async for doc in cursor]
+        except Exception as e:
+            print(f"   ❌ Mongo 查询失败: {e}")
+            return state
+
+        # "换一批" 继承放宽后的条件 (不含本轮的 _id 排除)
+        inherited = {k: v for k, v in query.items() if k != "_id"}
+        state['last_search_criteria'] = {
+            "hard_filters": inherited,
+            "semantic_query": state.get('semantic_query', "")
+        }
+        state['hard_filters'] = query
+        state['hard_candidate_ids'] = candidate_ids
+        state['relaxation_note'] = note
+        print(f"   -> 命中(Mongo): {len(candidate_ids)} 人")
         return state
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 from bson import ObjectId
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
@@ -64,20 +65,21 @@ class IntentNode:
             ) | self.chitchat_llm
         )
 
-    def load_profile(self, state: MatchmakingState):
+    async def load_profile(self, state: MatchmakingState):
         """Step 0: 加载当前用户全量画像 (带 Summary 缓存检查)"""
         print(f"👤 [LoadProfile] 加载用户: {state['user_id']}")
         try:
             uid = ObjectId(state['user_id'])
             
             # 1. 查 Basic
-            user_basic = self.db.users_basic.find_one({"_id": uid})
+            user_basic = await container.async_db.users_basic.find_one({"_id": uid})
             
             # 2. 查 Profile
-            user_profile = self.db.profile.find_one({"user_id": uid}) or {}
+            user_profile = await container.async_db.profile.find_one({"user_id": uid}) or {}
             
-            # --- 3. Summary 缓存逻辑 (封装复用) ---
-            summary = self.profile_service.get_profile_summary_with_cache(
+            # --- 3. Summary 缓存逻辑 (封装复用；缓存未命中时会同步调用 LLM，放到线程池) ---
+            summary = await asyncio.to_thread(
+                self.profile_service.get_profile_summary_with_cache,
                 user_basic, 
                 user_profile, 
                 self.db.profile # 这里传入 collection 对象
@@ -94,7 +96,7 @@ class IntentNode:
             state['error_msg'] = str(e)
         return state
 
-    def analyze_intent(self, state: MatchmakingState):
+    async def analyze_intent(self, state: MatchmakingState):
         """Step 1: 纯意图识别 (Router)"""
         if state.get('error_msg'): return state
 
@@ -104,7 +106,7 @@ class IntentNode:
         history_str = format_history(state.get('messages', []))
 
         try:
-            res = self.intent_chain.invoke({
+            res = await self.intent_chain.ainvoke({
                 "user_input": state['current_input'],
                 "chat_history": history_str,
                 "format_instructions": self.intent_parser.get_format_instructions()
@@ -116,13 +118,13 @@ class IntentNode:
             state['intent'] = "chitchat"
         return state
 
-    def chitchat(self, state: MatchmakingState):
+    async def chitchat(self, state: MatchmakingState):
         """通用对话/咨询节点"""
         # 格式化历史记录
         history_str = format_history(state.get('messages', []))
         
         try:
-            res = self.chitchat_chain.invoke({
+            res = await self.chitchat_chain.ainvoke({
                 "user_summary": state.get('current_user_summary', '未知用户'),
                 "user_input": state['current_input'],
                 "chat_history": history_str
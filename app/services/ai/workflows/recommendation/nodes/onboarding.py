@@ -1,23 +1,30 @@
 # -*- coding: utf-8 -*-
+import asyncio
 from datetime import datetime
 from bson import ObjectId
 from langchain_core.prompts import ChatPromptTemplate
 
-from app.core.utils.dict_utils import smart_merge
+from app.core.config import settings
 from app.core.container import container
 from app.common.models.state import MatchmakingState
+from app.common.models.profile import REQUIRED_PROFILE_DIMENSIONS
 
 # 延迟导入以避免循环依赖
 # from app.services.ai.workflows.user_init import UserInitializationService 
 
 class OnboardingNode:
     def __init__(self):
-        self.db = container.db
         self.chroma = container.chroma
         self.llm = container.get_llm("chat") # 0.7 for onboarding
         
         self.termination_manager = container.termination_manager # 使用单例
         self.profile_service = container.profile_service # 使用单例
+        self.extraction_service = container.extraction_service # 后台增量提取
+        self.extract_every_n = settings.onboarding.extract_every_n_user_msgs
+        self.history_window = 10 # Prompt 中保留的最近消息条数
+
+        # 尚未完成首次提取时使用的默认 Hint
+        self.default_hint = "暂未提取到画像信息，请从以下维度中自然地开启话题:\n" + "\n".join(REQUIRED_PROFILE_DIMENSIONS)
         
         # 懒加载 UserInitializationService
         self._user_init_service = None
@@ -52,7 +59,7 @@ class OnboardingNode:
             ChatPromptTemplate.from_template(
                 """你是一名红娘。用户的信息已经采集完毕了！
                 
-                【用户画像】: {current_profile_summary}
+                【用户画像关键词】: {profile_digest}
                 
                 请对用户表示感谢，并引导他开始寻找对象。
                 语气温暖、期待。"""
@@ -66,6 +73,13 @@ class OnboardingNode:
             self._user_init_service = UserInitializationService()
         return self._user_init_service
 
+    async def _profile_digest(self, uid: ObjectId) -> str:
+        """结构化画像的关键词摘要 (与 ES 文档的 tags 字段一致)"""
+        from app.services.ai.workflows.user_init import UserInitializationService
+        profile_data = await container.async_db.profile.find_one({"user_id": uid}) or {}
+        digest = UserInitializationService.build_es_profile({}, profile_data, "")["tags"]
+        return digest or "(暂无)"
+
     async def process(self, state: MatchmakingState):
         """处理 Onboarding 逻辑"""
         print("📝 [Onboarding] 实时对话处理...")
@@ -74,120 +88,65 @@ class OnboardingNode:
         current_input = state['current_input']
         uid = ObjectId(user_id)
         
-        # ⚠️ 注意: PyMongo 是同步的，在 async 函数中会阻塞 loop。
-        # 在生产环境中应使用 Motor 或 run_in_executor。这里暂时保持同步调用。
-        user_basic = self.db.users_basic.find_one({"_id": ObjectId(user_id)})
-        
-        # 1. 实时保存用户输入
+        # 1. 保存用户输入，并一次性取回最近历史 + 用户发言计数 + 后台提取结果 (Motor 异步访问)
         user_msg = {"role": "user", "content": current_input, "timestamp": datetime.now()}
-        self.db.onboarding_dialogues.update_one(
-            {"user_id": uid},
-            {"$push": {"messages": user_msg}},
-            upsert=True
-        )
-        
-        # 2. 读取完整历史
-        record = self.db.onboarding_dialogues.find_one({"user_id": uid})
-        history_list = record.get('messages', []) if record else []
+        record = await container.async_db.push_onboarding_message(uid, user_msg, self.history_window)
+        progress = {"finalized": False}
+        try:
+            return await self._reply(state, uid, record, progress)
+        except asyncio.CancelledError:
+            # 客户端断开导致本轮被取消: 撤回已写入的用户消息，避免对话里留下没有回复的半轮
+            # (已进入结算的轮次除外，结算的幂等键已包含这条消息)
+            if not progress["finalized"]:
+                await asyncio.shield(container.async_db.retract_onboarding_message(uid, user_msg))
+                print(f"   ↩️ [Onboarding] 本轮已取消，撤回用户消息 (user={user_id})")
+            raise
+
+    async def _reply(self, state: MatchmakingState, uid: ObjectId, record: dict, progress: dict):
+        """生成本轮回复 (结算或继续追问) 并写入 AI 消息"""
+        user_id = state['user_id']
+        history_list = record.get('messages', [])
+        user_msg_count = record.get('user_msg_count', 0)
 
-        full_profile = state['current_user_profile']
-        
-        # [Strategy] 预先生成 Hint，确保如果不进 batch 更新逻辑，后续步骤也有值可用
-        # ProfileService 内部可能有 LLM 调用，建议也改为 async，但为了最小改动，这里先同步执行
-        profile_completion_hint = self.profile_service.generate_profile_completion_hint(profile=full_profile)
+        # [Strategy] Hint 由后台增量提取任务生成并缓存，这里直接复用，不在请求链路里调用 LLM
+        profile_completion_hint = record.get('completion_hint') or self.default_hint
 
-        # 逻辑改为：每当用户说了 3 句话 (即积累了约 3 轮对话)，触发一次提取
-        user_msg_count = sum(1 for m in history_list if m['role'] == 'user')
-        
-        if user_msg_count > 0 and user_msg_count % 4 == 0:
-            print(f"   🔄 触发增量画像提取 (用户已发言 {user_msg_count} 次)...")
-            # 取最近的 6 条消息作为上下文 (User + AI)
-            recent_batch = history_list[-10:]
-            # 格式化对话
-            dialogue_text = self.profile_service.format_dialogue_for_llm(recent_batch)
-            # 提取 (CPU bound + Network bound)
-            extracted_data = self.profile_service.extract_from_dialogue(dialogue_text)
-            
-            # 更新 DB (Smart Merge)
-            if extracted_data:
-                # 过滤空值
-                update_payload = {k: v for k, v in extracted_data.items() if v}
-                
-                if update_payload:
-                    print(f"   -> 提取到新信息 (Before Merge): {list(update_payload.keys())}")
-                    
-                    # [FIX] 使用智能合并：列表追加，标量覆盖
-                    # 直接修改内存中的 full_profile
-                    smart_merge(full_profile, update_payload)
-                    
-                    # 准备写入 DB 的数据
-                    # 我们不仅要写入 update_payload 的 key，还要写入它们合并后的最终值 (因为 full_profile 已经被 modify 了)
-                    # 为了安全，重新 flatten 一次 full_profile 中涉及到 update_payload 的部分，或者直接 save 整个 documents
-                    # 考虑到并发风险低，直接 set 修改过的字段的最终值
-                    
-                    final_update_set = {}
-                    # 重新从 full_profile 提取最终值，构造 $set
-                    # 这里有一个技巧：因为 smart_merge 已经更新了 nested dict，
-                    # 我们可以简单地把 update_payload 顶层 key 对应的 full_profile 值写回去
-                    # 或者更细粒度一点。为了处理 list append，最简单的是把涉及到的 顶层 key 整个覆盖回去。
-                    
-                    for top_key in update_payload.keys():
-                        final_update_set[top_key] = full_profile[top_key]
-                        
-                    final_update_set["updated_at"] = datetime.now()
-                    
-                    self.db.profile.update_one(
-                        {"user_id": uid},
-                        {"$set": final_update_set},
-                        upsert=True
-                    )
-                    print(f"   -> 增量合并并更新了字段: {list(final_update_set.keys())}")
-                    
-                    # [FIX] 画像更新了，重新生成 Hint 以便 Termination Check 使用最新数据
-                    profile_completion_hint = self.profile_service.generate_profile_completion_hint(profile=full_profile)
-
-            # 4. 判断是否完成
-            min_conversational_turns_for_check = 3
-            if len(history_list) >= min_conversational_turns_for_check * 2:
-                should_terminate, signal = self.termination_manager.should_terminate_onboarding(
-                    # 传递生成的 hint text
-                    profile_completion_hint,
-                    history_list, min_conversational_turns=30, max_turns=50
-                )
-            else:
-                should_terminate = False
-                signal = None
-        
-            if should_terminate:
-                print(f"   ✅ 检测到信息采集完成: {signal.explanation}")
+        # 2. 上一次后台检测已判定可以结束 -> 结算
+        termination = record.get('termination') or {}
+        if termination.get('should_terminate'):
+            print(f"   ✅ 检测到信息采集完成: {termination.get('explanation')}")
 
-                # 5. 原子化结算
-                success = self._get_init_service().finalize_user_onboarding(user_id)
+            # 原子化结算: 一次写操作翻转状态 + 写入 Outbox，耗时的摘要/向量化由后台 Worker 完成
+            success = await self._get_init_service().enqueue_finalization(user_id)
 
-                if success:
-                    # 读取最新画像用于结束语
+            if success:
+                progress["finalized"] = True
+                container.finalization_worker.notify()
 
-                    full_profile = self.db.profile.find_one({"user_id": uid}) or {} # 重新读一次确保最新
-                    current_profile_summary_text = self.profile_service.generate_profile_summary(user_basic, full_profile)
+                # 结束语使用后台提取已写入的结构化画像的关键词，不再额外生成一次摘要 (摘要只由 Worker 生成一次)；
+                # completion_hint 是缺失维度分析，不能当画像用，否则结束语会提到"还没收集到的信息"
+                res = await self.finish_chain.ainvoke({"profile_digest": await self._profile_digest(uid)})
+                reply = res.content
 
-                    # [ASYNC CHANGE] 使用 ainvoke
-                    res = await self.finish_chain.ainvoke({"current_profile_summary": current_profile_summary_text})
-                    reply = res.content
+                ai_msg = {"role": "ai", "content": reply, "timestamp": datetime.now()}
+                await container.async_db.append_onboarding_reply(uid, ai_msg, {"completed_at": datetime.now()})
 
-                    ai_msg = {"role": "ai", "content": reply, "timestamp": datetime.now()}
-                    self.db.onboarding_dialogues.update_one({"user_id": uid}, {"$push": {"messages": ai_msg}})
+                state['reply'] = reply
+                return state
+            else:
+                print("   ❌ 结算失败，回退到继续追问")
 
-                    state['reply'] = reply
-                    return state
-                else:
-                    print("   ❌ 结算失败，回退到继续追问")
-        
-        # 6. 继续追问
+        # 3. 每当用户说了 N 句话，投递一次后台增量提取 (不阻塞本轮回复)
+        if user_msg_count > 0 and user_msg_count % self.extract_every_n == 0:
+            print(f"   🔄 投递后台增量画像提取 (用户已发言 {user_msg_count} 次)...")
+            self.extraction_service.schedule(user_id)
+
+        # 4. 继续追问
         print("   ⏳ 继续追问...")
         
-        # profile_completion_hint 已经在上面生成了，直接用
+        # profile_completion_hint 已经在上面读取了，直接用
 
-        history_for_prompt = "\n".join([f"{m['role']}: {m['content']}" for m in history_list[-10:]]) # 限制 History 长度
+        history_for_prompt = "\n".join([f"{m['role']}: {m['content']}" for m in history_list]) # 已由 $slice 限制 History 长度
         
         print(f"   💡 [Debug] Hint used for prompt: {profile_completion_hint}")
 
@@ -198,9 +157,9 @@ class OnboardingNode:
         })
         reply = res.content
         
-        # 保存 AI 回复
+        # 5. 保存 AI 回复
         ai_msg = {"role": "ai", "content": reply, "timestamp": datetime.now()}
-        self.db.onboarding_dialogues.update_one({"user_id": uid}, {"$push": {"messages": ai_msg}})
+        await container.async_db.append_onboarding_reply(uid, ai_msg)
         
         state['reply'] = reply
         return state
\ No newline at end of file
@@ -1,14 +1,86 @@
 # -*- coding: utf-8 -*-
+import asyncio
+import time
 from app.common.models.state import MatchmakingState
+from app.core.config import settings
 from app.core.container import container
+from app.services.retrieval_planner import MONGO_ONLY, ES_NATIVE, ID_HYBRID
 
 class RecallNode:
     def __init__(self):
         self.chroma = container.chroma
-        self.es_manager = container.es # <--- 从容器获取
+        self.es_manager = container.search_engine # <--- 从容器获取 (ES 或进程内引擎，见 local_search.mode)
+        self.embedding_service = container.embedding_service
+        self.planner = container.retrieval_planner
 
-    def semantic_recall(self, state: MatchmakingState):
-        """Step 3: 语义召回 (混合检索)"""
+    async def semantic_recall(self, state: MatchmakingState):
+        """Step 3: 语义召回 (按检索策略: mongo_only / es_native / id_hybrid)"""
+        start = time.perf_counter()
+        plan = state.get('retrieval_plan') or {}
+        query = state.get('semantic_query', "")
+        strategy = self.planner.resolve(plan, len(state.get('hard_candidate_ids', [])), query)
+
+        if strategy == ES_NATIVE:
+            state = await self._es_native_recall(state)
+            if not state['semantic_candidate_ids']:
+                # ES 原生过滤没有结果 (或 ES 异常): 退回 Mongo 过滤 + ID 限定检索
+                print("   ⚠️ ES 原生检索无结果，退回 Mongo 过滤")
+                try:
+                    cursor = container.async_db.users_basic.find(state['hard_filters'], {"_id": 1}).limit(200)
+                    state['hard_candidate_ids'] = [str(doc['_id']) async for doc in cursor]
+                except Exception as e:
+                    print(f"   ❌ Mongo 查询失败: {e}")
+                    state['hard_candidate_ids'] = []
+                strategy = self.planner.resolve({}, len(state['hard_candidate_ids']), query)
+        if strategy == MONGO_ONLY:
+            # 候选人很少 (或无关键词): ES 检索没有意义，直接交给精排
+            print(f"🧠 [Recall] 跳过 ES: {len(state['hard_candidate_ids'])} 人直接进入精排")
+            state['semantic_candidate_ids'] = state['hard_candidate_ids'][:10]
+        elif strategy == ID_HYBRID:
+            state = await self._id_hybrid_recall(state)
+
+        elapsed = time.perf_counter() - start + plan.get('mongo_seconds', 0.0)
+        self.planner.record(plan, strategy, elapsed)
+        print(f"   🧭 [Planner] 预测={plan.get('strategy')} 实际={strategy} 估算={plan.get('estimate')} "
+              f"Mongo命中={len(state.get('hard_candidate_ids', []))} 召回={len(state['semantic_candidate_ids'])} "
+              f"耗时={elapsed * 1000:.0f}ms")
+        return state
+
+    async def _search(self, **kwargs):
+        """主引擎混合检索；失败时 (fallback 模式) 改用进程内引擎，两者都失败才抛出"""
+        try:
+            return await asyncio.to_thread(self.es_manager.hybrid_search, **kwargs)
+        except Exception as e:
+            if settings.local_search.mode != "fallback":
+                raise
+            print(f"   ⚠️ ES 检索失败: {e}，改用进程内检索引擎")
+            # 首次使用时加载索引较慢，放在线程里取
+            engine = await asyncio.to_thread(lambda: container.local_search)
+            return await asyncio.to_thread(engine.hybrid_search, **kwargs)
+
+    async def _es_native_recall(self, state: MatchmakingState):
+        """条件宽泛时跳过 Mongo: 硬过滤条件翻译成 ES filter，在全量索引上混合检索"""
+        query = state['semantic_query']
+        filters, exclude = self.planner.es_filters(state['hard_filters'])
+        print(f"🧠 [Recall] ES 原生过滤检索: '{query}' filters={filters}")
+        try:
+            query_vector = await self.embedding_service.aembed_query(query)
+            results = await self._search(
+                query_text=query,
+                query_vector=query_vector,
+                top_k=50,
+                filters=filters,
+                exclude=exclude
+            )
+            state['semantic_candidate_ids'] = [res['user_id'] for res in results][:20]
+            print(f"   -> 召回: {len(results)} 人 (ES 原生过滤)")
+        except Exception as e:
+            print(f"   ❌ ES 检索失败: {e}")
+            state['semantic_candidate_ids'] = []
+        return state
+
+    async def _id_hybrid_recall(self, state: MatchmakingState):
+        """Mongo 过滤后的候选人 ID 限定混合检索"""
         candidates = state['hard_candidate_ids']
         query = state['semantic_query']
         
@@ -20,15 +92,15 @@ class RecallNode:
             return state
             
         try:
-            # 1. 准备向量 (复用 Chroma 的 embedding 逻辑)
-            query_vector = self.chroma.embeddings_model.embed_query(query)
+            # 1. 准备向量
+            query_vector = await self.embedding_service.aembed_query(query) # 跨请求微批
             
             # 2. 执行 Hybrid Search
             # 过滤条件: 只在 L1 过滤后的候选人中搜 (ID 过滤)
             # 必须传 filters，否则可能召回全是 L1 范围外的人，导致最终结果为空
             filters = {"user_id": candidates}
             
-            results = self.es_manager.hybrid_search(
+            results = await self._search(
                 query_text=query,
                 query_vector=query_vector,
                 top_k=50, # 稍微放大召回数量，因为后面还要 RRF
@@ -59,7 +131,9 @@ class RecallNode:
             # 兜底逻辑: 使用 Chroma 纯语义搜索
             try:
                 search_filter = {"user_id": {"$in": candidates}}
-                results = self.chroma.vector_db.similarity_search(query, k=15, filter=search_filter)
+                results = await asyncio.to_thread(
+                    self.chroma.vector_db.similarity_search, query, k=15, filter=search_filter
+                )
                 state['semantic_candidate_ids'] = [doc.metadata.get('user_id') for doc in results]
             except:
                 state['semantic_candidate_ids'] = candidates[:10]
@@ -1,4 +1,5 @@
 # -*- coding: utf-8 -*-
+import asyncio
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import PydanticOutputParser
 
@@ -41,6 +42,8 @@ class ResponseNode:
                 【精选嘉宾列表】:
                 {candidates_info}
                 
+                【条件放宽说明】: {relaxation_note}
+                
                 【推荐策略】:
                 1. **保留标题格式**: 请**原封不动**地使用我提供的嘉宾标题（例如：晨曦（30岁，178cm...）），**严禁**修改标题里的内容或格式，也不要加“第一位”这种前缀。
                 2. **拒绝报菜名**: 不要枯燥地罗列身高体重，要挖掘嘉宾的**闪光点**和**与用户的契合点**。
@@ -48,7 +51,8 @@ class ResponseNode:
                    - ❌ 差: "证据显示他喜欢滑雪。"
                    - ✅ 优: "而且惊喜的是，他是个户外达人，之前还提到每年冬天都会去崇礼滑雪，这和您爱运动的性格简直绝配！"
                 4. **差异化推荐**: 如果有多位嘉宾，请突出他们各自不同的气质（例如：一位是稳重的学霸，另一位是阳光的大男孩）。
-                5. **行动号召**: 最后用一句温暖的话鼓励用户发起互动，例如“想先了解哪一位？我可以帮您详细介绍。”
+                5. **如实说明放宽**: 如果【条件放宽说明】不是"无"，说明按原条件没有找到人，请在开头用一句话温和地告诉用户我们放宽了哪些条件。
+                6. **行动号召**: 最后用一句温暖的话鼓励用户发起互动，例如“想先了解哪一位？我可以帮您详细介绍。”
                 
                 请直接输出推荐语，每位嘉宾的介绍之间请空一行，保持排版舒适。"""
             ) | self.llm
@@ -71,7 +75,7 @@ class ResponseNode:
             ) | self.llm
         )
 
-    def evidence_hunting(self, state: MatchmakingState):
+    async def evidence_hunting(self, state: MatchmakingState):
         """Step 4.5: 证据搜寻与智能总结"""
         candidates = state.get('final_candidates', [])
         # 优化：剔除硬指标，只搜寻性格、兴趣、价值观相关的语义证据
@@ -93,7 +97,9 @@ class ResponseNode:
                         {"dialogue_type": {"$in": ["onboarding", "social"]}}
                     ]
                 }
-                docs = self.chroma.retrieve_related_context(query, user_id=cid_str, k=2, filter=search_filter)
+                docs = await asyncio.to_thread(
+                    self.chroma.retrieve_related_context, query, user_id=cid_str, k=2, filter=search_filter
+                )
                 
                 if docs:
                     # 拼接 raw text
@@ -101,7 +107,7 @@ class ResponseNode:
                     
                     # 2. 总结
                     print(f"   -> Analyzing raw text for {candidate['nickname']}...")
-                    res = self.evidence_chain.invoke({
+                    res = await self.evidence_chain.ainvoke({
                         "query": query,
                         "raw_text": raw_text,
                         "candidate_nickname": candidate['nickname'], 
@@ -139,7 +145,7 @@ class ResponseNode:
         except:
             return "体态未知"
 
-    def generate_response(self, state: MatchmakingState):
+    async def generate_response(self, state: MatchmakingState):
         """Step 5: 生成回复"""
         candidates = state.get('final_candidates', [])
         
@@ -147,7 +153,7 @@ class ResponseNode:
             # [NEW] 智能失败回复
             print("🤖 [Response] 搜索失败，生成建议...")
             try:
-                res = self.failure_chain.invoke({
+                res = await self.failure_chain.ainvoke({
                     "user_input": state['current_input'],
                     "hard_filters": state.get('hard_filters', {})
                 })
@@ -181,9 +187,10 @@ class ResponseNode:
             
             print("🤖 [Response] 正在生成推荐语...")
             try:
-                res = self.response_chain.invoke({
+                res = await self.response_chain.ainvoke({
                     "user_input": state['current_input'],
-                    "candidates_info": candidates_info
+                    "candidates_info": candidates_info,
+                    "relaxation_note": state.get('relaxation_note') or "无"
                 })
                 state['reply'] = res.content
             except Exception as e:
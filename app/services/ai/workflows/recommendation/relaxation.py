@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+确定性的条件放宽 (Relaxation Ladder)
+
+硬性条件查不到人时，不再让 LLM 猜一个放宽后的 FilterOutput (每次放宽都要一次 LLM 调用 + 一次查库，
+而且放宽的幅度不可控)。这里按固定顺序生成一组逐级放宽的条件 (每一级都在上一级的基础上继续放宽)：
+    放宽年龄 -> 不限 BMI -> 放宽身高 -> 不限城市
+各级并发计数 (每级最多数到 count_cap)，取命中人数达标的"放宽最少"的一级。
+LLM 只负责把放宽说明写进推荐语 (见 ResponseNode)。
+"""
+import asyncio
+import copy
+from typing import Dict, List, Optional, Tuple
+
+from app.core.config import settings, RelaxationConfig
+
+# 每一级梯子: (说明文案, 放宽后的完整 Mongo 条件)
+Rung = Tuple[str, Dict]
+
+
+def _widen_range(cond: Dict, step: float) -> Dict:
+    widened = dict(cond)
+    if "$gte" in widened: widened["$gte"] = widened["$gte"] - step
+    if "$lte" in widened: widened["$lte"] = widened["$lte"] + step
+    return widened
+
+
+def build_ladder(query: Dict, config: Optional[RelaxationConfig] = None) -> List[Rung]:
+    """
+    由原始 Mongo 条件生成放宽梯子 (不含原始条件本身)。
+    没有对应字段的步骤直接跳过；gender / _id 排除等条件始终保留。
+    """
+    config = config or settings.relaxation
+    ladder: List[Rung] = []
+    current = copy.deepcopy(query)
+
+    if isinstance(current.get("birth_year"), dict):
+        current["birth_year"] = _widen_range(current["birth_year"], config.age_step_years)
+        ladder.append((f"年龄范围前后各放宽 {config.age_step_years} 岁", copy.deepcopy(current)))
+
+    if "bmi" in current:
+        current.pop("bmi")
+        ladder.append(("不再限制体型 (BMI)", copy.deepcopy(current)))
+
+    if isinstance(current.get("height"), dict):
+        current["height"] = _widen_range(current["height"], config.height_step_cm)
+        ladder.append((f"身高范围前后各放宽 {config.height_step_cm}cm", copy.deepcopy(current)))
+
+    if "city" in current:
+        current.pop("city")
+        ladder.append(("不再限制城市", copy.deepcopy(current)))
+
+    return ladder
+
+
+async def count_ladder(collection, ladder: List[Rung], cap: int) -> List[int]:
+    """
+    并发统计每一级的命中人数 (最多数到 cap，够用即可)。
+    每级单独 count_documents(limit=cap)：扫描量以 cap 为界，不会因为最宽的一级 (如只剩 gender) 扫遍整个性别的用户。
+    """
+    if not ladder:
+        return []
+    return list(await asyncio.gather(*(collection.count_documents(cond, limit=cap) for _, cond in ladder)))
+
+
+def choose_rung(ladder: List[Rung], counts: List[int], min_hits: int) -> Optional[Tuple[int, Rung]]:
+    """取第一个命中数达标的梯级；都不达标时取命中最多的一级 (全为 0 则返回 None)"""
+    for i, n in enumerate(counts):
+        if n >= min_hits:
+            return i, ladder[i]
+    if counts and max(counts) > 0:
+        best = max(range(len(counts)), key=lambda i: (counts[i], -i))
+        return best, ladder[best]
+    return None
+
+
+def describe(ladder: List[Rung], index: int) -> str:
+    """第 index 级相对原始条件的累计放宽说明"""
+    return "；".join(desc for desc, _ in ladder[:index + 1])
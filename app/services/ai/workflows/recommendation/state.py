@@ -23,11 +23,6 @@ class FilterOutput(BaseModel):
     
     explanation: str = Field(description="筛选条件解释")
 
-class RefineOutput(BaseModel):
-    criteria: FilterOutput = Field(description="放宽后的具体筛选条件")
-    relaxed_query_str: str = Field(description="放宽后的自然语言描述 (用于前端展示/更新current_input)")
-    reason: str = Field(description="修正理由")
-
 class EvidenceOutput(BaseModel):
     has_evidence: bool = Field(description="是否找到证据")
     evidence_summary: str = Field(description="证据总结")
@@ -1,162 +1,312 @@
 # -*- coding: utf-8 -*-
-from datetime import datetime, date
+import asyncio
+from datetime import datetime, date, timedelta
+from typing import Dict, Optional
+
 from bson import ObjectId
+from pymongo import ReturnDocument
 
 from app.core.container import container
 from app.core.config import settings
+from app.core.utils.cal_utils import calc_age
+from app.services.dialogue_archive import aload_messages
+
+# 结算流水线的步骤 (按顺序执行，每一步独立记录状态，重试时跳过已完成的步骤)
+FINALIZE_STEPS = ["extract_delta", "summary", "es_index", "local_index", "chroma_index", "mark_basic"]
+
 
 class UserInitializationService:
     """
-    用户初始化编排服务 (Atomic Service)
-    职责：原子化地执行 [生成用户 -> 红娘对话 -> 提取画像] 这一完整流程。
+    用户初始化编排服务 (Outbox 模式)
+    职责：
+    1. `enqueue_finalization`: 在用户请求内，用**一次** Mongo 写操作翻转状态并写入 Outbox 记录。
+    2. `process_finalization`: 由后台 Worker 执行耗时步骤 (摘要 -> 向量化 -> ES -> Chroma)，
+       带重试、幂等键和逐步状态。
+
+    Outbox 记录内嵌在 `users_states` 文档的 `finalize_outbox` 字段中，
+    这样 "状态翻转 + 写 Outbox" 是单文档原子操作，不依赖副本集事务。
     """
 
     def __init__(self):
-        self.db_manager = container.db
         self.chroma_manager = container.chroma
         self.es_manager = container.es # <--- 从容器获取
-        
-        # 初始化各个子服务
-        self.llm_ai = container.get_llm("chat")
-        self.llm_user = container.get_llm("chat")
-        
-        self.termination_manager = container.termination_manager
+        self.embedding_service = container.embedding_service
+
         self.profile_service = container.profile_service
+        self.extraction_service = container.extraction_service
 
-    def finalize_user_onboarding(self, user_id: str) -> bool:
+        self.config = settings.finalization
+        self._index_payloads: Dict[ObjectId, tuple] = {} # 单次任务内 es_index / local_index 共用的 (ES 文档, 摘要向量)
+
+    @property
+    def adb(self):
+        """异步 Mongo 访问层 (Motor)，按当前事件循环获取"""
+        return container.async_db
+
+    # --- 1. 请求内: 翻转状态 + 写 Outbox ---
+
+    async def enqueue_finalization(self, user_id: str) -> bool:
         """
-        [原子操作块]
-        当用户完成 Onboarding 对话后调用。
-        负责：
-        1. (可选) 读取全量对话
-        2. (可选) 提取画像 -> 存库 
-           (注意: 现在的逻辑假设画像已经存在库里了。对于生成脚本，前面已经提了。对于实时对话，OnboardingNode已经增量提了)
-        3. 向量化画像 -> 存库 (Chroma + ES)
-        4. 向量化对话 -> 存库
-        5. 标记用户为 is_completed=True
+        原子地标记 Onboarding 完成并写入结算任务。
+        幂等键 = user_id + 对话发言计数，同一份对话重复提交不会产生新任务。
         """
-        print(f"🚀 [Finalize] 开始处理用户 {user_id} 的最终向量化与标记...")
         uid = ObjectId(user_id)
-        
+        dialogue_meta = await self.adb.onboarding_dialogues.find_one(
+            {"user_id": uid}, {"user_msg_count": 1}
+        ) or {}
+        idempotency_key = f"{user_id}:onboarding:{dialogue_meta.get('user_msg_count', 0)}"
+        now = datetime.now()
+
+        outbox = {
+            "idempotency_key": idempotency_key,
+            "status": "pending",
+            "steps": {},
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now
+        }
         try:
-            # 0. 清理旧向量 (幂等性)
-            try:
-                self.chroma_manager.vector_db.delete(where={"user_id": str(uid)})
-                # TODO: 以后可以考虑清理 ES，但 ES 的 index 方法本身就是覆盖式的 (Upsert)，所以不删也行
-            except:
-                pass
-
-            # 1. 读取对话 (用于向量化)
-            dialogue_record = self.db_manager.onboarding_dialogues.find_one({"user_id": uid})
-            if not dialogue_record:
-                print("   ❌ 未找到对话记录")
-                return False
-            messages = dialogue_record.get('messages', [])
-            
-            # 2. 读取画像 (用于向量化)
-            profile_data = self.db_manager.db["users_profile"].find_one({"user_id": uid}) or {}
-            
-            # 3. 向量化画像
-            print("   🧠 向量化画像...")
-            user_basic = self.db_manager.users_basic.find_one({"_id": uid})
-            summary_text = self.profile_service.generate_profile_summary(user_basic, profile_data)
-            
-            metadata = {
-                "user_id": str(user_id),
-                "gender": user_basic.get('gender', 'unknown'), 
-                "data_type": "profile_summary", 
-                "city": user_basic.get('city', 'unknown'),
-                "height": user_basic.get('height', 'unknown'),
-                "weight": user_basic.get('weight', 'unknown'),
-                "timestamp": str(datetime.now())
-            }
-            if isinstance(user_basic.get('birthday'), date): metadata['birth_year'] = user_basic.get('birthday').year
-            elif isinstance(user_basic.get('birthday'), str):
-                try: metadata['birth_year'] = int(user_basic.get('birthday').split('-')[0])
-                except: pass
-
-            # 写入 ES (新增混合检索同步)
-            print("   🔍 同步到 Elasticsearch (Hybrid Search)...")
-            try:
-                # 提取关键词标签 (全面覆盖文本字段)
-                interest_info = profile_data.get("interest_profile", {}) or {}
-                tags_list = interest_info.get("tags", [])
-                tags_str = " ".join(tags_list) if isinstance(tags_list, list) else ""
-                
-                edu_info = profile_data.get("education_profile", {}) or {}
-                highest_degree = edu_info.get("highest_degree", "")
-                major = edu_info.get("major", "")
-                
-                occ_info = profile_data.get("occupation_profile", {}) or {}
-                job_title = occ_info.get("job_title", "")
-                industry = occ_info.get("industry", "")
-                
-                fam_info = profile_data.get("family_profile", {}) or {}
-                family_struct = fam_info.get("family_structure", "")
-                
-                life_info = profile_data.get("lifestyle_profile", {}) or {}
-                smoking = life_info.get("smoking", "")
-                drinking = life_info.get("drinking", "")
-                exercise = life_info.get("exercise_level", "")
-                
-                pers_info = profile_data.get("personality_profile", {}) or {}
-                mbti = pers_info.get("mbti", "")
-                
-                love_info = profile_data.get("love_style_profile", {}) or {}
-                attachment = love_info.get("attachment_style", "")
-                
-                raw_keywords = [
-                    tags_str, highest_degree, major, job_title, industry,
-                    family_struct, smoking, drinking, exercise, mbti, attachment,
-                    user_basic.get('city', '')
-                ]
-                keyword_tags = " ".join([str(k) for k in raw_keywords if k])
-                # 获取向量 (复用 Chroma 的模型)
-                vector = self.chroma_manager.embeddings_model.embed_query(summary_text)
-                
-                # 索引到 ES
-                self.es_manager.index_user(
-                    user_id=str(user_id),
-                    profile_data={
-                        "gender": user_basic.get("gender"),
-                        "city": user_basic.get("city"),
-                        "age": user_basic.get("age") or 0,
-                        "tags": keyword_tags,
-                        "profile_text": summary_text
-                    },
-                    vector=vector
-                )
-            except Exception as es_err:
-                print(f"   ⚠️ ES 同步失败 (非致命错误): {es_err}")
-            
-            # 4. 向量化对话
-            print("   💬 向量化对话记录...")
-            if messages:
-                self.chroma_manager.add_conversation_chunks(
-                    str(user_id),
-                    messages,
-                    "onboarding",
-                    window_size=settings.rag.window_size,
-                    overlap=settings.rag.overlap
-                )
-            
-            # 5. 标记完成 (User States)
-            self.db_manager.users_states.update_one(
-                {"user_id": uid},
-                {"$set": {"is_onboarding_completed": True, "updated_at": datetime.now()}},
-                upsert=True
-            )
-            # 同时也更新 Basic (兼容性)
-            self.db_manager.users_basic.update_one(
-                {"_id": uid},
-                {"$set": {"is_completed": True}}
+            res = await self.adb.users_states.update_one(
+                {"user_id": uid, "finalize_outbox.idempotency_key": {"$ne": idempotency_key}},
+                {"$set": {
+                    "is_onboarding_completed": True,
+                    "updated_at": now,
+                    "finalize_outbox": outbox
+                }}
             )
-            
-            print("   ✅ 用户初始化最终完成！")
+            if res.matched_count == 0:
+                # 要么同一幂等键的任务已存在 (幂等 no-op)，要么状态文档缺失 (补建)
+                if not await self.adb.users_states.find_one({"user_id": uid}, {"_id": 1}):
+                    await self.adb.users_states.insert_one({
+                        "user_id": uid,
+                        "is_onboarding_completed": True,
+                        "updated_at": now,
+                        "finalize_outbox": outbox
+                    })
+                else:
+                    print(f"   ♻️ [Finalize] 任务已存在 (key={idempotency_key})，跳过重复提交")
+            print(f"📮 [Finalize] 用户 {user_id} 已标记完成，结算任务已入队 (key={idempotency_key})")
             return True
-            
         except Exception as e:
-            print(f"   ❌ Finalize 失败: {e}")
-            import traceback
-            traceback.print_exc()
-            return False
\ No newline at end of file
+            print(f"   ❌ [Finalize] 入队失败: {e}")
+            return False
+
+    # --- 2. Worker: 领取并执行任务 ---
+
+    async def claim_next_job(self) -> Optional[Dict]:
+        """
+        领取一个到期的任务 (pending / 待重试 / 租约过期)，并加租约防止重复执行。
+        每次领取计为一次尝试：处理中途 Worker 崩溃或超出租约的任务同样会累积次数，最终进入 dead。
+        """
+        now = datetime.now()
+        # 租约过期且次数已用尽的任务 (上一次执行没能走到 _mark_failed) 直接标记 dead，不再领取
+        expired = {"finalize_outbox.status": "processing", "finalize_outbox.locked_until": {"$lte": now}}
+        res = await self.adb.users_states.update_many(
+            {**expired, "finalize_outbox.attempts": {"$gte": self.config.max_attempts}},
+            {"$set": {"finalize_outbox.status": "dead", "finalize_outbox.last_error": "lease expired"}}
+        )
+        if res.modified_count:
+            print(f"   ☠️ [Finalize] {res.modified_count} 个任务租约过期且已达最大重试次数，标记为 dead")
+
+        return await self.adb.users_states.find_one_and_update(
+            {"$or": [
+                {"finalize_outbox.status": {"$in": ["pending", "failed"]},
+                 "finalize_outbox.next_attempt_at": {"$lte": now}},
+                expired
+            ]},
+            self._lease_update(now),
+            projection={"user_id": 1, "finalize_outbox": 1},
+            sort=[("finalize_outbox.next_attempt_at", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def _lease_update(self, now: datetime) -> Dict:
+        return {
+            "$set": {
+                "finalize_outbox.status": "processing",
+                "finalize_outbox.locked_until": now + timedelta(seconds=self.config.lease_seconds)
+            },
+            "$inc": {"finalize_outbox.attempts": 1}
+        }
+
+    async def process_finalization(self, job: Dict) -> bool:
+        """逐步执行结算任务。已完成的步骤直接跳过，失败时按指数退避安排重试。"""
+        uid = job["user_id"]
+        user_id = str(uid)
+        outbox = job.get("finalize_outbox") or {}
+        key = outbox.get("idempotency_key")
+        steps_state = outbox.get("steps") or {}
+
+        print(f"🚀 [Finalize] 开始处理用户 {user_id} 的结算任务 (key={key}, attempt={outbox.get('attempts', 0)})")
+        try:
+            for step in FINALIZE_STEPS:
+                if (steps_state.get(step) or {}).get("status") == "done":
+                    continue
+                try:
+                    await getattr(self, f"_step_{step}")(uid)
+                    await self._update_outbox(uid, key, {
+                        f"finalize_outbox.steps.{step}": {"status": "done", "at": datetime.now()}
+                    })
+                    print(f"   ✅ [Finalize] {step}")
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    print(f"   ❌ [Finalize] 步骤 {step} 失败: {e}")
+                    await self._mark_failed(uid, key, outbox.get("attempts", 0), step, e)
+                    return False
+        finally:
+            self._index_payloads.pop(uid, None)
+
+        await self._update_outbox(uid, key, {
+            "finalize_outbox.status": "done",
+            "finalize_outbox.finished_at": datetime.now()
+        })
+        print("   ✅ 用户初始化最终完成！")
+        return True
+
+    async def _update_outbox(self, uid: ObjectId, key: str, set_fields: Dict):
+        # 带上幂等键做条件更新，避免旧任务覆盖新任务的状态
+        await self.adb.users_states.update_one(
+            {"user_id": uid, "finalize_outbox.idempotency_key": key},
+            {"$set": set_fields}
+        )
+
+    async def _mark_failed(self, uid: ObjectId, key: str, attempts: int, step: str, error: Exception):
+        # attempts 已在领取时计入本次执行
+        dead = attempts >= self.config.max_attempts
+        delay = self.config.backoff_base_seconds * (2 ** (attempts - 1))
+        await self._update_outbox(uid, key, {
+            "finalize_outbox.status": "dead" if dead else "failed",
+            "finalize_outbox.next_attempt_at": datetime.now() + timedelta(seconds=delay),
+            "finalize_outbox.last_error": f"{step}: {error}",
+            f"finalize_outbox.steps.{step}": {"status": "failed", "at": datetime.now(), "error": str(error)}
+        })
+        if dead:
+            print(f"   ☠️ [Finalize] 已达最大重试次数 ({attempts})，任务标记为 dead")
+
+    # --- 3. 各个步骤 (均需幂等) ---
+
+    async def _step_extract_delta(self, uid: ObjectId):
+        """把最后一批尚未提取的对话落库，保证摘要基于最终画像"""
+        await self.extraction_service.run_once(str(uid), check_termination=False, raise_on_error=True)
+
+    async def _step_summary(self, uid: ObjectId):
+        """生成画像摘要 (整个结算只生成这一次)，写入 users_profile 的摘要缓存供后续复用"""
+        user_basic = await self.adb.users_basic.find_one({"_id": uid}) or {}
+        profile_data = await self.adb.profile.find_one({"user_id": uid}) or {}
+        summary_text = await asyncio.to_thread(
+            self.profile_service.generate_profile_summary,
+            user_basic, self.profile_service.clean_profile_data(profile_data)
+        )
+        await self.adb.profile.update_one(
+            {"user_id": uid},
+            {"$set": {"user_summary": summary_text, "summary_updated_at": datetime.now()}},
+            upsert=True
+        )
+
+    async def _index_payload(self, uid: ObjectId) -> tuple:
+        """构造索引文档并向量化摘要 (同一任务内只算一次，ES 与进程内引擎共用同一个向量)"""
+        if uid not in self._index_payloads:
+            user_basic = await self.adb.users_basic.find_one({"_id": uid}) or {}
+            profile_data = await self.adb.profile.find_one({"user_id": uid}) or {}
+            summary_text = profile_data.get("user_summary", "")
+
+            vector = await self.embedding_service.aembed_query(summary_text)
+            self._index_payloads[uid] = (self.build_es_profile(user_basic, profile_data, summary_text), vector)
+        return self._index_payloads[uid]
+
+    async def _step_es_index(self, uid: ObjectId):
+        """向量化摘要并写入 ES (index 以 user_id 为文档 ID，天然幂等)"""
+        if settings.local_search.mode == "primary":
+            return # 无 ES 部署，由 local_index 步骤写入进程内引擎
+        es_profile, vector = await self._index_payload(uid)
+        await asyncio.to_thread(self.es_manager.index_user, str(uid), es_profile, vector, True)
+
+    async def _step_local_index(self, uid: ObjectId):
+        """写入进程内检索引擎 (按 user_id 覆盖，幂等)；local_search.mode 为 off 时跳过"""
+        if settings.local_search.mode == "off":
+            return
+        es_profile, vector = await self._index_payload(uid)
+        await asyncio.to_thread(container.local_search.index_user, str(uid), es_profile, vector, True)
+
+    async def _step_chroma_index(self, uid: ObjectId):
+        """对话分块向量化 (确定性 Chunk ID，增量 upsert，重复执行结果一致)"""
+        # 对话可能已被归档到冷存储 (重新索引场景)，透明解压读取
+        messages = await aload_messages(self.adb, uid)
+        if not messages:
+            return
+        await asyncio.to_thread(
+            self.chroma_manager.add_conversation_chunks,
+            str(uid),
+            messages,
+            "onboarding",
+            window_size=settings.rag.window_size,
+            overlap=settings.rag.overlap
+        )
+
+    async def _step_mark_basic(self, uid: ObjectId):
+        # 同时也更新 Basic (兼容性)
+        await self.adb.users_basic.update_one(
+            {"_id": uid},
+            {"$set": {"is_completed": True}}
+        )
+
+    @staticmethod
+    def build_es_profile(user_basic: Dict, profile_data: Dict, summary_text: str) -> Dict:
+        """构造 ES 文档 (提取关键词标签，全面覆盖文本字段)"""
+        interest_info = profile_data.get("interest_profile", {}) or {}
+        tags_list = interest_info.get("tags", [])
+        tags_str = " ".join(tags_list) if isinstance(tags_list, list) else ""
+
+        edu_info = profile_data.get("education_profile", {}) or {}
+        occ_info = profile_data.get("occupation_profile", {}) or {}
+        fam_info = profile_data.get("family_profile", {}) or {}
+        life_info = profile_data.get("lifestyle_profile", {}) or {}
+        pers_info = profile_data.get("personality_profile", {}) or {}
+        love_info = profile_data.get("love_style_profile", {}) or {}
+
+        raw_keywords = [
+            tags_str, edu_info.get("highest_degree", ""), edu_info.get("major", ""),
+            occ_info.get("job_title", ""), occ_info.get("industry", ""),
+            fam_info.get("family_structure", ""),
+            life_info.get("smoking", ""), life_info.get("drinking", ""), life_info.get("exercise_level", ""),
+            pers_info.get("mbti", ""), love_info.get("attachment_style", ""),
+            user_basic.get('city', '')
+        ]
+        keyword_tags = " ".join([str(k) for k in raw_keywords if k])
+
+        age = user_basic.get("age") or 0
+        if not age and isinstance(user_basic.get("birthday"), date):
+            age = calc_age(user_basic.get("birthday"))
+
+        birth_year = user_basic.get("birth_year")
+        if not birth_year and isinstance(user_basic.get("birthday"), date):
+            birth_year = user_basic["birthday"].year
+
+        return {
+            "gender": user_basic.get("gender"),
+            "city": user_basic.get("city"),
+            "age": age,
+            "birth_year": birth_year,
+            "tags": keyword_tags,
+            "profile_text": summary_text
+        }
+
+    # --- 4. 同步入口 (脚本/数据生成使用) ---
+
+    def finalize_user_onboarding(self, user_id: str) -> bool:
+        """
+        [同步版本] 入队并立即在当前线程执行完整结算流程。
+        仅供脚本使用；在线请求请使用 enqueue_finalization + FinalizationWorker。
+        """
+        async def _run() -> bool:
+            if not await self.enqueue_finalization(user_id):
+                return False
+            # 与 Worker 一样加租约并计入尝试次数
+            job = await self.adb.users_states.find_one_and_update(
+                {"user_id": ObjectId(user_id)}, self._lease_update(datetime.now()),
+                projection={"user_id": 1, "finalize_outbox": 1},
+                return_document=ReturnDocument.AFTER
+            )
+            return await self.process_finalization(job)
+        return asyncio.run(_run())
@@ -0,0 +1,340 @@
+# -*- coding: utf-8 -*-
+"""
+批量导入用户 (合作方存量会员迁移)
+
+输入为 NDJSON，每行一个用户:
+    {"account": "13800000000", "password": "...", "nickname": "小王", "gender": "female",
+     "birthday": "1995-06-01", "city": "上海", "height": 165, "weight": 50,
+     "self_intro": "...", "persona": {"occupation": "教师"}}
+`password` 与 `password_hash` (已是 bcrypt 哈希，直接沿用) 二选一，其余字段可选。
+
+流程 (逐批流式处理，内存只持有一批):
+1. 解析 + 校验，文件内重复账号和已注册账号记为逐行错误；
+2. 密码在进程池中并行 bcrypt (同时上一批在写库，两者流水线重叠)；
+3. 依次对 users_basic -> users_states -> users_persona -> users_auth 做有序 insert_many，
+   某一行写入失败时记录错误、回滚该行已写入的文档，并从失败位置之后继续，不中断整个导入。
+   users_auth 最后写入，账号只有在其余文档都就绪后才可登录。
+
+命令行:
+    python -m app.services.bulk_import members.ndjson --errors-out errors.ndjson
+"""
+import argparse
+import asyncio
+import json
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, Optional
+
+import bcrypt
+from bson import ObjectId
+from pymongo.errors import BulkWriteError
+
+from app.core.config import settings, BulkImportConfig
+from app.core.utils.cal_utils import derive_basic_fields
+
+# 写入顺序: 前面的集合失败时，后面的不再写入；users_auth 放最后
+WRITE_ORDER = [("users_basic", "basic"), ("users_states", "states"), ("users_persona", "persona"), ("users_auth", "auth")]
+DUPLICATE_KEY = 11000
+
+
+def hash_passwords(passwords: List[str], rounds: int) -> List[str]:
+    """[进程池] 批量计算 bcrypt 哈希"""
+    return [bcrypt.hashpw(p.encode("utf-8"), bcrypt.gensalt(rounds=rounds)).decode("utf-8") for p in passwords]
+
+
+def parse_row(raw: Dict) -> Dict:
+    """校验并规范化一行，非法时抛出 ValueError"""
+    if not isinstance(raw, dict):
+        raise ValueError("每行必须是 JSON 对象")
+    account = str(raw.get("account") or "").strip()
+    if not account:
+        raise ValueError("缺少 account")
+    password, password_hash = raw.get("password"), raw.get("password_hash")
+    if not password and not password_hash:
+        raise ValueError("缺少 password 或 password_hash")
+    if password_hash and not str(password_hash).startswith("$2"):
+        raise ValueError("password_hash 不是 bcrypt 格式")
+
+    gender = raw.get("gender") or "unknown"
+    if gender not in ("male", "female", "unknown"):
+        raise ValueError(f"非法的 gender: {gender}")
+    birthday = raw.get("birthday")
+    if birthday:
+        try:
+            birthday = datetime.strptime(str(birthday), "%Y-%m-%d")
+        except ValueError:
+            raise ValueError(f"birthday 格式应为 YYYY-MM-DD: {birthday}")
+    for key in ("height", "weight"):
+        if raw.get(key) is not None and not isinstance(raw[key], (int, float)):
+            raise ValueError(f"{key} 必须是数字")
+    persona = raw.get("persona") or {"occupation": "未知"}
+    if not isinstance(persona, dict):
+        raise ValueError("persona 必须是 JSON 对象")
+
+    return {
+        "account": account,
+        "password": password,
+        "password_hash": password_hash,
+        # 缺失的字段不落库 (而不是写 None)，读取方按各自的默认值处理
+        "basic": {k: v for k, v in {
+            "nickname": raw.get("nickname") or f"用户{account[-4:]}",
+            "gender": gender,
+            "city": raw.get("city") or "未知",
+            "birthday": birthday,
+            "height": raw.get("height"),
+            "weight": raw.get("weight"),
+            "self_intro_raw": raw.get("self_intro"),
+        }.items() if v is not None and v != ""},
+        "persona": persona,
+    }
+
+
+async def aiter_lines(chunks: AsyncIterator[bytes]) -> AsyncIterator[str]:
+    """把字节流 (如 `Request.stream()`) 切分为行"""
+    buffer = b""
+    async for chunk in chunks:
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            yield line.decode("utf-8")
+    if buffer:
+        yield buffer.decode("utf-8")
+
+
+async def aiter_file(path: str) -> AsyncIterator[str]:
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            yield line
+
+
+class BulkUserImporter:
+    """
+    服务内为 container 单例 (进程池跨请求复用，避免每次导入都重新拉起 spawn 进程)，在 lifespan 关闭时 close()。
+    不传 async_db 时按当前事件循环取 container.async_db。
+    """
+    def __init__(self, async_db=None, config: Optional[BulkImportConfig] = None):
+        self._db = async_db
+        self.config = config or settings.bulk_import
+        self.workers = self.config.hash_workers or os.cpu_count() or 1
+        self._pool: Optional[ProcessPoolExecutor] = None
+
+    @property
+    def db(self):
+        if self._db is not None:
+            return self._db
+        from app.core.container import container
+        return container.async_db
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: 服务进程里已有 Motor / 模型线程，fork 不安全
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    # --- 主流程 ---
+
+    async def run(self, lines: AsyncIterator[str]) -> Dict:
+        start = time.perf_counter()
+        report = {"total": 0, "imported": 0, "failed": 0, "errors": [], "errors_truncated": False,
+                  "hash_seconds": 0.0, "write_seconds": 0.0}
+        seen_accounts = set()
+        batch: List[Dict] = []
+        write_task: Optional[asyncio.Task] = None
+
+        async def flush(rows: List[Dict]):
+            nonlocal write_task
+            prepared = await self._prepare(rows, seen_accounts, report)
+            if write_task:
+                previous, write_task = write_task, None
+                await previous # 上一批写完再发下一批，保证批次有序
+            write_task = asyncio.create_task(self._write(prepared, report))
+
+        line_no = 0
+        try:
+            async for line in lines:
+                line_no += 1
+                line = line.strip()
+                if not line:
+                    continue
+                report["total"] += 1
+                try:
+                    row = parse_row(json.loads(line))
+                except ValueError as e: # JSONDecodeError 也是 ValueError
+                    self._record_error(report, line_no, None, str(e))
+                    continue
+                row["line"] = line_no
+                batch.append(row)
+                if len(batch) >= self.config.batch_size:
+                    await flush(batch)
+                    batch = []
+            if batch:
+                await flush(batch)
+        finally:
+            # _prepare 或请求流中途出错时，也要等在途批次写完 (失败行在其内部回滚)，其异常不会被丢弃
+            if write_task:
+                await write_task
+
+        elapsed = time.perf_counter() - start
+        report["elapsed_seconds"] = round(elapsed, 3)
+        report["rows_per_second"] = round(report["imported"] / elapsed, 1) if elapsed else 0.0
+        report["hash_seconds"] = round(report["hash_seconds"], 3)
+        report["write_seconds"] = round(report["write_seconds"], 3)
+        return report
+
+    def _record_error(self, report: Dict, line: int, account: Optional[str], error: str):
+        report["failed"] += 1
+        if len(report["errors"]) < self.config.max_reported_errors:
+            report["errors"].append({"line": line, "account": account, "error": error})
+        else:
+            report["errors_truncated"] = True
+
+    # --- 1. 去重 + 哈希 + 组装文档 ---
+
+    async def _prepare(self, rows: List[Dict], seen_accounts: set, report: Dict) -> List[Dict]:
+        unique = []
+        for row in rows:
+            if row["account"] in seen_accounts:
+                self._record_error(report, row["line"], row["account"], "导入文件内账号重复")
+                continue
+            seen_accounts.add(row["account"])
+            unique.append(row)
+
+        existing = {
+            doc["account"] async for doc in self.db.users_auth.find(
+                {"account": {"$in": [r["account"] for r in unique]}}, {"account": 1}
+            )
+        }
+        valid = []
+        for row in unique:
+            if row["account"] in existing:
+                self._record_error(report, row["line"], row["account"], "该账号已被注册")
+            else:
+                valid.append(row)
+
+        t0 = time.perf_counter()
+        to_hash = [r for r in valid if not r["password_hash"]]
+        hashes = await self._hash([r["password"] for r in to_hash])
+        for row, h in zip(to_hash, hashes):
+            row["password_hash"] = h
+        report["hash_seconds"] += time.perf_counter() - t0
+
+        now = datetime.now()
+        for row in valid:
+            uid = ObjectId()
+            basic = {"_id": uid, **row["basic"], "created_at": now, "updated_at": now}
+            basic.update(derive_basic_fields(basic)) # 物化 bmi / birth_year，与注册/资料接口一致
+            row["docs"] = {
+                "basic": basic,
+                "states": {"user_id": uid, "is_onboarding_completed": False, "updated_at": now},
+                "persona": {"user_id": uid, "persona": row["persona"], "created_at": now},
+                "auth": {"account": row["account"], "password_hash": row["password_hash"],
+                         "user_id": uid, "created_at": now},
+            }
+        return valid
+
+    async def _hash(self, passwords: List[str]) -> List[str]:
+        """按进程数切块并行计算 (保持顺序)"""
+        if not passwords:
+            return []
+        size = math.ceil(len(passwords) / self.workers)
+        loop = asyncio.get_running_loop()
+        parts = await asyncio.gather(*[
+            loop.run_in_executor(self.pool, hash_passwords, passwords[i: i + size], self.config.bcrypt_rounds)
+            for i in range(0, len(passwords), size)
+        ])
+        return [h for part in parts for h in part]
+
+    # --- 2. 有序批量写入 ---
+
+    async def _write(self, rows: List[Dict], report: Dict):
+        t0 = time.perf_counter()
+        alive = rows
+        written: List[str] = []
+        for coll_name, key in WRITE_ORDER:
+            failed = await self._insert_ordered(getattr(self.db, coll_name), [r["docs"][key] for r in alive])
+            if failed:
+                failed_rows = [alive[pos] for pos in failed]
+                for pos, error in failed.items():
+                    self._record_error(report, alive[pos]["line"], alive[pos]["account"], error)
+                await self._rollback(failed_rows, written)
+                alive = [r for pos, r in enumerate(alive) if pos not in failed]
+            written.append(coll_name)
+        report["imported"] += len(alive)
+        report["write_seconds"] += time.perf_counter() - t0
+
+    @staticmethod
+    async def _insert_ordered(collection, docs: List[Dict]) -> Dict[int, str]:
+        """有序 insert_many；遇到失败行时记录并从其后一行继续，返回 {位置: 错误信息}"""
+        failed = {}
+        start = 0
+        while start < len(docs):
+            try:
+                await collection.insert_many(docs[start:], ordered=True)
+                break
+            except BulkWriteError as e:
+                write_errors = e.details.get("writeErrors") or []
+                if not write_errors:
+                    raise
+                err = write_errors[0]
+                pos = start + err["index"]
+                failed[pos] = "该账号已被注册" if err.get("code") == DUPLICATE_KEY and collection.name == "users_auth" \
+                    else err.get("errmsg", "写入失败")
+                start = pos + 1
+        return failed
+
+    async def _rollback(self, rows: List[Dict], written: List[str]):
+        """删除失败行在前序集合中已写入的文档，避免留下没有账号的孤儿档案"""
+        uids = [r["docs"]["basic"]["_id"] for r in rows]
+        for coll_name in written:
+            field = "_id" if coll_name == "users_basic" else "user_id"
+            await getattr(self.db, coll_name).delete_many({field: {"$in": uids}})
+
+    @staticmethod
+    def print_report(report: Dict):
+        print(f"📥 [BulkImport] 共 {report['total']} 行: 成功 {report['imported']}，失败 {report['failed']}")
+        print(f"   耗时 {report['elapsed_seconds']:.1f}s ({report['rows_per_second']:.1f} 行/s)，"
+              f"其中 bcrypt {report['hash_seconds']:.1f}s，写库 {report['write_seconds']:.1f}s (两者流水线重叠)")
+        for err in report["errors"][:10]:
+            print(f"   ❌ 第 {err['line']} 行 ({err['account']}): {err['error']}")
+        if report["failed"] > 10:
+            print(f"   ... 其余 {report['failed'] - 10} 条错误见 --errors-out")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk import users from NDJSON")
+    parser.add_argument("path", help="NDJSON 文件路径")
+    parser.add_argument("--batch-size", type=int, help="每批写入行数")
+    parser.add_argument("--workers", type=int, help="bcrypt 进程数")
+    parser.add_argument("--errors-out", help="把逐行错误写入该 NDJSON 文件")
+    args = parser.parse_args()
+
+    from app.core.container import container
+
+    config = settings.bulk_import.model_copy(update={
+        k: v for k, v in {"batch_size": args.batch_size, "hash_workers": args.workers}.items() if v
+    })
+
+    async def _main():
+        importer = BulkUserImporter(container.async_db, config)
+        try:
+            return await importer.run(aiter_file(args.path))
+        finally:
+            importer.close()
+            container.async_db.close()
+
+    result = asyncio.run(_main())
+    BulkUserImporter.print_report(result)
+    if args.errors_out:
+        with open(args.errors_out, "w", encoding="utf-8") as f:
+            for err in result["errors"]:
+                f.write(json.dumps(err, ensure_ascii=False) + "\n")
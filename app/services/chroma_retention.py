@@ -0,0 +1,204 @@
+# -*- coding: utf-8 -*-
+"""
+Chroma 对话块保留 / 压缩任务 (Tiered Lifecycle Management)
+
+按 `metadata.dialogue_type` 读取 `settings.chroma_retention.policies`，依据 `timestamp` 元数据：
+- permanent:      不做任何处理 (onboarding)；
+- persistent:     不淘汰，但早于 `compact_after_days` 的相邻块合并压缩；
+- sliding_window: 超过 `max_age_days` 或超出 `max_chunks_per_user` 的块直接删除，剩余的旧块同样可压缩。
+
+命令行 (默认 dry-run，只输出统计):
+    python -m app.services.chroma_retention
+    python -m app.services.chroma_retention --apply --type user_chat
+"""
+import argparse
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.documents import Document
+
+from app.core.config import settings, ChromaRetentionConfig, RetentionPolicy
+
+
+def parse_chunk_timestamp(value) -> Optional[datetime]:
+    """解析 add_conversation_chunks 写入的 timestamp (str(datetime))，无法解析时返回 None (视为未知，保留)"""
+    if not value:
+        return None
+    try:
+        ts = datetime.fromisoformat(str(value))
+    except ValueError:
+        return None
+    if ts.tzinfo is not None:
+        ts = ts.astimezone().replace(tzinfo=None)
+    return ts
+
+
+def merge_window_texts(texts: List[str]) -> str:
+    """合并相邻滑动窗口的文本，去掉窗口之间重叠的消息行"""
+    merged: List[str] = []
+    for text in texts:
+        lines = text.split("\n")
+        overlap = 0
+        for k in range(min(len(merged), len(lines)), 0, -1):
+            if merged[-k:] == lines[:k]:
+                overlap = k
+                break
+        merged.extend(lines[overlap:])
+    return "\n".join(merged)
+
+
+class ChromaRetentionService:
+    """计算并执行 Chroma 集合的保留计划"""
+
+    def __init__(self, chroma_manager, config: Optional[ChromaRetentionConfig] = None):
+        self.chroma = chroma_manager
+        self.config = config or settings.chroma_retention
+
+    # --- 1. 扫描 ---
+
+    def scan(self, dialogue_types: Optional[List[str]] = None) -> Dict[Tuple[str, str], List[Tuple[str, Dict]]]:
+        """分页读取元数据 (不读正文和向量)，按 (dialogue_type, user_id) 分组"""
+        groups = defaultdict(list)
+        where = {"dialogue_type": {"$in": dialogue_types}} if dialogue_types else None
+        offset = 0
+        while True:
+            page = self.chroma.vector_db.get(
+                where=where, include=["metadatas"],
+                limit=self.config.scan_page_size, offset=offset
+            )
+            ids = page.get("ids", [])
+            if not ids:
+                break
+            for cid, meta in zip(ids, page.get("metadatas", [])):
+                meta = meta or {}
+                groups[(meta.get("dialogue_type", "unknown"), meta.get("user_id", ""))].append((cid, meta))
+            offset += len(ids)
+            if len(ids) < self.config.scan_page_size:
+                break
+        return groups
+
+    # --- 2. 计算计划 ---
+
+    def plan(self, groups: Dict[Tuple[str, str], List[Tuple[str, Dict]]], now: Optional[datetime] = None) -> Dict:
+        """
+        返回 {"evict": [id...], "compact": [[id...], ...], "stats": {dialogue_type: {...}}}。
+        纯计算，不访问数据库。
+        """
+        now = now or datetime.now()
+        evict_ids: List[str] = []
+        compact_groups: List[List[str]] = []
+        stats = defaultdict(lambda: {"users": 0, "scanned": 0, "evicted": 0, "compacted_from": 0, "compacted_into": 0})
+
+        for (dialogue_type, _user_id), chunks in groups.items():
+            type_stats = stats[dialogue_type]
+            type_stats["users"] += 1
+            type_stats["scanned"] += len(chunks)
+
+            policy: Optional[RetentionPolicy] = self.config.policies.get(dialogue_type)
+            if not policy or policy.mode == "permanent":
+                continue
+
+            # 新 -> 旧 排序 (时间戳未知的视为最新，不参与淘汰)
+            def sort_key(item):
+                ts = parse_chunk_timestamp(item[1].get("timestamp"))
+                return (ts or datetime.max, item[1].get("start_message_index", 0))
+            ordered = sorted(chunks, key=sort_key, reverse=True)
+
+            kept = []
+            if policy.mode == "sliding_window":
+                cutoff = now - timedelta(days=policy.max_age_days) if policy.max_age_days else None
+                for rank, (cid, meta) in enumerate(ordered):
+                    ts = parse_chunk_timestamp(meta.get("timestamp"))
+                    too_old = cutoff is not None and ts is not None and ts < cutoff
+                    over_cap = policy.max_chunks_per_user is not None and rank >= policy.max_chunks_per_user
+                    if too_old or over_cap:
+                        evict_ids.append(cid)
+                        type_stats["evicted"] += 1
+                    else:
+                        kept.append((cid, meta))
+            else:
+                kept = ordered
+
+            # 压缩: 旧的、未压缩过的块，按消息顺序每 N 个相邻块合并
+            if policy.compact_after_days is None or policy.compact_group_size < 2:
+                continue
+            compact_cutoff = now - timedelta(days=policy.compact_after_days)
+            candidates = [
+                (cid, meta) for cid, meta in kept
+                if not meta.get("compacted")
+                and (parse_chunk_timestamp(meta.get("timestamp")) or now) < compact_cutoff
+            ]
+            candidates.sort(key=lambda item: item[1].get("start_message_index", 0))
+            for b in range(0, len(candidates), policy.compact_group_size):
+                group = candidates[b: b + policy.compact_group_size]
+                if len(group) < 2:
+                    continue
+                compact_groups.append([cid for cid, _ in group])
+                type_stats["compacted_from"] += len(group)
+                type_stats["compacted_into"] += 1
+
+        for type_stats in stats.values():
+            type_stats["remaining"] = type_stats["scanned"] - type_stats["evicted"] \
+                                      - type_stats["compacted_from"] + type_stats["compacted_into"]
+        return {"evict": evict_ids, "compact": compact_groups, "stats": dict(stats)}
+
+    # --- 3. 执行 ---
+
+    def apply(self, plan: Dict, batch_size: int = 500):
+        for b in range(0, len(plan["evict"]), batch_size):
+            self.chroma.vector_db.delete(ids=plan["evict"][b: b + batch_size])
+
+        for group_ids in plan["compact"]:
+            res = self.chroma.vector_db.get(ids=group_ids, include=["documents", "metadatas"])
+            rows = sorted(
+                zip(res.get("ids", []), res.get("documents", []), res.get("metadatas", [])),
+                key=lambda row: (row[2] or {}).get("start_message_index", 0)
+            )
+            if len(rows) < 2:
+                continue
+            first_meta, last_meta = rows[0][2] or {}, rows[-1][2] or {}
+            content = merge_window_texts([doc for _, doc, _ in rows])
+            metadata = {
+                "user_id": first_meta.get("user_id", ""),
+                "dialogue_type": first_meta.get("dialogue_type", ""),
+                "start_message_index": first_meta.get("start_message_index", 0),
+                "end_message_index": last_meta.get("end_message_index", 0),
+                "timestamp": first_meta.get("timestamp", ""),
+                "compacted": True,
+                "source_chunks": len(rows)
+            }
+            new_id = self.chroma.build_chunk_id(
+                metadata["user_id"], metadata["dialogue_type"], metadata["start_message_index"], content
+            )
+            # 先写入合并块，再删除原块，中途失败也不会丢证据
+            self.chroma.vector_db.add_documents([Document(page_content=content, metadata=metadata)], ids=[new_id])
+            self.chroma.vector_db.delete(ids=[cid for cid, _, _ in rows if cid != new_id])
+
+    def run(self, dry_run: Optional[bool] = None, dialogue_types: Optional[List[str]] = None) -> Dict:
+        """扫描 -> 计划 -> (可选) 执行，返回统计信息"""
+        dry_run = self.config.dry_run if dry_run is None else dry_run
+        plan = self.plan(self.scan(dialogue_types))
+        if not dry_run:
+            self.apply(plan)
+        self.print_report(plan["stats"], dry_run)
+        return plan["stats"]
+
+    @staticmethod
+    def print_report(stats: Dict, dry_run: bool):
+        mode = "DRY-RUN" if dry_run else "APPLIED"
+        print(f"🧹 [Retention] Chroma 保留任务 ({mode})")
+        print(f"   {'dialogue_type':<14} {'users':>6} {'scanned':>8} {'evicted':>8} {'compacted':>12} {'remaining':>10}")
+        for dialogue_type, s in sorted(stats.items()):
+            compacted = f"{s['compacted_from']}->{s['compacted_into']}"
+            print(f"   {dialogue_type:<14} {s['users']:>6} {s['scanned']:>8} {s['evicted']:>8} {compacted:>12} {s['remaining']:>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Chroma dialogue chunk retention / compaction")
+    parser.add_argument("--apply", action="store_true", help="实际执行删除与压缩 (默认只输出统计)")
+    parser.add_argument("--type", dest="types", nargs="*", help="只处理指定的 dialogue_type")
+    args = parser.parse_args()
+
+    from app.core.container import container
+    container.chroma_retention.run(dry_run=not args.apply, dialogue_types=args.types)
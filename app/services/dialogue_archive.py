@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""
+已结算 Onboarding 对话的冷存储归档
+
+结算完成 (`users_states.finalize_outbox.status == "done"`) 超过 `min_age_days` 的用户：
+1. 把 `users_onboarding_dialogues.messages` 编码为 BSON 后用 zstd 压缩，写入 `users_onboarding_archive`；
+2. 在原对话文档上 `$unset messages`，只保留轻量指针 `archived: {at, raw_bytes, compressed_bytes, message_count}`。
+
+读取全量对话请使用 `load_messages` / `aload_messages` (未归档直接返回，已归档透明解压)；
+需要恢复成热数据时调用 `rehydrate`。
+
+命令行:
+    python -m app.services.dialogue_archive            # dry-run，只统计
+    python -m app.services.dialogue_archive --apply
+    python -m app.services.dialogue_archive --rehydrate <user_id>
+"""
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+import bson
+import zstandard
+from bson import Binary, ObjectId
+
+from app.core.config import settings, DialogueArchiveConfig
+
+CODEC = "zstd+bson"
+
+
+def compress_messages(messages: List[Dict], level: int) -> bytes:
+    raw = bson.encode({"messages": messages})
+    return zstandard.ZstdCompressor(level=level).compress(raw)
+
+
+def decompress_messages(data: bytes) -> List[Dict]:
+    raw = zstandard.ZstdDecompressor().decompress(data)
+    return bson.decode(raw).get("messages", [])
+
+
+class DialogueArchiveService:
+    def __init__(self, db_manager, config: Optional[DialogueArchiveConfig] = None):
+        self.db = db_manager
+        self.config = config or settings.dialogue_archive
+
+    # --- 1. 归档 ---
+
+    def find_candidates(self, limit: int) -> List[ObjectId]:
+        """结算已完成且超过冷却期、对话尚未归档的用户"""
+        cutoff = datetime.now() - timedelta(days=self.config.min_age_days)
+        states = self.db.users_states.find(
+            {"finalize_outbox.status": "done", "finalize_outbox.finished_at": {"$lte": cutoff}},
+            {"user_id": 1}
+        )
+        user_ids = [s["user_id"] for s in states]
+        if not user_ids:
+            return []
+        docs = self.db.onboarding_dialogues.find(
+            {"user_id": {"$in": user_ids}, "messages": {"$exists": True}, "archived": {"$exists": False}},
+            {"user_id": 1}
+        ).limit(limit)
+        return [d["user_id"] for d in docs]
+
+    def archive_user(self, uid: ObjectId, dry_run: bool = False) -> Optional[Dict]:
+        doc = self.db.onboarding_dialogues.find_one({"user_id": uid}, {"messages": 1})
+        messages = (doc or {}).get("messages")
+        if not messages:
+            return None
+
+        raw_bytes = len(bson.encode({"messages": messages}))
+        data = compress_messages(messages, self.config.zstd_level)
+        pointer = {
+            "at": datetime.now(),
+            "codec": CODEC,
+            "raw_bytes": raw_bytes,
+            "compressed_bytes": len(data),
+            "message_count": len(messages)
+        }
+        if dry_run:
+            return pointer
+
+        # 先写归档，再删除热数据；中途失败重跑时整体覆盖
+        self.db.onboarding_archive.replace_one(
+            {"user_id": uid},
+            {"user_id": uid, "data": Binary(data), **pointer},
+            upsert=True
+        )
+        self.db.onboarding_dialogues.update_one(
+            {"user_id": uid},
+            {"$unset": {"messages": ""}, "$set": {"archived": pointer}}
+        )
+        return pointer
+
+    def run(self, dry_run: bool = False, limit: Optional[int] = None) -> Dict:
+        """归档一批用户并输出节省的存储与热集合工作集变化"""
+        before = self._collection_size()
+        report = {"users": 0, "messages": 0, "raw_bytes": 0, "compressed_bytes": 0}
+        for uid in self.find_candidates(limit or self.config.batch_size):
+            pointer = self.archive_user(uid, dry_run)
+            if not pointer:
+                continue
+            report["users"] += 1
+            report["messages"] += pointer["message_count"]
+            report["raw_bytes"] += pointer["raw_bytes"]
+            report["compressed_bytes"] += pointer["compressed_bytes"]
+        after = self._collection_size()
+
+        report["saved_bytes"] = report["raw_bytes"] - report["compressed_bytes"]
+        report["ratio"] = round(report["raw_bytes"] / report["compressed_bytes"], 2) if report["compressed_bytes"] else 0
+        report["hot_size_before"] = before
+        report["hot_size_after"] = before - report["raw_bytes"] if dry_run else after
+        self.print_report(report, dry_run)
+        return report
+
+    def _collection_size(self) -> int:
+        """users_onboarding_dialogues 的逻辑数据量 (即热集合工作集大小)"""
+        try:
+            return self.db.db.command("collStats", self.db.onboarding_dialogues.name).get("size", 0)
+        except Exception:
+            return 0
+
+    @staticmethod
+    def print_report(report: Dict, dry_run: bool):
+        mb = 1024 * 1024
+        print(f"🗄️ [Archive] Onboarding 对话归档 ({'DRY-RUN' if dry_run else 'APPLIED'})")
+        print(f"   用户数: {report['users']}，消息数: {report['messages']}")
+        print(f"   原始 BSON: {report['raw_bytes'] / mb:.2f} MB -> zstd: {report['compressed_bytes'] / mb:.2f} MB "
+              f"(压缩比 {report['ratio']}x，节省 {report['saved_bytes'] / mb:.2f} MB)")
+        hot_before, hot_after = report["hot_size_before"], report["hot_size_after"]
+        if hot_before:
+            print(f"   热集合工作集: {hot_before / mb:.2f} MB -> {hot_after / mb:.2f} MB "
+                  f"(-{(hot_before - hot_after) / hot_before:.1%})")
+
+    # --- 2. 读取 / 恢复 ---
+
+    def load_messages(self, uid: ObjectId) -> List[Dict]:
+        """读取完整对话 (未归档直接返回，已归档透明解压)"""
+        doc = self.db.onboarding_dialogues.find_one({"user_id": uid}, {"messages": 1, "archived": 1}) or {}
+        if not doc.get("archived"):
+            return doc.get("messages", [])
+        archive = self.db.onboarding_archive.find_one({"user_id": uid}, {"data": 1})
+        return decompress_messages(archive["data"]) if archive else []
+
+    def rehydrate(self, uid: ObjectId) -> int:
+        """把归档的对话恢复为热数据 (重新索引 / 重开 Onboarding 前调用)，返回恢复的消息数"""
+        archive = self.db.onboarding_archive.find_one({"user_id": uid}, {"data": 1})
+        if not archive:
+            return 0
+        messages = decompress_messages(archive["data"])
+        self.db.onboarding_dialogues.update_one(
+            {"user_id": uid},
+            {"$set": {"messages": messages}, "$unset": {"archived": ""}}
+        )
+        self.db.onboarding_archive.delete_one({"user_id": uid})
+        return len(messages)
+
+
+async def aload_messages(async_db, uid: ObjectId) -> List[Dict]:
+    """`DialogueArchiveService.load_messages` 的异步版本 (Motor)"""
+    doc = await async_db.onboarding_dialogues.find_one({"user_id": uid}, {"messages": 1, "archived": 1}) or {}
+    if not doc.get("archived"):
+        return doc.get("messages", [])
+    archive = await async_db.onboarding_archive.find_one({"user_id": uid}, {"data": 1})
+    return decompress_messages(archive["data"]) if archive else []
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive finalized onboarding dialogues to zstd cold storage")
+    parser.add_argument("--apply", action="store_true", help="实际执行归档 (默认只输出统计)")
+    parser.add_argument("--limit", type=int, help="本次最多归档的用户数")
+    parser.add_argument("--rehydrate", metavar="USER_ID", help="恢复指定用户的对话为热数据")
+    args = parser.parse_args()
+
+    from app.core.container import container
+    service = container.dialogue_archive
+    if args.rehydrate:
+        count = service.rehydrate(ObjectId(args.rehydrate))
+        print(f"✅ 已恢复用户 {args.rehydrate} 的 {count} 条消息")
+    else:
+        service.run(dry_run=not args.apply, limit=args.limit)
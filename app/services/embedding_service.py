@@ -0,0 +1,391 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import hashlib
+import json
+import logging
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+
+logger = logging.getLogger(__name__)
+
+# 预热 / 一致性校验使用的样例文本 (覆盖短 query 与长画像两种形态)
+SAMPLE_TEXTS = [
+    "杭州 985 程序员",
+    "性格开朗，喜欢户外运动",
+    "她是一名在上海工作的产品经理，硕士毕业于复旦大学，性格温和细腻，周末喜欢烘焙和看展，"
+    "家庭氛围和睦，父母均已退休，希望找一个有责任心、情绪稳定、愿意一起经营生活的伴侣。",
+    "不抽烟 偶尔喝酒 独生子女 父母有退休金",
+]
+
+
+class BaseEmbeddingBackend:
+    """Embedding 后端基类"""
+    name = "base"
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        raise NotImplementedError
+
+
+class TorchBackend(BaseEmbeddingBackend):
+    """PyTorch 基线 (sentence-transformers / HuggingFaceEmbeddings)"""
+    name = "torch"
+
+    def __init__(self, model_name: str):
+        from langchain_huggingface import HuggingFaceEmbeddings
+        self.model = HuggingFaceEmbeddings(model_name=model_name, model_kwargs={"device": "cpu"})
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self.model.embed_documents(texts)
+
+
+class OnnxBackend(BaseEmbeddingBackend):
+    """
+    ONNX Runtime 后端 (CPU)。
+    首次使用时从 sentence-transformers 模型导出 ONNX 文件并缓存，之后启动只加载 ONNX，不再加载 PyTorch 模型。
+    Pooling / Normalize 方式与原 sentence-transformers 配置保持一致。
+    """
+    name = "onnx"
+
+    def __init__(self, model_name: str, cache_dir: str, intra_op_threads: int = 0):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        self.model_name = model_name
+        self.model_dir = Path(cache_dir) / model_name.replace("/", "__")
+        fp32_path = self.model_dir / "model.onnx"
+        if not fp32_path.exists():
+            self._export(fp32_path)
+
+        self.tokenizer = AutoTokenizer.from_pretrained(str(self.model_dir))
+        meta = self._read_meta()
+        self.pooling = meta["pooling"]
+        self.normalize = meta["normalize"]
+        self.max_length = meta["max_length"]
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if intra_op_threads:
+            options.intra_op_num_threads = intra_op_threads
+        self.model_path = self._model_path(fp32_path)
+        self.session = ort.InferenceSession(
+            str(self.model_path), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    def _model_path(self, fp32_path: Path) -> Path:
+        return fp32_path
+
+    def _export(self, fp32_path: Path):
+        """从 sentence-transformers 模型导出 ONNX (只输出 last_hidden_state，Pooling 在 numpy 中做)"""
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        logger.info(f"Exporting {self.model_name} to ONNX at {fp32_path} ...")
+        st_model = SentenceTransformer(self.model_name, device="cpu")
+        transformer = st_model[0]
+        hf_model = transformer.auto_model.eval()
+        tokenizer = transformer.tokenizer
+
+        pooling, normalize = "mean", False
+        for module in st_model:
+            cls_name = module.__class__.__name__
+            if cls_name == "Pooling":
+                pooling = "cls" if module.pooling_mode_cls_token else "mean"
+            elif cls_name == "Normalize":
+                normalize = True
+
+        class _Wrapper(torch.nn.Module):
+            def __init__(self, model):
+                super().__init__()
+                self.model = model
+
+            def forward(self, input_ids, attention_mask, token_type_ids=None):
+                kwargs = {"input_ids": input_ids, "attention_mask": attention_mask}
+                if token_type_ids is not None:
+                    kwargs["token_type_ids"] = token_type_ids
+                return self.model(**kwargs).last_hidden_state
+
+        sample = tokenizer(["样例文本"], return_tensors="pt")
+        input_names = [k for k in ("input_ids", "attention_mask", "token_type_ids") if k in sample]
+        dynamic_axes = {k: {0: "batch", 1: "seq"} for k in input_names}
+        dynamic_axes["last_hidden_state"] = {0: "batch", 1: "seq"}
+
+        self.model_dir.mkdir(parents=True, exist_ok=True)
+        with torch.no_grad():
+            torch.onnx.export(
+                _Wrapper(hf_model),
+                tuple(sample[k] for k in input_names),
+                str(fp32_path),
+                input_names=input_names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=dynamic_axes,
+                opset_version=17,
+                dynamo=False,
+            )
+        tokenizer.save_pretrained(str(self.model_dir))
+        with open(self.model_dir / "embedding_meta.json", "w", encoding="utf-8") as f:
+            json.dump({
+                "pooling": pooling,
+                "normalize": normalize,
+                "max_length": transformer.max_seq_length or 512
+            }, f)
+
+    def _read_meta(self) -> dict:
+        with open(self.model_dir / "embedding_meta.json", "r", encoding="utf-8") as f:
+            return json.load(f)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        import numpy as np
+
+        encoded = self.tokenizer(
+            texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np"
+        )
+        feeds = {k: v.astype(np.int64) for k, v in encoded.items() if k in self.input_names}
+        hidden = self.session.run(["last_hidden_state"], feeds)[0]
+
+        if self.pooling == "cls":
+            vectors = hidden[:, 0]
+        else:
+            mask = encoded["attention_mask"][..., None].astype(np.float32)
+            vectors = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+
+        if self.normalize:
+            vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+        return vectors.astype(np.float32).tolist()
+
+
+class OnnxInt8Backend(OnnxBackend):
+    """ONNX Runtime + 动态 int8 量化 (权重 int8，激活运行时量化)"""
+    name = "onnx_int8"
+
+    def _model_path(self, fp32_path: Path) -> Path:
+        int8_path = fp32_path.with_name("model.int8.onnx")
+        if not int8_path.exists():
+            from onnxruntime.quantization import quantize_dynamic, QuantType
+            logger.info(f"Quantizing {fp32_path} -> {int8_path} (dynamic int8) ...")
+            quantize_dynamic(str(fp32_path), str(int8_path), weight_type=QuantType.QInt8)
+        return int8_path
+
+
+BACKENDS = {
+    TorchBackend.name: TorchBackend,
+    OnnxBackend.name: OnnxBackend,
+    OnnxInt8Backend.name: OnnxInt8Backend,
+}
+
+
+def create_backend(backend: str, model_name: str, cache_dir: str = "models/onnx", intra_op_threads: int = 0) -> BaseEmbeddingBackend:
+    """后端工厂"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown embedding backend '{backend}'. Available: {list(BACKENDS)}")
+    if backend == TorchBackend.name:
+        return TorchBackend(model_name)
+    return BACKENDS[backend](model_name, cache_dir, intra_op_threads)
+
+
+def cosine_similarity(a: List[float], b: List[float]) -> float:
+    import numpy as np
+    va, vb = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    return float(va @ vb / (np.linalg.norm(va) * np.linalg.norm(vb) + 1e-12))
+
+
+class EmbeddingMicroBatcher:
+    """
+    跨请求的动态微批 (Dynamic Micro-Batching)。
+    并发请求各自只 embed 一条短 query 时，CPU 模型每次只跑 batch=1。
+    这里把等待中的文本攒到 `max_wait_ms` 毫秒或 `max_batch_size` 条，在工作线程里做一次批量前向，
+    再分别回填每个调用方的 Future。
+    """
+
+    def __init__(self, embed_fn, max_wait_ms: float = 5.0, max_batch_size: int = 32, max_concurrent_batches: int = 1):
+        self.embed_fn = embed_fn # 同步批量函数: List[str] -> List[List[float]]
+        self.max_wait = max_wait_ms / 1000.0
+        self.max_batch_size = max_batch_size
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._slots = asyncio.Semaphore(max_concurrent_batches) # 同时在跑的批次数 (CPU 模型通常 1 即可)
+        self._tasks = set()
+        # 统计
+        self.batches = 0
+        self.items = 0
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending[:self.max_batch_size], self._pending[self.max_batch_size:]
+        task = asyncio.create_task(self._run_batch(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        # 剩余的 (超过单批上限) 继续排下一批
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+
+    async def _run_batch(self, batch: List[Tuple[str, asyncio.Future]]):
+        # 调用方已取消的请求不再参与计算
+        batch = [(t, f) for t, f in batch if not f.done()]
+        if not batch:
+            return
+        async with self._slots:
+            try:
+                vectors = await asyncio.to_thread(self.embed_fn, [t for t, _ in batch])
+            except Exception as e:
+                for _, f in batch:
+                    if not f.done():
+                        f.set_exception(e)
+                return
+        self.batches += 1
+        self.items += len(batch)
+        for (_, f), vec in zip(batch, vectors):
+            if not f.done():
+                f.set_result(vec)
+
+
+class EmbeddingService(Embeddings):
+    """
+    独立的向量化服务 (由 AppContainer 持有)。
+    实现 LangChain `Embeddings` 接口，可直接作为 Chroma 的 embedding_function，
+    同时供 ES 召回 / 结算流程使用，不再借道 `chroma.embeddings_model`。
+    """
+
+    def __init__(self, model_name: str, backend: str = "torch", cache_dir: str = "models/onnx",
+                 batch_size: int = 32, intra_op_threads: int = 0,
+                 microbatch_enabled: bool = True, microbatch_max_wait_ms: float = 5.0, microbatch_max_size: int = 32):
+        self.model_name = model_name
+        self.backend_name = backend
+        self.cache_dir = cache_dir
+        self.batch_size = batch_size
+        self.intra_op_threads = intra_op_threads
+        self._backend: Optional[BaseEmbeddingBackend] = None
+
+        self.microbatch_enabled = microbatch_enabled
+        self.microbatch_max_wait_ms = microbatch_max_wait_ms
+        self.microbatch_max_size = microbatch_max_size
+        self._batcher: Optional[EmbeddingMicroBatcher] = None
+        self._batcher_loop = None
+
+    @property
+    def backend(self) -> BaseEmbeddingBackend:
+        """懒加载后端 (启动时由 warmup 提前触发)"""
+        if self._backend is None:
+            start = time.perf_counter()
+            self._backend = create_backend(self.backend_name, self.model_name, self.cache_dir, self.intra_op_threads)
+            logger.info(f"Embedding backend '{self.backend_name}' loaded in {time.perf_counter() - start:.2f}s")
+        return self._backend
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        vectors = []
+        for i in range(0, len(texts), self.batch_size):
+            vectors.extend(self.backend.embed_documents(texts[i : i + self.batch_size]))
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.backend.embed_documents([text])[0]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """异步单条向量化：经由微批器与其他并发请求合并成一次批量前向"""
+        if not self.microbatch_enabled:
+            return await asyncio.to_thread(self.embed_query, text)
+        return await self.batcher.embed(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        return await asyncio.to_thread(self.embed_documents, texts)
+
+    @property
+    def batcher(self) -> EmbeddingMicroBatcher:
+        """微批器绑定在当前事件循环上 (脚本里多次 asyncio.run 时会按循环重建)"""
+        loop = asyncio.get_running_loop()
+        if self._batcher is None or self._batcher_loop is not loop:
+            self._batcher = EmbeddingMicroBatcher(
+                self.backend.embed_documents,
+                max_wait_ms=self.microbatch_max_wait_ms,
+                max_batch_size=self.microbatch_max_size
+            )
+            self._batcher_loop = loop
+        return self._batcher
+
+    def warmup(self) -> float:
+        """加载模型并跑一次前向，消除首个请求的冷启动延迟。返回耗时 (秒)。"""
+        start = time.perf_counter()
+        self.embed_documents(SAMPLE_TEXTS)
+        elapsed = time.perf_counter() - start
+        logger.info(f"Embedding warmup ({self.backend_name}) finished in {elapsed:.2f}s")
+        return elapsed
+
+    def parity_check(self, threshold: float = 0.99, texts: Optional[List[str]] = None, allow_torch: bool = True) -> Optional[float]:
+        """
+        与 PyTorch 基线对比余弦一致性，返回最小余弦相似度。
+        结论按 ONNX 文件的 sha256 缓存在模型目录的 parity.json 中，同一个模型文件只需要加载一次 torch；
+        allow_torch=False (服务启动路径) 时只读缓存，没有缓存返回 None，绝不导入 torch。
+        低于阈值时抛出 RuntimeError (量化/导出出错时宁可启动失败，也不要悄悄写入错位的向量)。
+        """
+        if self.backend_name == TorchBackend.name:
+            return 1.0
+        cache_path = self.backend.model_dir / "parity.json"
+        model_hash = _file_sha256(self.backend.model_path)
+        cache = json.loads(cache_path.read_text(encoding="utf-8")) if cache_path.exists() else {}
+
+        if texts is None and model_hash in cache:
+            min_cos = cache[model_hash]["min_cos"]
+        elif not allow_torch:
+            return None
+        else:
+            sample = texts or SAMPLE_TEXTS
+            baseline = TorchBackend(self.model_name).embed_documents(sample)
+            candidate = self.embed_documents(sample)
+            min_cos = min(cosine_similarity(a, b) for a, b in zip(baseline, candidate))
+            if texts is None:
+                cache[model_hash] = {"min_cos": min_cos, "model": self.backend.model_path.name,
+                                     "checked_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+                cache_path.write_text(json.dumps(cache, indent=2), encoding="utf-8")
+        logger.info(f"Embedding parity ({self.backend_name} vs torch): min cosine = {min_cos:.5f}")
+        if min_cos < threshold:
+            raise RuntimeError(
+                f"Embedding backend '{self.backend_name}' parity check failed: "
+                f"min cosine {min_cos:.5f} < {threshold}"
+            )
+        return min_cos
+
+
+def _file_sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def main():
+    """导出/量化 ONNX 并与 torch 基线做一致性校验，结论写入 parity.json (部署时执行，服务启动只读结论)"""
+    import argparse
+    from app.core.config import settings
+
+    parser = argparse.ArgumentParser(description="Export the ONNX embedding backend and record its parity verdict")
+    parser.add_argument("--backend", default=settings.embedding.backend)
+    parser.add_argument("--threshold", type=float, default=settings.embedding.parity_threshold)
+    args = parser.parse_args()
+
+    service = EmbeddingService(settings.llm.chroma_embedding_model, backend=args.backend,
+                               cache_dir=settings.embedding.onnx_cache_dir)
+    min_cos = service.parity_check(args.threshold)
+    print(f"✅ {args.backend} parity vs torch: min cosine {min_cos:.5f} (threshold {args.threshold})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+"""
+聊天轮次的幂等与在途合并 (Idempotency + Request Coalescing)
+
+移动端在弱网下会重试 `/chat/message`，每次重试都会完整再跑一遍图 (多次 LLM 调用)，
+Onboarding 阶段还会把同一条用户消息重复 `$push` 进对话。这里按请求键去重：
+- 原请求仍在执行: 重复请求挂到同一个执行上，等待同一个结果 (coalesced)；
+- 原请求已完成:   TTL 内直接返回保存的响应 (replayed)；
+- 原请求失败:     不缓存异常，重试会重新执行。
+
+请求键优先使用客户端的 `Idempotency-Key` 头，否则退化为 "用户 + 消息 (+ 上下文) 的哈希"，
+后者只保留很短的 TTL，避免用户有意重复发送同一句话 (如 "换一批") 时拿到旧结果。
+
+注意: 状态保存在进程内，多 Worker 部署时需要按用户做粘性路由才能保证跨 Worker 去重。
+"""
+import asyncio
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from app.core.config import settings, IdempotencyConfig
+
+
+def build_request_key(user_id: str, idempotency_key: Optional[str], payload: Dict) -> Tuple[str, bool]:
+    """返回 (缓存键, 是否为客户端显式提供的键)"""
+    if idempotency_key:
+        return f"{user_id}:key:{idempotency_key}", True
+    digest = hashlib.sha256(
+        json.dumps(payload, sort_keys=True, ensure_ascii=False, default=str).encode("utf-8")
+    ).hexdigest()
+    return f"{user_id}:msg:{digest}", False
+
+
+class IdempotencyCache:
+    def __init__(self, config: Optional[IdempotencyConfig] = None):
+        self.config = config or settings.idempotency
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self._done: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict() # key -> (过期时间, 响应)
+        self._waiter_counts: Dict[str, int] = {}
+        self.stats = {"executed": 0, "coalesced": 0, "replayed": 0, "cancelled": 0}
+
+    def _get_done(self, key: str):
+        entry = self._done.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._done[key]
+            return None
+        self._done.move_to_end(key)
+        return entry
+
+    def _put_done(self, key: str, value: Any, ttl: float):
+        self._done[key] = (time.monotonic() + ttl, value)
+        self._done.move_to_end(key)
+        while len(self._done) > self.config.max_entries:
+            self._done.popitem(last=False)
+
+    async def run(self, key: str, fn: Callable[[], Awaitable[Any]], explicit: bool = True) -> Tuple[Any, str]:
+        """
+        执行 `fn` 并按 `key` 去重，返回 (结果, 来源)。来源: executed / coalesced / replayed。
+        共享的执行在独立 Task 中进行，某个等待方被取消不会影响其他等待方；全部等待方都离开时才取消执行。
+        """
+        if not self.config.enabled:
+            return await fn(), "executed"
+
+        entry = self._get_done(key)
+        if entry is not None:
+            self.stats["replayed"] += 1
+            return entry[1], "replayed"
+
+        future = self._in_flight.get(key)
+        if future is not None:
+            self.stats["coalesced"] += 1
+            return await self._wait(key, future), "coalesced"
+
+        ttl = self.config.ttl_seconds if explicit else self.config.fallback_ttl_seconds
+        future = asyncio.ensure_future(self._execute(key, fn, ttl))
+        future.add_done_callback(lambda f: f.cancelled() or f.exception()) # 所有等待方都已离开时也取走异常
+        self._in_flight[key] = future
+        self.stats["executed"] += 1
+        return await self._wait(key, future), "executed"
+
+    async def _wait(self, key: str, future: asyncio.Future):
+        """等待共享的执行；最后一个等待方被取消 (客户端全部断开) 时取消执行本身"""
+        self._waiter_counts[key] = self._waiter_counts.get(key, 0) + 1
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            if not future.done() and self._waiter_counts[key] == 1:
+                future.cancel()
+                self.stats["cancelled"] += 1
+            raise
+        finally:
+            self._waiter_counts[key] -= 1
+            if not self._waiter_counts[key]:
+                del self._waiter_counts[key]
+
+    async def _execute(self, key: str, fn: Callable[[], Awaitable[Any]], ttl: float):
+        try:
+            value = await fn()
+            self._put_done(key, value, ttl)
+            return value
+        finally:
+            self._in_flight.pop(key, None)
+
+    def snapshot(self) -> Dict:
+        return {**self.stats, "in_flight": len(self._in_flight), "stored": len(self._done)}
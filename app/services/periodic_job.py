@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+import asyncio
+from typing import Callable, Optional
+
+
+class PeriodicJob:
+    """
+    随应用启动的定时后台任务 (由 lifespan 启动/停止)
+    `fn` 为同步函数，在线程池中执行，不阻塞事件循环；单次失败只记录日志，下个周期继续。
+    """
+
+    def __init__(self, name: str, fn: Callable[[], object], interval_seconds: float):
+        self.name = name
+        self.fn = fn
+        self.interval = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            print(f"✅ Periodic job '{self.name}' started.")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.to_thread(self.fn)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️ [{self.name}] 定时任务执行失败: {e}")
+            await asyncio.sleep(self.interval)
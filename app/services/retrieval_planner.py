@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+候选人检索的代价规划 (Cost-based Retrieval Planner)
+
+原来的链路固定是 "Mongo 硬过滤 (limit 200) -> ES 在这些 ID 里混合检索"：
+- 条件很宽 (比如只有性别) 时，传给 ES 的是 200 个任意 ID，语义检索只能在这一小撮里挑；
+- 条件很窄 (只有三五个人) 时，ES KNN 毫无意义，只是多一次网络往返和一次 embedding。
+
+这里维护 users_basic 的基数统计 (按性别分组的城市 / 出生年份 / 身高 / BMI 直方图，定时刷新)，
+在 hard_filter 里估算选择度，每个查询选一种策略:
+- mongo_only: 候选人很少，Mongo 结果直接交给精排，不调用 ES；
+- es_native:  条件很宽且 ES 索引里有对应字段 (性别/城市/年龄)，跳过 Mongo，直接在 ES 里带过滤条件检索；
+- id_hybrid:  其余情况，沿用 Mongo 过滤 + ES ID 限定混合检索。
+估算按各条件相互独立处理；mongo_only / id_hybrid 在 Mongo 返回后按实际人数校正。
+
+注意候选池的差异: ES 只收录已完成结算 (有画像摘要) 的用户，Mongo 硬过滤面向全部 users_basic。
+es_native 因此不会召回尚未完成 Onboarding 的用户；id_hybrid 里这些人也会在 ES 的 ID 限定检索中落空，
+只在 ES 召回不足时作为垫底候选出现。基数统计按 users_basic 计算，对 es_native 是偏高的估算。
+"""
+import math
+import time
+from collections import defaultdict, deque
+from datetime import datetime
+from typing import Dict, Optional, Tuple
+
+from app.core.config import settings, RetrievalPlannerConfig
+
+MONGO_ONLY = "mongo_only"
+ES_NATIVE = "es_native"
+ID_HYBRID = "id_hybrid"
+
+# ES 索引中存在的硬指标字段 (见 ESManager.create_index_if_not_exists；birth_year 与 Mongo 同名同义)
+ES_FILTERABLE = {"gender", "city", "birth_year", "_id"}
+HIST_FIELDS = {"city": "$city", "birth_year": "$birth_year", "height": "$height", "bmi": {"$floor": "$bmi"}}
+
+
+def _range_count(hist: Dict, cond: Dict, bucket_width: Optional[float] = None) -> float:
+    """直方图中落在 {$gte, $lte} 范围内的人数；bucket_width 不为空时按桶的重叠比例计入"""
+    lo = cond.get("$gte", cond.get("$gt", -math.inf))
+    hi = cond.get("$lte", cond.get("$lt", math.inf))
+    total = 0.0
+    for value, n in hist.items():
+        if value is None:
+            continue
+        if bucket_width is None:
+            if lo <= value <= hi:
+                total += n
+        else:
+            overlap = min(value + bucket_width, hi) - max(value, lo)
+            if overlap > 0:
+                total += n * min(1.0, overlap / bucket_width)
+    return total
+
+
+class CardinalityStats:
+    """users_basic 的基数统计，一次 $facet 聚合刷新 (由 PeriodicJob 在线程池中定时调用)"""
+
+    def __init__(self, db):
+        self.db = db
+        self._hist: Optional[Dict] = None
+        self.refreshed_at: Optional[datetime] = None
+
+    def refresh(self):
+        facets = {"total": [{"$group": {"_id": {"g": "$gender"}, "n": {"$sum": 1}}}]}
+        for field, expr in HIST_FIELDS.items():
+            facets[field] = [{"$group": {"_id": {"g": "$gender", "v": expr}, "n": {"$sum": 1}}}]
+        start = time.perf_counter()
+        doc = next(self.db.users_basic.aggregate([{"$facet": facets}]), {})
+
+        hist = {"total": {}, **{field: defaultdict(dict) for field in HIST_FIELDS}}
+        for row in doc.get("total", []):
+            hist["total"][row["_id"].get("g")] = row["n"]
+        for field in HIST_FIELDS:
+            for row in doc.get(field, []):
+                hist[field][row["_id"].get("g")][row["_id"].get("v")] = row["n"]
+        self._hist = hist # 整体替换，读方不会看到半成品
+        self.refreshed_at = datetime.now()
+        print(f"📊 [Stats] users_basic 基数统计已刷新: {hist['total']} ({time.perf_counter() - start:.2f}s)")
+
+    def _field_hist(self, field: str, gender: Optional[str]) -> Dict:
+        by_gender = self._hist[field]
+        if gender is not None:
+            return by_gender.get(gender, {})
+        merged: Dict = defaultdict(int)
+        for values in by_gender.values():
+            for v, n in values.items():
+                merged[v] += n
+        return merged
+
+    def estimate(self, query: Dict) -> Optional[float]:
+        """估算 Mongo 条件的命中人数；尚无统计时返回 None"""
+        if not self._hist:
+            return None
+        gender = query.get("gender") if isinstance(query.get("gender"), str) else None
+        totals = self._hist["total"]
+        total = totals.get(gender, 0) if gender is not None else sum(totals.values())
+        if total <= 0:
+            return 0.0
+
+        estimate = float(total)
+        for field, cond in query.items():
+            if field == "city":
+                cities = cond.get("$in", []) if isinstance(cond, dict) else [cond]
+                hist = self._field_hist("city", gender)
+                estimate *= sum(hist.get(c, 0) for c in cities) / total
+            elif field in ("birth_year", "height") and isinstance(cond, dict):
+                estimate *= _range_count(self._field_hist(field, gender), cond) / total
+            elif field == "bmi" and isinstance(cond, dict):
+                estimate *= _range_count(self._field_hist("bmi", gender), cond, bucket_width=1.0) / total
+        return estimate
+
+    def snapshot(self) -> Dict:
+        return {
+            "refreshed_at": self.refreshed_at.isoformat() if self.refreshed_at else None,
+            "total": dict(self._hist["total"]) if self._hist else {},
+        }
+
+
+class RetrievalPlanner:
+    def __init__(self, stats: CardinalityStats, config: Optional[RetrievalPlannerConfig] = None):
+        self.stats = stats
+        self.config = config or settings.retrieval_planner
+        self._latencies: Dict[str, deque] = defaultdict(lambda: deque(maxlen=1000))
+        self.counters = defaultdict(int)
+
+    def plan(self, query: Dict, semantic_query: str) -> Dict:
+        """返回 {strategy, estimate, reason}"""
+        if not self.config.enabled:
+            return {"strategy": ID_HYBRID, "estimate": None, "reason": "planner 未启用"}
+        estimate = self.stats.estimate(query)
+        if estimate is None:
+            return {"strategy": ID_HYBRID, "estimate": None, "reason": "暂无基数统计"}
+        estimate = round(estimate, 1)
+        if not semantic_query:
+            return {"strategy": MONGO_ONLY, "estimate": estimate, "reason": "无语义关键词"}
+        if estimate <= self.config.mongo_only_max:
+            return {"strategy": MONGO_ONLY, "estimate": estimate, "reason": "候选人很少"}
+        if estimate >= self.config.es_native_min and set(query) <= ES_FILTERABLE:
+            return {"strategy": ES_NATIVE, "estimate": estimate, "reason": "条件宽泛且 ES 可表达"}
+        return {"strategy": ID_HYBRID, "estimate": estimate, "reason": "默认"}
+
+    def resolve(self, plan: Dict, actual: int, semantic_query: str) -> str:
+        """Mongo 已返回时按实际人数确定最终策略 (es_native 不经过 Mongo，不校正)"""
+        if plan.get("strategy") == ES_NATIVE:
+            return ES_NATIVE
+        if not semantic_query or actual <= self.config.mongo_only_max:
+            return MONGO_ONLY
+        return ID_HYBRID
+
+    @staticmethod
+    def es_filters(query: Dict) -> Tuple[Dict, Dict]:
+        """把 Mongo 硬过滤条件翻译为 ESManager.hybrid_search 的 (filters, exclude)"""
+        filters, exclude = {}, {}
+        if isinstance(query.get("gender"), str):
+            filters["gender"] = query["gender"]
+        city = query.get("city")
+        if isinstance(city, dict) and city.get("$in"):
+            filters["city"] = list(city["$in"])
+        elif isinstance(city, str):
+            filters["city"] = city
+        birth_year = query.get("birth_year")
+        if isinstance(birth_year, dict):
+            # 过滤 ES 的 birth_year 字段 (age 是结算时写入的快照，每过一个生日就偏一岁)
+            filters["birth_year"] = {op.lstrip("$"): v for op, v in birth_year.items() if op in ("$gte", "$gt", "$lte", "$lt")}
+        excluded = (query.get("_id") or {}).get("$nin") or []
+        if excluded:
+            exclude["user_id"] = [str(i) for i in excluded]
+        return filters, exclude
+
+    def record(self, plan: Dict, strategy: str, seconds: float):
+        self.counters[strategy] += 1
+        if plan.get("strategy") and plan["strategy"] != strategy:
+            self.counters["corrected"] += 1
+        self._latencies[strategy].append(seconds)
+
+    def snapshot(self) -> Dict:
+        strategies = {}
+        for strategy, values in self._latencies.items():
+            ordered = sorted(values)
+            strategies[strategy] = {
+                "count": self.counters[strategy],
+                "p50_ms": round(ordered[int(0.5 * (len(ordered) - 1))] * 1000, 1),
+                "p99_ms": round(ordered[int(0.99 * (len(ordered) - 1))] * 1000, 1),
+            }
+        return {"strategies": strategies, "corrected": self.counters["corrected"], "stats": self.stats.snapshot()}
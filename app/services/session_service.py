@@ -2,13 +2,28 @@
 from datetime import datetime
 from typing import Optional, List, Dict
 from bson import ObjectId
-from pymongo import DESCENDING
+from pymongo import DESCENDING, ReturnDocument
 
 from app.core.container import container
+from app.core.utils.cal_utils import calc_age
+
+# 每个消息桶文档存放的消息条数
+MESSAGE_BUCKET_SIZE = 100
 
 class SessionService:
+    """
+    会话服务
+    - `chat_sessions`: 只存会话元信息和 `latest_state` 快照，外加消息计数 `message_count`；
+    - `chat_messages`: 消息按 session 分桶存储 (每桶 `MESSAGE_BUCKET_SIZE` 条)，
+      桶号 = seq // MESSAGE_BUCKET_SIZE，索引 (session_id, bucket)。
+    会话文档大小不再随消息增长，读取历史只需加载尾部的 1~2 个桶。
+    写入顺序: 先在 `next_seq` 上原子预留序号，再写消息桶，最后才增加 `message_count` (= 实际存下的消息数)。
+    中途失败只会让 `seq` 出现空洞 (读取方按 seq 排序取尾部，不假设连续)，不会让计数多于实际消息。
+    在线请求只使用 `a*` 异步接口 (Motor)；同步接口保留给命令行调试脚本 test_langgraph.py。
+    """
     def __init__(self):
         self.db = container.db
+        self.bucket_size = MESSAGE_BUCKET_SIZE
 
     def create_session(self, user_id: str, title: str = "新对话") -> str:
         """创建一个新的会话"""
@@ -19,7 +34,8 @@ class SessionService:
             "updated_at": datetime.now(),
             "is_active": True,
             "latest_state": {}, # 初始为空状态
-            "messages": []      # 初始化消息列表
+            "message_count": 0, # 消息单独分桶存储在 chat_messages
+            "next_seq": 0       # 下一个可分配的消息序号 (可能因写入失败留下空洞)
         }
         res = self.db.chat_sessions.insert_one(session_doc)
         return str(res.inserted_id)
@@ -32,74 +48,231 @@ class SessionService:
             "_id": ObjectId(session_id), 
             "user_id": user_id,
             "is_active": True
-        })
+        }, {"messages": 0}) # 兼容尚未迁移的旧文档，不加载内嵌消息
 
-    def get_user_last_session(self, user_id: str) -> Optional[Dict]:
-        """获取用户最近的一个活跃会话"""
-        return self.db.chat_sessions.find_one(
-            {"user_id": user_id, "is_active": True},
-            sort=[("updated_at", DESCENDING)]
-        )
+    # 持久化到 latest_state 的字段白名单 (避免存入过大的临时数据)
+    STATE_KEYS = [
+        "seen_candidate_ids", 
+        "last_search_criteria", 
+        "last_target_person", 
+        "match_policy",
+        "semantic_query",
+        "intent",
+        "search_count"
+    ]
 
-    def update_session_state(self, session_id: str, new_state: Dict):
-        """更新会话的 LangGraph State 快照"""
-        # 我们只保存关键字段，避免存入过大的临时数据
-        # 这里定义需要持久化的字段白名单
-        keys_to_persist = [
-            "seen_candidate_ids", 
-            "last_search_criteria", 
-            "last_target_person", 
-            "match_policy",
-            "semantic_query",
-            "intent",
-            "search_count"
-        ]
-        
-        state_subset = {k: new_state.get(k) for k in keys_to_persist if k in new_state}
-        
-        # 对于 final_candidates，如果太长，我们可以只存 ID 列表，或者简化存
-        # 这里为了演示，暂时全存（假设数量不多）
+    @staticmethod
+    def to_candidate_refs(candidates: List[Dict]) -> List[Dict]:
+        """
+        候选人压缩为引用 {id, nickname}：指代消解只需要昵称，详情由 id 按需回查。
+        summary / evidence 等大字段不再进入会话快照。
+        """
+        refs = []
+        for c in candidates or []:
+            if isinstance(c, dict) and c.get("id"):
+                refs.append({"id": str(c["id"]), "nickname": c.get("nickname", "")})
+        return refs
+
+    def _build_state_subset(self, new_state: Dict) -> Dict:
+        state_subset = {k: new_state.get(k) for k in self.STATE_KEYS if k in new_state}
         if "final_candidates" in new_state:
-             # 转换为纯 dict 存储 (如果是 Pydantic 对象)
-             cands = new_state["final_candidates"]
-             if cands and isinstance(cands, list):
-                 state_subset["final_candidates"] = cands
+            state_subset["final_candidates"] = self.to_candidate_refs(new_state["final_candidates"])
+        return state_subset
 
+    def update_session_state(self, session_id: str, new_state: Dict):
+        """更新会话的 LangGraph State 快照"""
         self.db.chat_sessions.update_one(
             {"_id": ObjectId(session_id)},
             {
                 "$set": {
-                    "latest_state": state_subset,
+                    "latest_state": self._build_state_subset(new_state),
                     "updated_at": datetime.now()
                 }
             }
         )
 
-    def add_message(self, session_id: str, role: str, content: str, metadata: Dict = None):
-        """添加一条聊天记录 (直接存入 Session 文档)"""
-        
+    @staticmethod
+    def _reserve_seq_update(n: int) -> List[Dict]:
+        """预留 n 个序号的管道更新 (旧会话没有 next_seq 时从 message_count 接续)"""
+        return [{"$set": {"next_seq": {"$add": [
+            {"$ifNull": ["$next_seq", {"$ifNull": ["$message_count", 0]}]}, n
+        ]}}}]
+
+    def _bucket_writes(self, sid: ObjectId, messages: List[Dict], now: datetime):
+        """按桶分组的 (filter, update)，同一个桶内的多条消息一次 $push 写入"""
+        by_bucket: Dict[int, List[Dict]] = {}
+        for msg in messages:
+            by_bucket.setdefault(msg["seq"] // self.bucket_size, []).append(msg)
+        for bucket, msgs in by_bucket.items():
+            yield {"session_id": sid, "bucket": bucket}, {
+                "$push": {"messages": {"$each": msgs}},
+                "$inc": {"count": len(msgs)},
+                "$set": {"updated_at": now},
+                "$setOnInsert": {"created_at": now}
+            }
+
+    def add_message(self, session_id: str, role: str, content: str, metadata: Dict = None) -> int:
+        """添加一条聊天记录 (写入 chat_messages 的尾部桶)，返回消息序号"""
+        sid = ObjectId(session_id)
+        now = datetime.now()
+
+        # 1. 在会话文档上原子地预留序号
+        session = self.db.chat_sessions.find_one_and_update(
+            {"_id": sid},
+            self._reserve_seq_update(1),
+            projection={"next_seq": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if not session:
+            raise ValueError(f"会话不存在: {session_id}")
+        seq = session["next_seq"] - 1
+
+        # 2. 追加到对应的桶 (桶不存在时自动创建)
         msg_obj = {
+            "seq": seq,
             "role": role,
             "content": content,
-            "timestamp": datetime.now(),
+            "timestamp": now,
             "metadata": metadata or {}
         }
+        for flt, update in self._bucket_writes(sid, [msg_obj], now):
+            self.db.chat_messages.update_one(flt, update, upsert=True)
+
+        # 3. 消息落库后再计数
         self.db.chat_sessions.update_one(
-            {"_id": ObjectId(session_id)},
-            {
-                "$push": {"messages": msg_obj},
-                "$set": {"updated_at": datetime.now()}
-            }
+            {"_id": sid}, {"$inc": {"message_count": 1}, "$set": {"updated_at": now}}
         )
+        return seq
 
     def get_history(self, session_id: str, limit: int = 20) -> List[Dict]:
-        """获取聊天历史 (通过 slice 获取最后 N 条，天然按时间正序)"""
-        # MongoDB $slice 接受负数，表示取最后 N 个
-        doc = self.db.chat_sessions.find_one(
-            {"_id": ObjectId(session_id)},
-            {"messages": {"$slice": -limit}} 
+        """获取最近 N 条聊天历史 (只读取尾部的桶，按序号正序返回)"""
+        if limit <= 0:
+            return []
+        # 最后一个桶可能未满，最多需要 ceil(limit / bucket_size) + 1 个桶
+        n_buckets = -(-limit // self.bucket_size) + 1
+        buckets = self.db.chat_messages.find(
+            {"session_id": ObjectId(session_id)},
+            {"messages": 1}
+        ).sort("bucket", DESCENDING).limit(n_buckets)
+
+        messages = [m for b in buckets for m in b.get("messages", [])]
+        messages.sort(key=lambda m: m.get("seq", 0))
+        return messages[-limit:]
+
+    # --- 异步接口 (FastAPI Handler 使用，Motor) ---
+
+    async def acreate_session(self, user_id: str, title: str = "新对话") -> str:
+        now = datetime.now()
+        res = await container.async_db.chat_sessions.insert_one({
+            "user_id": user_id,
+            "title": title,
+            "created_at": now,
+            "updated_at": now,
+            "is_active": True,
+            "latest_state": {},
+            "message_count": 0,
+            "next_seq": 0
+        })
+        return str(res.inserted_id)
+
+    async def aget_context(self, session_id: str, user_id: str, history_limit: int = 10) -> Optional[Dict]:
+        """
+        读取会话上下文 (服务端保存，客户端只需传 session_id)。
+        返回可直接并入 LangGraph 初始 State 的字段；会话不存在或不属于该用户时返回 None。
+        """
+        if not ObjectId.is_valid(session_id):
+            return None
+        adb = container.async_db
+        session = await adb.chat_sessions.find_one(
+            {"_id": ObjectId(session_id), "user_id": user_id, "is_active": True},
+            {"latest_state": 1}
+        )
+        if not session:
+            return None
+        latest = session.get("latest_state") or {}
+
+        # 最近历史 (只读尾部的桶；history_limit <= 0 时不取历史，注意 history[-0:] 会返回整个列表)
+        history = []
+        if history_limit > 0:
+            n_buckets = -(-history_limit // self.bucket_size) + 1
+            buckets = adb.chat_messages.find(
+                {"session_id": ObjectId(session_id)}, {"messages": 1}
+            ).sort("bucket", DESCENDING).limit(n_buckets)
+            history = [m async for b in buckets for m in b.get("messages", [])]
+            history.sort(key=lambda m: m.get("seq", 0))
+            history = history[-history_limit:]
+
+        return {
+            "messages": [{"role": m["role"], "content": m["content"]} for m in history],
+            "seen_candidate_ids": latest.get("seen_candidate_ids", []),
+            "final_candidates": latest.get("final_candidates", []), # 候选人引用 {id, nickname}
+            "last_target_person": latest.get("last_target_person"),
+            "last_search_criteria": latest.get("last_search_criteria")
+        }
+
+    async def asave_turn(self, session_id: str, user_input: str, final_state: Dict):
+        """一轮结束: 追加本轮的用户/AI 消息，消息落库后再写回状态快照与计数"""
+        adb = container.async_db
+        sid = ObjectId(session_id)
+        now = datetime.now()
+
+        # 1. 为两条消息预留序号 (并发的轮次各自拿到不相交的序号)
+        session = await adb.chat_sessions.find_one_and_update(
+            {"_id": sid},
+            self._reserve_seq_update(2),
+            projection={"next_seq": 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if not session:
+            return
+        first_seq = session["next_seq"] - 2
+        turn = [
+            {"role": "user", "content": user_input},
+            {"role": "ai", "content": final_state.get("reply", ""), "metadata": {"intent": final_state.get("intent")}}
+        ]
+        messages = [{"seq": first_seq + offset, "timestamp": now, "metadata": {}, **msg} for offset, msg in enumerate(turn)]
+
+        # 2. 写消息桶 (两条通常落在同一个桶，一次写入)
+        for flt, update in self._bucket_writes(sid, messages, now):
+            await adb.chat_messages.update_one(flt, update, upsert=True)
+
+        # 3. 最后更新快照与计数: 失败时最多留下序号空洞，不会出现计数与消息不符
+        await adb.chat_sessions.update_one(
+            {"_id": sid},
+            {
+                "$set": {"latest_state": self._build_state_subset(final_state), "updated_at": now},
+                "$inc": {"message_count": 2}
+            }
         )
-        if not doc or "messages" not in doc:
+
+    async def arehydrate_candidates(self, refs: List[Dict]) -> List[Dict]:
+        """按需把候选人引用回查为展示用的卡片数据 (一次 $in 批量查询)"""
+        ids = [ObjectId(r["id"]) for r in refs or [] if ObjectId.is_valid(r.get("id", ""))]
+        if not ids:
             return []
-        
-        return doc["messages"]
+        adb = container.async_db
+        basics = {
+            d["_id"]: d async for d in adb.users_basic.find(
+                {"_id": {"$in": ids}}, {"nickname": 1, "gender": 1, "birthday": 1, "city": 1}
+            )
+        }
+        summaries = {
+            d["user_id"]: d.get("user_summary", "") async for d in adb.profile.find(
+                {"user_id": {"$in": ids}}, {"user_id": 1, "user_summary": 1}
+            )
+        }
+        cards = []
+        for oid in ids: # 保持引用顺序
+            basic = basics.get(oid)
+            if not basic:
+                continue
+            cards.append({
+                "id": str(oid),
+                "nickname": basic.get("nickname", "未知"),
+                "gender": basic.get("gender", "unknown"),
+                "age": calc_age(basic.get("birthday")),
+                "city": basic.get("city", ""),
+                "summary": summaries.get(oid, ""),
+                "evidence": ""
+            })
+        return cards
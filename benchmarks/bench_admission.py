@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+准入控制过载压测 (不依赖外部服务)
+
+用法:
+    python benchmarks/bench_admission.py --capacity 16 --service 0.5 --load 0.5 1.0 2.0 4.0 --duration 20
+
+用一个模拟的 LLM 供应商代替图运行：同时处理的请求数超过 `capacity` 后，每个请求的耗时按比例变长
+(处理器共享模型，对应供应商限速/排队时的表现)。以开环方式按 `load * capacity / service` 的速率到达请求：
+  - off: 不做准入控制 (改造前)，所有请求直接进入"图"
+  - on:  AdmissionController(max_in_flight=capacity)，超出预计截止时间的请求立即 429
+输出各负载倍数下完成请求的 p50/p99 延迟、拒绝率和有效吞吐。
+"""
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+
+# 添加项目根目录到 Path
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from app.core.config import AdmissionConfig
+from app.services.admission import AdmissionController, AdmissionRejected
+
+
+class SimulatedProvider:
+    """并发超过 capacity 后按比例变慢的 LLM 供应商"""
+
+    def __init__(self, capacity: int, service: float):
+        self.capacity = capacity
+        self.service = service
+        self.active = 0
+
+    async def call(self):
+        self.active += 1
+        try:
+            remaining = self.service
+            while remaining > 0:
+                step = min(0.01, remaining)
+                await asyncio.sleep(step * max(1.0, self.active / self.capacity))
+                remaining -= step
+        finally:
+            self.active -= 1
+
+
+def pct(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))] if values else 0.0
+
+
+async def run_load(controller: AdmissionController, provider: SimulatedProvider, rate: float, duration: float, users: int):
+    rng = random.Random(42)
+    latencies, rejected = [], 0
+    tasks = []
+
+    async def request(user_id: str):
+        nonlocal rejected
+        start = time.perf_counter()
+        try:
+            async with controller.admit(user_id):
+                await provider.call()
+            latencies.append(time.perf_counter() - start)
+        except AdmissionRejected:
+            rejected += 1
+
+    start = time.perf_counter()
+    while time.perf_counter() - start < duration:
+        tasks.append(asyncio.create_task(request(f"user_{rng.randrange(users)}")))
+        await asyncio.sleep(rng.expovariate(rate))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    return len(tasks), latencies, rejected, elapsed
+
+
+async def bench(args):
+    print(f"\ncapacity={args.capacity}, service={args.service}s, deadline={args.deadline}s, duration={args.duration}s")
+    print(f"{'load':>5} | {'admission':>9} | {'offered':>7} | {'done':>6} | {'rejected':>8} | "
+          f"{'p50 s':>7} | {'p99 s':>7} | {'goodput/s':>9}")
+    print("-" * 80)
+    for load in args.load:
+        rate = load * args.capacity / args.service
+        for enabled in (False, True):
+            config = AdmissionConfig(
+                enabled=enabled, max_in_flight=args.capacity, queue_deadline_seconds=args.deadline,
+                initial_service_seconds=args.service, per_user_limit=1
+            )
+            controller = AdmissionController(config)
+            provider = SimulatedProvider(args.capacity, args.service)
+            offered, latencies, rejected, elapsed = await run_load(controller, provider, rate, args.duration, args.users)
+            print(f"{load:>5.1f} | {'on' if enabled else 'off':>9} | {offered:>7} | {len(latencies):>6} | "
+                  f"{rejected / offered:>7.1%} | {pct(latencies, 0.5):>7.2f} | {pct(latencies, 0.99):>7.2f} | "
+                  f"{len(latencies) / elapsed:>9.1f}")
+            if enabled:
+                snap = controller.snapshot()
+                print(f"{'':>5}   reasons: user_busy={snap['rejected_user_busy']} overloaded={snap['rejected_overloaded']} "
+                      f"queue_timeout={snap['rejected_queue_timeout']} queue_full={snap['rejected_queue_full']} "
+                      f"| queue wait p99={snap['queue_wait_p99']}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Admission control overload test")
+    parser.add_argument("--capacity", type=int, default=16, help="供应商并发能力 = max_in_flight")
+    parser.add_argument("--service", type=float, default=0.5, help="不拥塞时单次图运行耗时 (秒)")
+    parser.add_argument("--deadline", type=float, default=2.0, help="队列截止时间 (秒)")
+    parser.add_argument("--load", type=float, nargs="+", default=[0.5, 1.0, 2.0, 4.0], help="到达速率 / 服务能力")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--users", type=int, default=10000, help="模拟的不同用户数")
+    args = parser.parse_args()
+    asyncio.run(bench(args))
+
+
+if __name__ == "__main__":
+    main()
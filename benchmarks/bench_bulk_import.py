@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+批量导入吞吐基准 (需要本地 mongod)
+
+用法:
+    python benchmarks/bench_bulk_import.py --uri mongodb://localhost:27017 --sizes 10000 100000
+    python benchmarks/bench_bulk_import.py --sizes 100000 --prehashed   # 只测写库 (密码已是 bcrypt 哈希)
+
+对比:
+  - baseline: 逐个用户走注册 + 完善资料的写法 (内联 bcrypt + 4 次 insert_one)，只跑 `--baseline-sample` 个用户后按比例外推
+  - bulk:     BulkUserImporter (进程池 bcrypt + 有序 insert_many 批量写入，哈希与写库流水线重叠)
+输出各规模下的 rows/s、总耗时以及 bcrypt / 写库各自的耗时。运行结束后删除基准库。
+注意: bcrypt cost=12 时单核约 4 次/秒，100k 用户的总耗时基本由核数决定，可用 `--rounds` 调低观察写库部分。
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import bcrypt
+from pymongo import MongoClient
+
+# 添加项目根目录到 Path
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from app.core.config import settings
+from app.db.async_mongo_manager import AsyncMongoDBManager
+from app.db.mongo_indexes import aapply_indexes
+from app.services.bulk_import import BulkUserImporter, aiter_file
+
+CITIES = ["上海", "北京", "杭州", "深圳", "成都", "南京"]
+
+
+def write_ndjson(path: str, size: int, prehashed_value: str = None, dup_ratio: float = 0.001):
+    """生成合成会员数据，混入少量重复账号和非法行，用于观察逐行错误"""
+    rng = random.Random(size)
+    with open(path, "w", encoding="utf-8") as f:
+        for i in range(size):
+            if rng.random() < dup_ratio:
+                f.write("{not json}\n")
+                continue
+            row = {
+                "account": f"1{rng.randint(3, 9)}{i:09d}",
+                "nickname": f"会员{i}",
+                "gender": rng.choice(["male", "female"]),
+                "birthday": f"{rng.randint(1980, 2002)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+                "city": rng.choice(CITIES),
+                "height": rng.randint(150, 190),
+                "weight": rng.randint(42, 90),
+                "self_intro": "喜欢旅行和做饭",
+            }
+            if prehashed_value:
+                row["password_hash"] = prehashed_value
+            else:
+                row["password"] = f"pw-{i}"
+            f.write(json.dumps(row, ensure_ascii=False) + "\n")
+
+
+async def baseline(db: AsyncMongoDBManager, sample: int, rounds: int) -> float:
+    """改造前的逐个注册写法，返回 rows/s"""
+    start = time.perf_counter()
+    for i in range(sample):
+        pwd_hash = bcrypt.hashpw(f"pw-{i}".encode("utf-8"), bcrypt.gensalt(rounds=rounds)).decode("utf-8")
+        res = await db.users_basic.insert_one({"nickname": f"基线{i}", "gender": "female", "created_at": datetime.now()})
+        await db.users_states.insert_one({"user_id": res.inserted_id, "is_onboarding_completed": False})
+        await db.users_persona.insert_one({"user_id": res.inserted_id, "persona": {"occupation": "未知"}})
+        await db.users_auth.insert_one({"account": f"baseline_{i}", "password_hash": pwd_hash, "user_id": res.inserted_id})
+    return sample / (time.perf_counter() - start)
+
+
+async def bench(args):
+    db = AsyncMongoDBManager(args.uri, args.db)
+    await aapply_indexes(db)
+    prehashed = bcrypt.hashpw(b"bench", bcrypt.gensalt(rounds=args.rounds)).decode("utf-8") if args.prehashed else None
+    config = settings.bulk_import.model_copy(update={
+        "bcrypt_rounds": args.rounds, "batch_size": args.batch_size, "hash_workers": args.workers
+    })
+
+    base_rps = await baseline(db, args.baseline_sample, args.rounds)
+    print(f"\nbcrypt rounds={args.rounds}, workers={config.hash_workers or os.cpu_count()}, "
+          f"batch={config.batch_size}, prehashed={args.prehashed}")
+    print(f"{'size':>8} | {'mode':>8} | {'rows/s':>9} | {'total s':>9} | {'bcrypt s':>9} | {'write s':>8} | {'errors':>6}")
+    print("-" * 76)
+    for size in args.sizes:
+        print(f"{size:>8} | {'baseline':>8} | {base_rps:>9.1f} | {size / base_rps:>9.1f} | {'-':>9} | {'-':>8} | {'-':>6}")
+        with tempfile.NamedTemporaryFile("w", suffix=".ndjson", delete=False) as tmp:
+            path = tmp.name
+        try:
+            write_ndjson(path, size, prehashed)
+            for coll in ("users_basic", "users_states", "users_persona", "users_auth"):
+                await getattr(db, coll).delete_many({})
+            importer = BulkUserImporter(db, config)
+            try:
+                report = await importer.run(aiter_file(path))
+            finally:
+                importer.close()
+            print(f"{size:>8} | {'bulk':>8} | {report['rows_per_second']:>9.1f} | {report['elapsed_seconds']:>9.1f} | "
+                  f"{report['hash_seconds']:>9.1f} | {report['write_seconds']:>8.1f} | {report['failed']:>6}")
+        finally:
+            os.remove(path)
+    db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk user import throughput benchmark")
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="matchmaker_bench_import")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--rounds", type=int, default=12)
+    parser.add_argument("--workers", type=int, default=0, help="bcrypt 进程数，0 表示 CPU 核数")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--baseline-sample", type=int, default=100)
+    parser.add_argument("--prehashed", action="store_true", help="输入已带 password_hash，跳过 bcrypt")
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(bench(args))
+    finally:
+        MongoClient(args.uri).drop_database(args.db)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+Chroma 保留/压缩前后的检索延迟基准
+
+用法:
+    python benchmarks/bench_chroma_retention.py --users 200 --chunks-per-user 120 --queries 300
+
+在临时目录中构建合成语料 (onboarding / social / user_chat 三类，时间戳分布在最近 180 天)，
+分别测量保留任务执行前后带过滤条件的 similarity_search 延迟 (p50 / p95) 和集合大小。
+向量使用确定性哈希投影生成，不加载真实模型，只衡量索引规模对检索的影响。
+"""
+import argparse
+import hashlib
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# 添加项目根目录到 Path
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from app.core.config import ChromaRetentionConfig
+from app.db.chroma_manager import ChromaManager
+from app.services.chroma_retention import ChromaRetentionService
+
+
+class HashEmbeddings(Embeddings):
+    """文本 -> 确定性单位向量 (基准专用)"""
+
+    def __init__(self, dims: int = 384):
+        self.dims = dims
+
+    def _embed(self, text: str):
+        seed = int(hashlib.md5(text.encode("utf-8")).hexdigest()[:8], 16)
+        vec = np.random.default_rng(seed).standard_normal(self.dims)
+        return (vec / np.linalg.norm(vec)).tolist()
+
+    def embed_documents(self, texts):
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._embed(text)
+
+
+def build_corpus(chroma: ChromaManager, users: int, chunks_per_user: int, rng: random.Random):
+    now = datetime.now()
+    types = ["onboarding", "social", "user_chat"]
+    for u in range(users):
+        user_id = f"user_{u:05d}"
+        for dialogue_type in types:
+            n_msgs = chunks_per_user * 3 // len(types) + 2
+            start = now - timedelta(days=rng.randint(0, 180))
+            messages = [
+                {"role": "user" if i % 2 == 0 else "ai",
+                 "content": f"{dialogue_type} 消息 {i} 来自 {user_id}: {rng.random():.6f}",
+                 "timestamp": start + timedelta(hours=i)}
+                for i in range(n_msgs)
+            ]
+            # 每个窗口使用自己的首条消息时间戳，模拟长期累积的对话
+            chroma.add_conversation_chunks(user_id, messages, dialogue_type, window_size=5, overlap=2, batch_size=256)
+    return [f"user_{u:05d}" for u in range(users)]
+
+
+def measure(chroma: ChromaManager, user_ids, queries: int, rng: random.Random):
+    latencies = []
+    for i in range(queries):
+        user_id = rng.choice(user_ids)
+        start = time.perf_counter()
+        chroma.retrieve_related_context(f"兴趣爱好 {i}", user_id=user_id, k=5,
+                                        filter={"dialogue_type": {"$in": ["social", "user_chat"]}})
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        "p50_ms": statistics.median(latencies),
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))],
+        "size": chroma.vector_db._collection.count()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chroma retention latency benchmark")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--chunks-per-user", type=int, default=120)
+    parser.add_argument("--queries", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as tmp:
+        chroma = ChromaManager(tmp, "retention_bench", embedding_function=HashEmbeddings())
+        print("⏳ 构建合成语料 ...")
+        user_ids = build_corpus(chroma, args.users, args.chunks_per_user, rng)
+
+        before = measure(chroma, user_ids, args.queries, rng)
+
+        service = ChromaRetentionService(chroma, ChromaRetentionConfig(dry_run=False))
+        start = time.perf_counter()
+        service.run(dry_run=False)
+        elapsed = time.perf_counter() - start
+
+        after = measure(chroma, user_ids, args.queries, rng)
+
+    print(f"\n⏱️ 保留任务耗时: {elapsed:.2f}s")
+    print(f"{'':>8} | {'chunks':>8} | {'p50 ms':>8} | {'p95 ms':>8}")
+    print("-" * 42)
+    for name, r in (("before", before), ("after", after)):
+        print(f"{name:>8} | {r['size']:>8} | {r['p50_ms']:>8.2f} | {r['p95_ms']:>8.2f}")
+
+
+if __name__ == "__main__":
+    main()
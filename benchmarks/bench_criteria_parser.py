@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""
+规则解析 vs LLM 解析 (filter_chain) 的准确率与命中率
+
+用法:
+    python benchmarks/bench_criteria_parser.py                       # 内置的小样本 (人工按 filter_chain 规则标注)
+    python benchmarks/bench_criteria_parser.py --log logs/criteria.jsonl --thresholds 0.6 0.8 1.0
+
+日志来自线上: 配置 `criteria_parser.log_path` 后，每次走 LLM 的解析都会追加一行
+{user_input, user_basic, llm, rule, confidence, llm_seconds}。
+想覆盖全部流量 (包括规则本可以命中的) 时，临时设置 `criteria_parser.enabled: false` 采集一段时间。
+
+对每个阈值输出:
+  - hit:      置信度 >= 阈值、会跳过 LLM 的比例
+  - hard_acc: 命中样本中硬性条件 (城市/身高/年龄/BMI) 与 LLM 完全一致的比例
+  - kw_acc:   命中样本中关键词集合一致的比例 (忽略空格切分差异)
+  - saved s:  命中样本原本花在 LLM 上的时间 (日志中有 llm_seconds 时)
+以及规则解析自身的耗时和默认阈值下逐字段的不一致计数。
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from collections import Counter
+from datetime import datetime
+
+# 添加项目根目录到 Path
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from app.core.config import settings
+from app.core.utils.cal_utils import calc_age
+from app.services.ai.workflows.recommendation.criteria_parser import parse_criteria
+
+HARD_FIELDS = ["city", "height_min", "height_max", "age_min", "age_max", "bmi_min", "bmi_max"]
+
+_USER = {"gender": "female", "birthday": "1996-06-01 00:00:00", "height": 165, "weight": 52, "city": "上海"}
+_YEAR = datetime.now().year
+# (需求, 期望的 FilterOutput 字段)；按 filter_chain 提示词中的规则人工标注
+SAMPLES = [
+    ("杭州的，1米75以上，25到30岁", {"city": ["杭州"], "height_min": 175, "age_min": 25, "age_max": 30, "keywords": ""}),
+    ("同城985程序员", {"city": ["上海"], "keywords": "985 程序员"}),
+    ("找个比我大的，一米八以上，不抽烟", {"height_min": 180, "age_min": calc_age(datetime(1996, 6, 1)), "keywords": "不抽烟"}),
+    ("上海或杭州，微胖的", {"city": ["上海", "杭州"], "bmi_min": 24, "bmi_max": 28, "keywords": ""}),
+    ("90后，身材匀称，喜欢滑雪", {"age_min": _YEAR - 1999, "age_max": _YEAR - 1990, "bmi_min": 18.5, "bmi_max": 24,
+                             "keywords": "喜欢滑雪"}),
+    ("想找个温柔体贴的", {"keywords": "温柔体贴"}),
+    ("随便", {"keywords": ""}),
+    ("170到180cm，30岁以下", {"height_min": 170, "height_max": 180, "age_max": 30, "keywords": ""}),
+    ("北京的研究生，性格开朗", {"city": ["北京"], "keywords": "研究生 性格开朗"}),
+    ("我要找个工作稳定的独生女，父母有退休金，不抽烟", {"keywords": "工作稳定 独生女 父母有退休金 不抽烟"}),
+    ("很瘦的，1.8米以上", {"bmi_max": 18.5, "height_min": 180, "keywords": ""}),
+    ("江浙沪的医生", {"city": ["上海", "杭州", "南京", "苏州"], "keywords": "医生"}),
+    ("不要上海的，25到30", {"age_min": 25, "age_max": 30, "keywords": ""}),
+    ("深圳做金融的，35岁以内，有房", {"city": ["深圳"], "age_max": 35, "keywords": "金融 有房"}),
+]
+
+# 含否定的条件: 规则不取反、不把否定词留在关键词里，置信度必须低于阈值 (交给 LLM)
+NEGATION_SAMPLES = [
+    "不要太胖", "不能太胖", "千万别胖", "不是很胖就行", "别太瘦", "不喜欢太瘦的",
+    "不要90后", "不要35岁以上的", "不要比我小的", "不要1米6以下的",
+    "不要程序员", "不要离异的", "不要上海的", "南京的，不要太胖",
+]
+_NEGATORS = ("不要", "不能", "别", "不是", "不喜欢", "不找")
+
+
+def builtin_records():
+    for text, expected in SAMPLES:
+        yield {"user_input": text, "user_basic": _USER, "llm": expected, "llm_seconds": None}
+
+
+def load_records(path):
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _user_basic(raw):
+    basic = dict(raw or {})
+    if isinstance(basic.get("birthday"), str):
+        try:
+            basic["birthday"] = datetime.fromisoformat(basic["birthday"])
+        except ValueError:
+            basic["birthday"] = None
+    return basic
+
+
+def _same(field, a, b):
+    if field == "city":
+        return set(a or []) == set(b or [])
+    if a is None or b is None:
+        return a is None and b is None
+    return abs(float(a) - float(b)) < 0.01
+
+
+def _keyword_set(s):
+    return set((s or "").split())
+
+
+def evaluate(records, thresholds, default_threshold):
+    rows = []
+    parse_times = []
+    for rec in records:
+        start = time.perf_counter()
+        rule, confidence = parse_criteria(rec["user_input"], _user_basic(rec.get("user_basic")))
+        parse_times.append(time.perf_counter() - start)
+        llm = rec["llm"]
+        rule = rule.model_dump()
+        diffs = [f for f in HARD_FIELDS if not _same(f, rule.get(f), llm.get(f))]
+        kw_ok = _keyword_set(rule.get("keywords")) == _keyword_set(llm.get("keywords")) \
+            or "".join(_keyword_set(rule.get("keywords"))) == "".join(_keyword_set(llm.get("keywords")))
+        rows.append((rec, confidence, diffs, kw_ok))
+
+    total = len(rows)
+    print(f"\nrecords={total}")
+    print(f"{'threshold':>9} | {'hit':>6} | {'hard_acc':>8} | {'kw_acc':>7} | {'all_acc':>7} | {'saved s':>8}")
+    print("-" * 62)
+    for thr in thresholds:
+        hits = [r for r in rows if r[1] >= thr]
+        n = len(hits) or 1
+        saved = sum(r[0].get("llm_seconds") or 0 for r in hits)
+        print(f"{thr:>9.2f} | {len(hits) / total:>6.1%} | {sum(not r[2] for r in hits) / n:>8.1%} | "
+              f"{sum(r[3] for r in hits) / n:>7.1%} | {sum(not r[2] and r[3] for r in hits) / n:>7.1%} | {saved:>8.1f}")
+
+    parse_times.sort()
+    print(f"\nrule parse: mean={sum(parse_times) / total * 1e6:.0f}us "
+          f"p99={parse_times[int(0.99 * (total - 1))] * 1e6:.0f}us")
+
+    mismatches = Counter()
+    print(f"\nmismatches at threshold {default_threshold}:")
+    for rec, confidence, diffs, kw_ok in rows:
+        if confidence < default_threshold or (not diffs and kw_ok):
+            continue
+        mismatches.update(diffs + ([] if kw_ok else ["keywords"]))
+        print(f"  [{confidence:.2f}] {rec['user_input']}  -> {', '.join(diffs + ([] if kw_ok else ['keywords']))}")
+    if mismatches:
+        print("  by field: " + ", ".join(f"{k}={v}" for k, v in mismatches.most_common()))
+
+
+def check_negations(threshold):
+    """否定样本: 置信度应低于阈值，且关键词中不残留否定词"""
+    failed = 0
+    for text in NEGATION_SAMPLES:
+        rule, confidence = parse_criteria(text, _user_basic(_USER))
+        leaked = [n for n in _NEGATORS if n in (rule.keywords or "")]
+        if confidence >= threshold or leaked:
+            failed += 1
+            print(f"  ❌ [{confidence:.2f}] {text} -> {rule.model_dump(exclude_none=True)}")
+    print(f"\nnegation: {len(NEGATION_SAMPLES) - failed}/{len(NEGATION_SAMPLES)} deferred to LLM at threshold {threshold}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Rule-based criteria parser vs LLM filter_chain")
+    parser.add_argument("--log", help="criteria_parser.log_path 产生的 JSONL，不指定则使用内置样本")
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.5, 0.6, 0.7, 0.8, 0.9, 1.0])
+    args = parser.parse_args()
+
+    records = list(load_records(args.log)) if args.log else list(builtin_records())
+    if not records:
+        print("no records")
+        return
+    evaluate(records, args.thresholds, settings.criteria_parser.min_confidence)
+    if not args.log:
+        check_negations(settings.criteria_parser.min_confidence)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+"""
+Embedding 后端吞吐基准 (torch / onnx / onnx_int8)
+
+用法:
+    python benchmarks/bench_embedding_backends.py --model BAAI/bge-small-zh-v1.5 --backends torch onnx onnx_int8
+
+输出每个后端在不同 batch size 下的 texts/sec、单条 query 延迟，以及相对 torch 基线的最小余弦一致性。
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+
+# 添加项目根目录到 Path
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from app.services.embedding_service import SAMPLE_TEXTS, EmbeddingService, cosine_similarity
+
+
+def build_corpus(n: int):
+    base = SAMPLE_TEXTS
+    return [f"{base[i % len(base)]} #{i}" for i in range(n)]
+
+
+def bench_backend(service: EmbeddingService, corpus, batch_sizes, query_rounds: int):
+    results = {}
+    for bs in batch_sizes:
+        service.batch_size = bs
+        start = time.perf_counter()
+        service.embed_documents(corpus)
+        elapsed = time.perf_counter() - start
+        results[f"batch={bs}"] = len(corpus) / elapsed
+
+    latencies = []
+    for i in range(query_rounds):
+        start = time.perf_counter()
+        service.embed_query(corpus[i % len(corpus)])
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    results["query_p50_ms"] = statistics.median(latencies)
+    results["query_p95_ms"] = latencies[int(len(latencies) * 0.95) - 1]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--model", default="BAAI/bge-small-zh-v1.5")
+    parser.add_argument("--backends", nargs="+", default=["torch", "onnx", "onnx_int8"])
+    parser.add_argument("--cache-dir", default=os.path.join(project_root, "models", "onnx"))
+    parser.add_argument("--corpus-size", type=int, default=512)
+    parser.add_argument("--batch-sizes", nargs="+", type=int, default=[1, 8, 32])
+    parser.add_argument("--query-rounds", type=int, default=200)
+    args = parser.parse_args()
+
+    corpus = build_corpus(args.corpus_size)
+    baseline_vectors = None
+
+    print(f"模型: {args.model} | 语料: {len(corpus)} 条")
+    print("-" * 80)
+    for backend in args.backends:
+        service = EmbeddingService(args.model, backend=backend, cache_dir=args.cache_dir)
+        load_s = service.warmup()
+        results = bench_backend(service, corpus, args.batch_sizes, args.query_rounds)
+
+        vectors = service.embed_documents(SAMPLE_TEXTS)
+        if backend == "torch":
+            baseline_vectors = vectors
+        parity = (min(cosine_similarity(a, b) for a, b in zip(baseline_vectors, vectors))
+                  if baseline_vectors else float("nan"))
+
+        throughput = " | ".join(f"{k}: {v:8.1f}/s" for k, v in results.items() if k.startswith("batch"))
+        print(f"[{backend:<10}] load+warmup {load_s:6.2f}s | {throughput} | "
+              f"query p50 {results['query_p50_ms']:.1f}ms p95 {results['query_p95_ms']:.1f}ms | "
+              f"min cos vs torch {parity:.5f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Embedding 跨请求微批压测
+
+用法:
+    python benchmarks/bench_embedding_microbatch.py --backend onnx --concurrency 1 16 64 --requests 512
+
+模拟 N 个并发调用方各自 `aembed_query` 一条短 query，对比:
+  - unbatched: 每条 query 单独 to_thread 执行 (batch=1)
+  - batched:   经 EmbeddingMicroBatcher 合并
+输出 embeddings/sec、平均/ p99 延迟，以及平均批大小。
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+# 添加项目根目录到 Path
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from app.services.embedding_service import SAMPLE_TEXTS, EmbeddingService
+
+
+def percentile(values, p: float) -> float:
+    ordered = sorted(values)
+    idx = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[idx]
+
+
+async def run_load(service: EmbeddingService, concurrency: int, total: int, batched: bool):
+    service.microbatch_enabled = batched
+    service._batcher = None # 每轮重置统计
+    queue = asyncio.Queue()
+    for i in range(total):
+        queue.put_nowait(f"{SAMPLE_TEXTS[i % len(SAMPLE_TEXTS)]} #{i}")
+    latencies = []
+
+    async def caller():
+        while True:
+            try:
+                text = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            start = time.perf_counter()
+            await service.aembed_query(text)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[caller() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    avg_batch = 1.0
+    if batched and service._batcher and service._batcher.batches:
+        avg_batch = service._batcher.items / service._batcher.batches
+    return {
+        "eps": total / elapsed,
+        "mean_ms": statistics.mean(latencies),
+        "p99_ms": percentile(latencies, 99),
+        "avg_batch": avg_batch
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Embedding micro-batching load test")
+    parser.add_argument("--model", default="BAAI/bge-small-zh-v1.5")
+    parser.add_argument("--backend", default="torch", choices=["torch", "onnx", "onnx_int8"])
+    parser.add_argument("--cache-dir", default=os.path.join(project_root, "models", "onnx"))
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--requests", type=int, default=512)
+    parser.add_argument("--max-wait-ms", type=float, default=5.0)
+    parser.add_argument("--max-batch-size", type=int, default=32)
+    args = parser.parse_args()
+
+    service = EmbeddingService(
+        args.model, backend=args.backend, cache_dir=args.cache_dir,
+        microbatch_max_wait_ms=args.max_wait_ms, microbatch_max_size=args.max_batch_size
+    )
+    print(f"⏳ 预热 {args.backend} ... {service.warmup():.2f}s")
+
+    print(f"\n{'concurrency':>11} | {'mode':>9} | {'emb/s':>8} | {'mean ms':>8} | {'p99 ms':>8} | {'avg batch':>9}")
+    print("-" * 70)
+    for c in args.concurrency:
+        for batched in (False, True):
+            r = asyncio.run(run_load(service, c, args.requests, batched))
+            mode = "batched" if batched else "unbatched"
+            print(f"{c:>11} | {mode:>9} | {r['eps']:>8.1f} | {r['mean_ms']:>8.2f} | {r['p99_ms']:>8.2f} | {r['avg_batch']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
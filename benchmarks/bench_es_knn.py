@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""
+ES 向量检索召回率 / 延迟基准: 固定参数 vs 自适应 (需要本地 Elasticsearch 8.x)
+
+用法:
+    python benchmarks/bench_es_knn.py --url http://localhost:9200 --docs 50000 --dims 128 --queries 50
+
+在独立的基准索引中写入合成用户 (聚簇的随机向量 + 城市/性别)，对不同选择度的过滤条件比较:
+  - fixed:    改造前的参数 (k = top_k*2, num_candidates = 100，一律近似 KNN)
+  - adaptive: ESManager.vector_search (小集合 script_score 精确打分，大集合按选择度放大 num_candidates)
+以 NumPy 在过滤后的文档上暴力计算的余弦 Top-k 为真值，输出 recall@k 与 p50/p99 延迟。运行结束后删除基准索引。
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+from elasticsearch import Elasticsearch, helpers
+
+# 添加项目根目录到 Path
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from app.db.es_manager import ESManager
+
+# 城市分布有长尾，用来制造不同选择度的过滤条件
+CITIES = ["上海", "北京", "杭州", "深圳", "成都", "南京", "武汉", "西安", "厦门", "拉萨"]
+CITY_WEIGHTS = [0.3, 0.2, 0.15, 0.1, 0.08, 0.07, 0.05, 0.03, 0.015, 0.005]
+
+
+def make_data(n: int, dims: int, seed: int = 7):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(32, dims))
+    vectors = centers[rng.integers(0, len(centers), n)] + rng.normal(scale=0.6, size=(n, dims))
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    cities = rng.choice(CITIES, size=n, p=CITY_WEIGHTS)
+    genders = rng.choice(["male", "female"], size=n)
+    return vectors.astype(np.float32), cities, genders, centers
+
+
+def build_index(es: ESManager, vectors, cities, genders):
+    client = es.client
+    if client.indices.exists(index=es.index_name):
+        client.indices.delete(index=es.index_name)
+    client.indices.create(index=es.index_name, mappings={"properties": {
+        "user_id": {"type": "keyword"},
+        "gender": {"type": "keyword"},
+        "city": {"type": "keyword"},
+        "profile_vector": {"type": "dense_vector", "dims": vectors.shape[1], "index": True, "similarity": "cosine"},
+    }})
+    actions = (
+        {"_index": es.index_name, "_id": str(i), "_source": {
+            "user_id": str(i), "gender": genders[i], "city": cities[i], "profile_vector": vectors[i].tolist()}}
+        for i in range(len(vectors))
+    )
+    helpers.bulk(client, actions, chunk_size=2000, request_timeout=120)
+    client.indices.refresh(index=es.index_name)
+    client.indices.forcemerge(index=es.index_name, max_num_segments=1, request_timeout=600)
+
+
+def scenarios(n: int, cities, genders, rng):
+    ids = np.arange(n)
+    for size in (20, 200, 2000):
+        chosen = rng.choice(ids, size=size, replace=False)
+        yield f"ids_{size}", {"user_id": [str(i) for i in chosen]}, chosen
+    for city in ("拉萨", "厦门", "上海"):
+        yield f"city_{city}", {"city": city}, ids[cities == city]
+    yield "gender", {"gender": "female"}, ids[genders == "female"]
+    yield "none", None, ids
+
+
+def fixed_search(es: ESManager, vector, filter_query, k):
+    res = es.client.search(index=es.index_name, knn={
+        "field": "profile_vector", "query_vector": vector, "k": k, "num_candidates": 100, "filter": filter_query
+    }, size=k, _source=["user_id"])
+    return res["hits"]["hits"]
+
+
+def pct(values, q):
+    values = sorted(values)
+    return values[int(q * (len(values) - 1))] if values else 0.0
+
+
+def bench(args):
+    es = ESManager()
+    es.client = Elasticsearch(hosts=[args.url], request_timeout=120)
+    es.index_name = args.index
+    es._doc_count = None
+
+    vectors, cities, genders, centers = make_data(args.docs, args.dims)
+    print(f"indexing {args.docs} docs (dims={args.dims})...")
+    build_index(es, vectors, cities, genders)
+
+    rng = np.random.default_rng(11)
+    queries = centers[rng.integers(0, len(centers), args.queries)] + rng.normal(scale=0.6, size=(args.queries, args.dims))
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    k = args.top_k * 2 # 与 hybrid_search 一致
+
+    print(f"\nk={k}, exact_max_docs={es.knn_config.exact_max_docs}, factor={es.knn_config.num_candidates_factor}")
+    print(f"{'scenario':>12} | {'filtered':>8} | {'mode':>8} | {'num_cand':>8} | "
+          f"{'recall':>7} | {'p50 ms':>7} | {'p99 ms':>7}")
+    print("-" * 78)
+    for name, filters, allowed in scenarios(args.docs, cities, genders, rng):
+        _, _, filter_query = es.build_filter(filters)
+        filtered_size = es._filtered_size(filters, None, filter_query)
+        plan = es.knn_plan(k, filtered_size)
+        results = {"fixed": ([], []), "adaptive": ([], [])}
+        for q in queries:
+            sims = vectors[allowed] @ q.astype(np.float32)
+            truth = {str(i) for i in allowed[np.argsort(-sims)[:k]]}
+            for mode in results:
+                start = time.perf_counter()
+                if mode == "fixed":
+                    hits = fixed_search(es, q.tolist(), filter_query, k)
+                else:
+                    hits, _ = es.vector_search(q.tolist(), filter_query, k, es._filtered_size(filters, None, filter_query))
+                results[mode][1].append((time.perf_counter() - start) * 1000)
+                got = {h["_source"]["user_id"] for h in hits}
+                results[mode][0].append(len(got & truth) / max(len(truth), 1))
+        for mode, (recalls, latencies) in results.items():
+            shown_mode = "approx" if mode == "fixed" else plan["mode"]
+            num_cand = 100 if mode == "fixed" else plan.get("num_candidates", "-")
+            print(f"{name:>12} | {len(allowed):>8} | {shown_mode:>8} | {num_cand:>8} | "
+                  f"{np.mean(recalls):>7.3f} | {pct(latencies, 0.5):>7.1f} | {pct(latencies, 0.99):>7.1f}  ({mode})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="ES vector search recall/latency: fixed vs adaptive KNN")
+    parser.add_argument("--url", default="http://localhost:9200")
+    parser.add_argument("--index", default="bench_knn_adaptive")
+    parser.add_argument("--docs", type=int, default=50000)
+    parser.add_argument("--dims", type=int, default=128)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--top-k", type=int, default=50, help="hybrid_search 的 top_k (向量检索取 2 倍)")
+    args = parser.parse_args()
+    try:
+        bench(args)
+    finally:
+        Elasticsearch(hosts=[args.url]).indices.delete(index=args.index, ignore_unavailable=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+同步 PyMongo vs 异步 Motor 的并发吞吐基准 (需要本地 mongod)
+
+用法:
+    python benchmarks/bench_mongo_async.py --uri mongodb://localhost:27017 --concurrency 1 16 64 --requests 2000
+
+在独立的基准库中写入合成用户，模拟 `GET /users/me` 的访问模式 (users_basic + users_states 两次点查)：
+  - before: 在 async handler 里直接调用同步 PyMongo (阻塞事件循环，当前的写法)
+  - after:  通过 AsyncMongoDBManager (Motor) await
+输出各并发度下的 requests/sec 与 p95 延迟。运行结束后删除基准库。
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+from pymongo import MongoClient
+
+# 添加项目根目录到 Path
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if project_root not in sys.path:
+    sys.path.append(project_root)
+
+from app.db.async_mongo_manager import AsyncMongoDBManager
+from app.db.mongo_manager import MongoDBManager
+
+
+def seed(uri: str, db_name: str, users: int):
+    db = MongoClient(uri)[db_name]
+    db.users_basic.drop()
+    db.users_states.drop()
+    ids = db.users_basic.insert_many([
+        {"nickname": f"bench_{i}", "gender": "female", "city": "上海", "created_at": datetime.now()}
+        for i in range(users)
+    ]).inserted_ids
+    db.users_states.insert_many([{"user_id": uid, "is_onboarding_completed": True} for uid in ids])
+    db.users_states.create_index("user_id")
+    return ids
+
+
+async def run_load(handler, user_ids, concurrency: int, total: int):
+    latencies = []
+    counter = iter(range(total))
+
+    async def worker():
+        for i in counter:
+            start = time.perf_counter()
+            await handler(user_ids[i % len(user_ids)])
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    latencies.sort()
+    return total / elapsed, latencies[int(0.95 * (len(latencies) - 1))], statistics.mean(latencies)
+
+
+async def bench(args, user_ids):
+    sync_db = MongoDBManager(args.uri, args.db)
+    async_db = AsyncMongoDBManager(args.uri, args.db)
+
+    async def sync_handler(uid):
+        # 与改造前的 handler 一致：在协程里直接调用阻塞驱动
+        sync_db.users_basic.find_one({"_id": uid})
+        sync_db.users_states.find_one({"user_id": uid})
+
+    async def async_handler(uid):
+        await async_db.users_basic.find_one({"_id": uid})
+        await async_db.users_states.find_one({"user_id": uid})
+
+    print(f"\n{'concurrency':>11} | {'driver':>7} | {'req/s':>9} | {'mean ms':>8} | {'p95 ms':>8}")
+    print("-" * 56)
+    for c in args.concurrency:
+        for name, handler in (("pymongo", sync_handler), ("motor", async_handler)):
+            await handler(user_ids[0]) # 预热连接
+            rps, p95, mean = await run_load(handler, user_ids, c, args.requests)
+            print(f"{c:>11} | {name:>7} | {rps:>9.1f} | {mean:>8.2f} | {p95:>8.2f}")
+    async_db.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PyMongo vs Motor concurrency benchmark")
+    parser.add_argument("--uri", default="mongodb://localhost:27017")
+    parser.add_argument("--db", default="matchmaker_bench_async")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64])
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    user_ids = seed(args.uri, args.db, args.users)
+    try:
+        asyncio.run(bench(args, user_ids))
+    finally:
+        MongoClient(args.uri).drop_database(args.db)
+
+
+if __name__ == "__main__":
+    main()